@@ -56,3 +56,39 @@ def get_node_services() -> typing.Generator[typing.Tuple[str, int, str], None, N
 
 
 DB_URI = os.environ.get("ESCRIBA_DB_URI", ":memory:")
+# Read-only connections kept open for the dashboard.
+DB_POOL_SIZE = int(os.environ.get("ESCRIBA_DB_POOL_SIZE", "8"))
+DATA_DIR = os.environ.get(
+    "ESCRIBA_DATA_DIR",
+    os.path.join(
+        os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"),
+        "escriba",
+    ),
+)
+ARTIFACT_DIR = os.environ.get(
+    "ESCRIBA_ARTIFACT_DIR", os.path.join(DATA_DIR, "artifact")
+)
+WARC_DIR = os.environ.get("ESCRIBA_WARC_DIR", os.path.join(DATA_DIR, "warc"))
+CDXJ_DIR = os.environ.get("ESCRIBA_CDXJ_DIR", os.path.join(DATA_DIR, "cdxj"))
+# Bloom filter of the known URLs, which lets ingestion skip looking up the
+# URLs that are surely new. Past its capacity the error rate only grows.
+URL_FILTER_PATH = os.environ.get(
+    "ESCRIBA_URL_FILTER_PATH", os.path.join(DATA_DIR, "url.bloom")
+)
+URL_FILTER_CAPACITY = int(os.environ.get("ESCRIBA_URL_FILTER_CAPACITY", "20000000"))
+URL_FILTER_ERROR_RATE = float(os.environ.get("ESCRIBA_URL_FILTER_ERROR_RATE", "0.01"))
+# Politeness towards every host: mean and burst requests per second, and
+# how many snapshots of the same host may run at once.
+HOST_RATE = float(os.environ.get("ESCRIBA_HOST_RATE", "1"))
+HOST_BURST = float(os.environ.get("ESCRIBA_HOST_BURST", "4"))
+HOST_CONCURRENCY = int(os.environ.get("ESCRIBA_HOST_CONCURRENCY", "2"))
+# Dispatch the snapshots expected to finish sooner first, within the fair
+# share of every transfer.
+SHORTEST_FIRST = os.environ.get("ESCRIBA_SHORTEST_FIRST", "") not in ("", "0")
+# Recaptures of HTML whose simhash differs in at most these many bits from
+# the previous capture are kept as unchanged. Unset means exact matches only.
+SIMHASH_DISTANCE = (
+    int(os.environ["ESCRIBA_SIMHASH_DISTANCE"])
+    if "ESCRIBA_SIMHASH_DISTANCE" in os.environ
+    else None
+)
@@ -17,7 +17,11 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
 import escriba.daemon.agent as agent
+import escriba.daemon.dispatch as dispatch
+import escriba.daemon.duration as duration
 import escriba.daemon.internet_archive as internet_archive
+import escriba.daemon.maintenance as maintenance
+import escriba.daemon.recurrence as recurrence
 import escriba.daemon.scheduler as scheduler
 import escriba.daemon.snapshot_job as snapshot_job
 import escriba.daemon.title as title
@@ -17,16 +17,160 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
 import asyncio
+import contextlib
+import dataclasses
+import functools
+import http.client
 import json
 import logging
+import os
+import resource
+import signal
+import time
+import typing
 
 import escriba.config as config
 import escriba.messaging as messaging
+import escriba.storage as storage
 
 logger = logging.getLogger(__name__)
 
+# Seconds between attempts to reap a child that closed its output pipes.
+WAIT_POLL_INTERVAL = 0.01
+# Services configured with this program run inside the agent process.
+BUILTIN = "builtin"
+
+
+async def _read_pipe(fd: int) -> bytes:
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    pipe = os.fdopen(fd, "rb", buffering=0)
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe
+    )
+    try:
+        return await reader.read()
+    finally:
+        transport.close()
+
+
+async def _wait(pid: int) -> typing.Tuple[int, resource.struct_rusage]:
+    # The asyncio child watcher reaps children with os.waitpid, which
+    # throws away their resource usage. We reap our own children instead.
+    while True:
+        waited_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+        if waited_pid:
+            return os.waitstatus_to_exitcode(status), rusage
+        await asyncio.sleep(WAIT_POLL_INTERVAL)
+
+
+async def _spawn(
+    program: str, *args: str, timeout: float
+) -> typing.Tuple[int, bytes, bytes, typing.Dict[str, typing.Any]]:
+    """Execute program and account for the resources its process used.
+
+    The program runs in a session of its own, which is killed as a whole
+    once it runs past timeout seconds, browsers and all.
+    """
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    started = time.monotonic()
+    try:
+        pid = os.posix_spawnp(
+            program,
+            [program, *args],
+            os.environ,
+            file_actions=[
+                (os.POSIX_SPAWN_DUP2, stdout_w, 1),
+                (os.POSIX_SPAWN_DUP2, stderr_w, 2),
+            ],
+            setsid=True,
+        )
+    except Exception:
+        for fd in (stdout_r, stderr_r):
+            os.close(fd)
+        raise
+    finally:
+        for fd in (stdout_w, stderr_w):
+            os.close(fd)
+
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            asyncio.gather(_read_pipe(stdout_r), _read_pipe(stderr_r)), timeout
+        )
+    except TimeoutError:
+        logger.warning("Killing [ %s %s ] after %g seconds.", program, args, timeout)
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(pid, signal.SIGKILL)
+        stdout, stderr = b"", f"Killed after {timeout:g} seconds.".encode()
+    returncode, rusage = await _wait(pid)
+    usage = dict(
+        wall_time=time.monotonic() - started,
+        user_time=rusage.ru_utime,
+        system_time=rusage.ru_stime,
+        # Linux reports the maximum resident set size in kilobytes.
+        max_rss=rusage.ru_maxrss * 1024,
+        stdout_size=len(stdout),
+        stderr_size=len(stderr),
+    )
+    return returncode, stdout, stderr, usage
+
+
+def _capture_warc(
+    writer: storage.warc.Writer, url: str, timeout: float
+) -> typing.Tuple[int, bytes, bytes, typing.Dict[str, typing.Any]]:
+    started = time.monotonic()
+    before = resource.getrusage(resource.RUSAGE_THREAD)
+    try:
+        locations = storage.warc.capture(url, writer, timeout=timeout)
+    except (OSError, http.client.HTTPException) as exc:
+        logger.info("Could not capture %s. %s", url, exc)
+        returncode, stdout, stderr = os.EX_TEMPFAIL, b"", str(exc).encode()
+    except ValueError as exc:
+        # Unsupported URLs and malformed responses fail the same way again.
+        logger.info("Could not capture %s. %s", url, exc)
+        returncode, stdout, stderr = 1, b"", str(exc).encode()
+    else:
+        returncode, stderr = 0, b""
+        stdout = "".join(
+            json.dumps(dataclasses.asdict(location)) + "\n" for location in locations
+        ).encode()
+    after = resource.getrusage(resource.RUSAGE_THREAD)
+    usage = dict(
+        wall_time=time.monotonic() - started,
+        user_time=after.ru_utime - before.ru_utime,
+        system_time=after.ru_stime - before.ru_stime,
+        # A thread has no memory of its own, so report the whole agent.
+        max_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        stdout_size=len(stdout),
+        stderr_size=len(stderr),
+    )
+    return returncode, stdout, stderr, usage
+
+
+def _builtin(service: str) -> typing.Callable[..., typing.Awaitable]:
+    """Handle the service inside the agent, avoiding a process per request."""
+    if service == "warc":
+        # Every listener appends to its own files, so no locking is needed.
+        writer = storage.warc.Writer(config.WARC_DIR)
+
+        async def execute(url: str, *_, timeout: float):
+            # A thread cannot be killed, so the deadline bounds every socket
+            # operation instead.
+            timeout = min(timeout, storage.warc.TIMEOUT)
+            return await asyncio.to_thread(_capture_warc, writer, url, timeout)
+
+        return execute
+
+    raise ValueError(f"There is no builtin program for service [ {service} ]")
+
 
 async def listener(program: str, **kwargs):
+    if program == BUILTIN:
+        execute = _builtin(kwargs["service"])
+    else:
+        execute = functools.partial(_spawn, program)
+
     sock = messaging.worker.Worker(**kwargs)
     await sock.connect()
     reply = None
@@ -37,16 +181,24 @@ async def listener(program: str, **kwargs):
         if request is None:
             break  # Worker was interrupted
 
-        proc = await asyncio.create_subprocess_exec(
-            program,
-            *request,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
+        options, *args = request
+        options = json.loads(options)
+        if time.time() > options["expires"]:
+            # The client gave up on it already and may have sent it again.
+            logger.info("Dropping request expired in the queue: %s", args)
+            reply = [
+                json.dumps(dict(rc=-signal.SIGKILL, help="Request expired.")),
+                b"",
+                b"",
+            ]
+            continue
 
-        stdout, stderr = await proc.communicate()
+        returncode, stdout, stderr, usage = await execute(
+            *args, timeout=options["timeout"]
+        )
+        logger.debug("Program [ %s ] used: %s", program, usage)
         reply = [
-            json.dumps(dict(rc=proc.returncode, help="Work finished.")),
+            json.dumps(dict(rc=returncode, help="Work finished.", usage=usage)),
             stdout,
             stderr,
         ]
@@ -0,0 +1,217 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import dataclasses
+import heapq
+import itertools
+import logging
+import typing
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class TokenBucket:
+    """Allow a mean rate of events per second, with bursts up to burst."""
+
+    rate: float
+    burst: float
+    tokens: float = dataclasses.field(default=None)
+    stamp: float = 0.0
+
+    def __post_init__(self):
+        if self.tokens is None:
+            self.tokens = self.burst
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, now: float) -> float:
+        """Seconds to wait until a token is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+@dataclasses.dataclass(eq=False)
+class _Flow:
+    key: typing.Hashable
+    weight: float
+    # Virtual time at which the next item of the flow starts.
+    start: float
+    # Heap of (rank, seq, cost, item), see Dispatcher.push.
+    items: typing.List = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass(eq=False)
+class _Host:
+    name: str
+    bucket: TokenBucket
+    flows: typing.Dict[typing.Hashable, _Flow] = dataclasses.field(default_factory=dict)
+    # Heap of (start, seq, flow) of the flows with queued items.
+    active: typing.List = dataclasses.field(default_factory=list)
+    size: int = 0
+    running: int = 0
+    scheduled: bool = False
+    vtime: float = 0.0
+
+
+class Dispatcher:
+    """Hand out queued work fairly across hosts, within per host limits.
+
+    Every host has its own queue, a token bucket bounding how often it is
+    sent work and a cap on how much of its work runs at once. Hosts able to
+    take work sit in a heap keyed by the moment their next token is ready,
+    ties broken by arrival, so each decision costs O(log hosts) and hosts
+    ready at the same time are served round-robin.
+
+    Within a host, items are shared among flows, say transfers, by start
+    time fair queuing: the flow with the smallest virtual start time goes
+    next, and then starts cost/weight later. Flows of equal weight take
+    turns, and a flow of twice the weight gets twice the turns, however many
+    items each one has queued. Items of a flow go in arrival order or, when
+    shortest_first is set, cheapest first.
+    """
+
+    def __init__(
+        self,
+        *,
+        rate: float,
+        burst: float,
+        concurrency: int,
+        shortest_first: bool = False,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.shortest_first = shortest_first
+        self._hosts: typing.Dict[str, _Host] = {}
+        self._heap: typing.List[typing.Tuple[float, int, _Host]] = []
+        self._counter = itertools.count()
+        self._size = 0
+
+    def __len__(self) -> int:
+        """Count the queued items, not yet handed out."""
+        return self._size
+
+    def queued(self, host: str, flow: typing.Hashable = None) -> int:
+        """Count the items queued for the host, or for a flow within it."""
+        if not (state := self._hosts.get(host)):
+            return 0
+        if flow is None:
+            return state.size
+        if queue := state.flows.get(flow):
+            return len(queue.items)
+        return 0
+
+    def _schedule(self, host: _Host, now: float) -> None:
+        if host.scheduled or not host.size or host.running >= self.concurrency:
+            return
+        ready_time = now + host.bucket.delay(now)
+        heapq.heappush(self._heap, (ready_time, next(self._counter), host))
+        host.scheduled = True
+
+    def push(
+        self,
+        host: str,
+        item,
+        now: float,
+        *,
+        flow: typing.Hashable = None,
+        weight: float = 1.0,
+        cost: float = 1.0,
+    ) -> None:
+        """Queue an item of the host, on behalf of a flow.
+
+        The cost of an item, say how long it is expected to run, is what the
+        flow is charged once the item is handed out.
+        """
+        if not (state := self._hosts.get(host)):
+            state = self._hosts[host] = _Host(
+                host, TokenBucket(self.rate, self.burst, stamp=now)
+            )
+        seq = next(self._counter)
+        if not (queue := state.flows.get(flow)):
+            # A flow coming back from idle starts from now, not from its past.
+            queue = state.flows[flow] = _Flow(flow, weight, state.vtime)
+            heapq.heappush(state.active, (queue.start, seq, queue))
+        queue.weight = weight
+        rank = cost if self.shortest_first else 0.0
+        heapq.heappush(queue.items, (rank, seq, cost, item))
+        state.size += 1
+        self._size += 1
+        self._schedule(state, now)
+
+    def _take(self, host: _Host) -> typing.Any:
+        start, _, queue = heapq.heappop(host.active)
+        _, _, cost, item = heapq.heappop(queue.items)
+        host.vtime = start
+        queue.start = start + cost / queue.weight
+        if queue.items:
+            heapq.heappush(host.active, (queue.start, next(self._counter), queue))
+        else:
+            del host.flows[queue.key]
+        host.size -= 1
+        self._size -= 1
+        return item
+
+    def pop(self, now: float) -> typing.Optional[typing.Tuple[str, typing.Any]]:
+        """Take the next item allowed to run now, along with its host."""
+        while self._heap and self._heap[0][0] <= now:
+            _, _, host = heapq.heappop(self._heap)
+            host.scheduled = False
+            if not host.size or host.running >= self.concurrency:
+                continue
+            if host.bucket.delay(now) > 0:
+                self._schedule(host, now)
+                continue
+
+            host.bucket.take(now)
+            host.running += 1
+            item = self._take(host)
+            # Back to the end of the line, behind the hosts already waiting.
+            self._schedule(host, now)
+            return host.name, item
+        return None
+
+    def done(self, host: str, now: float) -> None:
+        """Release the slot taken by an item of the host."""
+        state = self._hosts[host]
+        state.running -= 1
+        self._schedule(state, now)
+
+    def prune(self, now: float) -> None:
+        """Forget idle hosts whose bucket is full, as new ones would be."""
+        for name, host in list(self._hosts.items()):
+            if host.size or host.running:
+                continue
+            host.bucket.delay(now)
+            if host.bucket.tokens >= self.burst:
+                del self._hosts[name]
+
+    def next_time(self) -> typing.Optional[float]:
+        """When the soonest host may take work, if any host is waiting."""
+        if self._heap:
+            return self._heap[0][0]
+        return None
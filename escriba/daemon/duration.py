@@ -0,0 +1,142 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import dataclasses
+import logging
+import math
+import typing
+
+import escriba.dao as dao
+
+logger = logging.getLogger(__name__)
+
+# Quantiles are within this relative error of the true ones.
+RELATIVE_ACCURACY = 0.02
+# Counts are halved past this many samples, so old history fades away.
+MAX_COUNT = 1000
+# Samples needed before a sketch is trusted over the static timeout.
+MIN_COUNT = 20
+# Sketches kept in memory, past which hosts seen seldom are forgotten.
+MAX_SKETCHES = 10000
+
+DEADLINE_QUANTILE = 0.99
+DEADLINE_FACTOR = 3.0
+# Deadlines never go below this many seconds, nor above twice the static
+# timeout of the strategy.
+MIN_DEADLINE = 10.0
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+# Durations below a millisecond share the first bucket.
+_MIN_VALUE = 1e-3
+# Buckets which faded below this weight, a sample ten decays old, are dropped.
+_MIN_WEIGHT = 1e-3
+
+
+@dataclasses.dataclass
+class Sketch:
+    """Streaming quantiles over logarithmic buckets, DDSketch style.
+
+    A value falls in bucket ceil(log(value, gamma)), so every bucket spans
+    the same relative width and any quantile is known within the relative
+    accuracy. Durations from a millisecond to a day take some 400 buckets.
+    """
+
+    buckets: typing.Dict[int, float] = dataclasses.field(default_factory=dict)
+    count: float = 0.0
+
+    def add(self, value: float) -> None:
+        key = math.ceil(math.log(max(value, _MIN_VALUE)) / _LOG_GAMMA)
+        self.buckets[key] = self.buckets.get(key, 0.0) + 1
+        self.count += 1
+        if self.count > MAX_COUNT:
+            self._decay()
+
+    def _decay(self) -> None:
+        # Every bucket fades alike, or the rare slow samples the high
+        # quantiles come from would be the first ones lost.
+        self.buckets = {
+            key: count / 2
+            for key, count in self.buckets.items()
+            if count / 2 >= _MIN_WEIGHT
+        }
+        self.count = sum(self.buckets.values())
+
+    def quantile(self, q: float) -> typing.Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= rank:
+                break
+        # The middle of the bucket, in relative terms.
+        return 2 * _GAMMA**key / (_GAMMA + 1)
+
+
+class Durations:
+    """How long snapshots take, by strategy and by strategy and host."""
+
+    def __init__(self):
+        self._sketches: typing.Dict[typing.Tuple, Sketch] = {}
+
+    def observe(
+        self, strategy: "dao.strategy.Strategy", host: str, seconds: float
+    ) -> None:
+        for key in ((strategy,), (strategy, host)):
+            self._sketches.setdefault(key, Sketch()).add(seconds)
+        if len(self._sketches) > MAX_SKETCHES:
+            self._sketches = {
+                key: sketch
+                for key, sketch in self._sketches.items()
+                if len(key) == 1 or sketch.count >= MIN_COUNT
+            }
+
+    def _sketch(
+        self, strategy: "dao.strategy.Strategy", host: str
+    ) -> typing.Optional[Sketch]:
+        """The most specific sketch with enough samples to be trusted."""
+        for key in ((strategy, host), (strategy,)):
+            sketch = self._sketches.get(key)
+            if sketch and sketch.count >= MIN_COUNT:
+                return sketch
+        return None
+
+    def deadline(
+        self, strategy: "dao.strategy.Strategy", host: str, attempt: int = 0
+    ) -> float:
+        """Seconds the snapshot may run before the agent kills it.
+
+        The deadline doubles on every attempt, as a timeout may just mean
+        the history is too optimistic for this snapshot.
+        """
+        deadline = float(strategy.timeout)
+        if sketch := self._sketch(strategy, host):
+            deadline = sketch.quantile(DEADLINE_QUANTILE) * DEADLINE_FACTOR
+        deadline *= 2**attempt
+        return min(max(deadline, MIN_DEADLINE), 2 * strategy.timeout)
+
+    def expected(self, strategy: "dao.strategy.Strategy", host: str) -> float:
+        """Typical duration of the snapshot, its median so far."""
+        if sketch := self._sketch(strategy, host):
+            return sketch.quantile(0.5)
+        return float(strategy.timeout)
+
+    def __len__(self) -> int:
+        return len(self._sketches)
@@ -21,25 +21,36 @@ import logging
 
 import escriba.db as db
 import escriba.dao as dao
+import escriba.storage as storage
 
 logger = logging.getLogger(__name__)
 
 
-async def run(*, interval: int):
+async def run(*, interval: int, writer: db.writer.Writer):
     async with db.connect() as con:
         while True:
+            updates = []
             for job in await dao.snapshot.listmany_ready_for_archivedotorg_update(
                 con,
                 100,
             ):
-                if not (archived_url := job.stdout):
+                archived_url = None
+                if job.stdout_digest:
+                    archived_url = storage.artifact.read(job.stdout_digest).decode()
+                    archived_url = archived_url.strip()
+                if not archived_url:
                     logger.warning(
                         "Job [ %s ] succeeded, but found no url on archive.org.",
                         job.uid,
                     )
-                await dao.webpage.update_archivedotorg(
-                    con, uid=job.uid, archived_url=archived_url
+                updates.append(
+                    writer.submit(
+                        dao.webpage.update_archivedotorg,
+                        uid=job.webpage_uid,
+                        # Not NULL, or the same snapshot would come back.
+                        archived_url=archived_url or "",
+                    )
                 )
-                await con.commit()
+            await asyncio.gather(*updates)
 
             await asyncio.sleep(interval)
@@ -0,0 +1,215 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import asyncio
+import datetime
+import logging
+import typing
+
+import escriba.db as db
+import escriba.dao as dao
+import escriba.storage as storage
+
+logger = logging.getLogger(__name__)
+
+# Bytes of WAL past which the file is truncated at the next quiet moment,
+# and past which it is checkpointed even while writes go on.
+WAL_LIMIT = 4 * 1024 * 1024
+WAL_PRESSURE = 4 * WAL_LIMIT
+# How often each periodic step runs. A step waits for a quiet moment,
+# unless it is late by a whole period.
+PERIODS = {
+    "optimize": datetime.timedelta(hours=1),
+    "incremental_vacuum": datetime.timedelta(days=1),
+    "analyze": datetime.timedelta(weeks=1),
+    "collect_artifacts": datetime.timedelta(hours=1),
+}
+# Free pages given back by each write intent of the incremental vacuum.
+VACUUM_BATCH = 1024
+# Artifacts unreferenced, and not stored again, for this long are removed,
+# this many per write intent.
+ARTIFACT_GRACE = datetime.timedelta(hours=1)
+ARTIFACT_BATCH = 256
+# Steps kept in the maintenance log.
+LOG_SIZE = 10000
+
+_Detail = typing.Dict[str, typing.Any]
+
+
+async def _data_version(con) -> int:
+    """Number which changes whenever another connection commits."""
+    cursor = await con.execute("PRAGMA data_version;")
+    return (await cursor.fetchone())[0]
+
+
+async def _checkpoint(con, mode: str) -> _Detail:
+    busy, log, checkpointed = await db.checkpoint(con, mode)
+    return dict(busy=bool(busy), log=log, checkpointed=checkpointed)
+
+
+async def _execute(con, sql: str) -> None:
+    """Write intent executing a statement."""
+    await con.execute(sql)
+
+
+async def _free_pages(con) -> _Detail:
+    """Write intent giving back to the filesystem a batch of free pages."""
+    cursor = await con.execute("PRAGMA freelist_count;")
+    free = (await cursor.fetchone())[0]
+    freed = 0
+    if free:
+        # The pragma frees one page each time it is executed from Python,
+        # which takes only the first step of statements returning no rows.
+        await con.repeat("PRAGMA incremental_vacuum;", min(free, VACUUM_BATCH))
+        cursor = await con.execute("PRAGMA freelist_count;")
+        freed = free - (await cursor.fetchone())[0]
+    return dict(freed=freed, left=free - freed)
+
+
+async def _forget_artifacts(con, before: datetime.datetime) -> _Detail:
+    """Write intent removing a batch of unreferenced artifacts."""
+    digests = await dao.artifact.listmany_unreferenced(
+        con, ARTIFACT_BATCH, before=before
+    )
+    removed = 0
+    for digest in digests:
+        # A file stored again meanwhile is about to be referenced again.
+        if await asyncio.to_thread(
+            storage.artifact.remove, digest, before=before.timestamp()
+        ):
+            await dao.artifact.delete(con, digest)
+            removed += 1
+    return dict(found=len(digests), removed=removed)
+
+
+# Every step but the checkpoint writes, so it goes through the writer like
+# the writes of the other daemons.
+
+
+async def _optimize(writer: db.writer.Writer) -> _Detail:
+    await writer.submit(db.optimize)
+    return {}
+
+
+async def _incremental_vacuum(writer: db.writer.Writer) -> _Detail:
+    # In batches, so other writes are not held back until the end.
+    freed = 0
+    while True:
+        detail = await writer.submit(_free_pages)
+        freed += detail["freed"]
+        if not detail["freed"] or not detail["left"]:
+            return dict(freed=freed)
+
+
+async def _analyze(writer: db.writer.Writer) -> _Detail:
+    await writer.submit(_execute, "ANALYZE;")
+    return {}
+
+
+async def _collect_artifacts(writer: db.writer.Writer) -> _Detail:
+    before = datetime.datetime.now(datetime.timezone.utc) - ARTIFACT_GRACE
+    removed = 0
+    while True:
+        detail = await writer.submit(_forget_artifacts, before)
+        removed += detail["removed"]
+        if detail["found"] < ARTIFACT_BATCH or not detail["removed"]:
+            return dict(removed=removed)
+
+
+_STEPS: typing.Dict[
+    str, typing.Callable[[db.writer.Writer], typing.Awaitable[_Detail]]
+] = {
+    "optimize": _optimize,
+    "incremental_vacuum": _incremental_vacuum,
+    "analyze": _analyze,
+    "collect_artifacts": _collect_artifacts,
+}
+
+
+async def _record(con, *, step: str, duration: float, detail: _Detail) -> None:
+    """Write intent logging the step."""
+    await dao.maintenance.create(con, step=step, duration=duration, detail=detail)
+    await dao.maintenance.prune(con, keep=LOG_SIZE)
+
+
+async def _run(
+    writer: db.writer.Writer,
+    step: str,
+    work: typing.Awaitable[_Detail],
+    **context,
+) -> _Detail:
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    detail = {**context, **await work}
+    duration = loop.time() - start
+    logger.info("Maintenance step %s took %.3fs: %s", step, duration, detail)
+    await writer.submit(_record, step=step, duration=duration, detail=detail)
+    return detail
+
+
+async def run(*, interval: int, writer: db.writer.Writer):
+    """Keep the WAL short and the database in shape for the long run.
+
+    The WAL is checkpointed once writes pause, and truncated if it got
+    large. Under continuous writes, it is checkpointed anyway once it gets
+    much larger, without blocking them. Every other connection committing
+    tells apart quiet moments from busy ones.
+    """
+    loop = asyncio.get_running_loop()
+    async with db.connect() as con:
+        due = {step: loop.time() + p.total_seconds() for step, p in PERIODS.items()}
+        version = await _data_version(con)
+        size = db.wal_size()
+        checked = loop.time()
+        dirty = True
+        while True:
+            await asyncio.sleep(interval)
+            now = loop.time()
+            latest_version, latest_size = await _data_version(con), db.wal_size()
+            quiet = latest_version == version
+            dirty = dirty or not quiet
+            # Bytes written to the WAL per second, as far as its size tells.
+            rate = max(latest_size - size, 0) / (now - checked)
+            size, checked = latest_size, now
+
+            mode = None
+            if quiet and size > WAL_LIMIT:
+                mode = "TRUNCATE"
+            elif (quiet and dirty) or size > WAL_PRESSURE:
+                mode = "PASSIVE"
+            if mode:
+                detail = await _run(
+                    writer,
+                    "checkpoint",
+                    _checkpoint(con, mode),
+                    mode=mode,
+                    wal_size=size,
+                    write_rate=round(rate),
+                )
+                # Not done until every frame was copied.
+                dirty = detail["busy"] or detail["checkpointed"] < detail["log"]
+                size = db.wal_size()
+
+            for step, period in PERIODS.items():
+                late = now - due[step]
+                if late >= 0 and (quiet or late >= period.total_seconds()):
+                    await _run(writer, step, _STEPS[step](writer))
+                    due[step] = loop.time() + period.total_seconds()
+
+            # Logging the steps above must not count as writes by others.
+            version = await _data_version(con)
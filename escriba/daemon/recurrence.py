@@ -0,0 +1,85 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import asyncio
+import datetime
+import heapq
+import logging
+
+import escriba.db as db
+import escriba.dao as dao
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+async def _fire(con, due: list) -> None:
+    """Write intent advancing the due schedules and enqueuing their webpages."""
+    webpage_uids = [
+        schedule.webpage_uid
+        for schedule in due
+        if await dao.schedule.advance(con, schedule)
+    ]
+    if webpage_uids:
+        await dao.webpage_job.create_many(
+            con,
+            webpage_uids=webpage_uids,
+            job_state=dao.job.JobState.PENDING,
+            priority=dao.job.Priority.RECURRING,
+        )
+    logger.info("Enqueued %d recurring captures.", len(webpage_uids))
+
+
+async def run(*, interval: int, writer: db.writer.Writer):
+    """Fire recurring schedules right when they are due.
+
+    The schedules due within the next couple of intervals are kept in a heap,
+    so the daemon sleeps until the soonest one instead of polling. The heap
+    is refilled from the next_due index every interval, which also picks up
+    the schedules changed in the meantime.
+    """
+    period = datetime.timedelta(seconds=interval)
+    async with db.connect() as con:
+        heap = []
+        truncated = False
+        refill_time = _now()
+        while True:
+            now = _now()
+            if now >= refill_time or (truncated and not heap):
+                schedules = await dao.schedule.listmany_due(
+                    con, BATCH_SIZE, until=now + 2 * period
+                )
+                truncated = len(schedules) == BATCH_SIZE
+                heap = [(s.next_due, s.webpage_uid, s) for s in schedules]
+                heapq.heapify(heap)
+                refill_time = now + period
+
+            due = []
+            while heap and heap[0][0] <= now:
+                due.append(heapq.heappop(heap)[-1])
+            if due:
+                await writer.submit(_fire, due)
+                continue
+
+            wake_time = min(heap[0][0], refill_time) if heap else refill_time
+            await asyncio.sleep(max((wake_time - now).total_seconds(), 0))
@@ -20,21 +20,29 @@ import asyncio
 
 import escriba.config as config
 import escriba.daemon as daemon
+import escriba.db as db
 import escriba.messaging as messaging
 
 
 async def run():
     config.configure_logger()
+    writer = db.writer.Writer()
     async with asyncio.TaskGroup() as tg:
         # These tasks share no state in memory and communicate only by
-        # database and/or network messages. All these may become
+        # database and/or network messages, besides the writer which
+        # commits their writes in groups. All these may become
         # independent processes running under supervisord:
+        tg.create_task(writer.run())
         tg.create_task(daemon.agent.run(endpoint="tcp://localhost:5555"))
-        tg.create_task(daemon.internet_archive.run(interval=1))
+        tg.create_task(daemon.internet_archive.run(interval=1, writer=writer))
+        tg.create_task(daemon.maintenance.run(interval=10, writer=writer))
+        tg.create_task(daemon.recurrence.run(interval=60, writer=writer))
         tg.create_task(
-            daemon.snapshot_job.run(interval=1, endpoint="tcp://localhost:5555")
+            daemon.snapshot_job.run(
+                interval=1, endpoint="tcp://localhost:5555", writer=writer
+            )
         )
-        tg.create_task(daemon.title.run(interval=1))
-        tg.create_task(daemon.transfer_job.run(interval=3))
-        tg.create_task(daemon.webpage_job.run(interval=1))
+        tg.create_task(daemon.title.run(interval=1, writer=writer))
+        tg.create_task(daemon.transfer_job.run(interval=3, writer=writer))
+        tg.create_task(daemon.webpage_job.run(interval=1, writer=writer))
         tg.create_task(messaging.broker.run("tcp://*:5555"))
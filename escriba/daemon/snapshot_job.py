@@ -17,91 +17,468 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
 import asyncio
+import datetime
 import json
 import logging
+import os
+import random
+import time
 import typing
 import urllib.parse
 import uuid
 
+import escriba.config as config
+import escriba.daemon as daemon
 import escriba.db as db
 import escriba.dao as dao
 import escriba.messaging as messaging
+import escriba.storage as storage
 
 logger = logging.getLogger(__name__)
 
+# Ready snapshots read at once, and kept in memory for each host and
+# transfer at most.
+WINDOW = 1000
+FLOW_WINDOW = 50
+
+# Seconds to wait before trying a failed snapshot again, doubling on every
+# attempt up to the cap.
+BACKOFF_BASE = 30
+BACKOFF_CAP = 3600
+
+# Succeeded snapshots whose durations are learned on start.
+SEED_SIZE = 10000
+
+# Seconds a request may wait in the broker for a free agent. Agents drop
+# requests older than that, so once the client stops waiting for the reply
+# nothing may still run it, and retrying cannot duplicate the work.
+QUEUE_TIMEOUT = 600
+# Allowance for clocks drifting between nodes and replies in transit.
+CLOCK_SLACK = 30
+
 
 async def _archive_file(
     endpoint: str,
     request: typing.List[str],
     snapshot: dao.snapshot.Snapshot,
-    timeout: int,
-) -> typing.Tuple[uuid.UUID, typing.Optional[typing.List[str]]]:
-    client = messaging.client.Client(endpoint, timeout=timeout)
+    deadline: float,
+) -> typing.Tuple[dao.snapshot.Snapshot, typing.Optional[typing.List[bytes]]]:
+    """Have an agent run the request, killing it past deadline seconds."""
+    client = messaging.client.Client(
+        endpoint, timeout=QUEUE_TIMEOUT + deadline + CLOCK_SLACK
+    )
+    options = dict(timeout=deadline, expires=time.time() + QUEUE_TIMEOUT)
+
+    # Workers take the first frame for the service name, so repeat it.
+    name = snapshot.strategy.name
+    await client.send(name, [name, json.dumps(options), *request])
+
+    reply = await client.recv(decode=False)
+    return snapshot, reply
+
+
+async def _put(
+    data: bytes, media_type: str, digest: typing.Optional[str] = None
+) -> typing.Optional[storage.artifact.Artifact]:
+    """Keep the output in the artifact store."""
+    if not data:
+        return None
+    return await asyncio.to_thread(
+        storage.artifact.put, data, media_type=media_type, digest=digest
+    )
+
+
+async def _acquire(
+    con, artifact: typing.Optional[storage.artifact.Artifact]
+) -> typing.Optional[str]:
+    if not artifact:
+        return None
+    await dao.artifact.acquire(con, artifact)
+    return artifact.digest
+
+
+def _body(
+    strategy: dao.strategy.Strategy, stdout: typing.Optional[bytes]
+) -> typing.Optional[storage.artifact.Artifact]:
+    """The body a fetch snapshot keeps in the artifact store, if any."""
+    if strategy != dao.strategy.Strategy.fetch or not stdout:
+        return None
+    try:
+        reference = json.loads(stdout)
+        return storage.artifact.Artifact(
+            digest=reference["digest"],
+            size=reference["size"],
+            media_type=reference["media_type"],
+        )
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+async def _release(con, strategy: dao.strategy.Strategy, uid: uuid.UUID) -> None:
+    """Drop the references held by outputs a snapshot is about to replace."""
+    previous = await dao.snapshot.aget(con, uid=uid)
+    if previous.stdout_digest and strategy == dao.strategy.Strategy.fetch:
+        try:
+            reference = await asyncio.to_thread(
+                storage.artifact.read, previous.stdout_digest
+            )
+        except OSError:
+            reference = None
+        if body := _body(strategy, reference):
+            await dao.artifact.release(con, body.digest)
+    for digest in (previous.stdout_digest, previous.stderr_digest):
+        if digest:
+            await dao.artifact.release(con, digest)
+
+
+async def _record(
+    con,
+    job: dao.snapshot.Snapshot,
+    *,
+    job_state: dao.job.JobState,
+    result: typing.Optional[str],
+    stdout: typing.Optional[storage.artifact.Artifact],
+    stderr: typing.Optional[storage.artifact.Artifact],
+    body: typing.Optional[storage.artifact.Artifact] = None,
+    simhash: typing.Optional[int] = None,
+    same_as: typing.Optional[dao.snapshot.Snapshot] = None,
+) -> None:
+    """Write intent recording the outcome along with references to the outputs."""
+    await _release(con, job.strategy, job.uid)
+    if same_as:
+        await dao.artifact.retain(con, same_as.stdout_digest)
+        stdout_digest = same_as.stdout_digest
+    else:
+        stdout_digest = await _acquire(con, stdout)
+    # The body a fetch stored is referenced along with its reference.
+    await _acquire(con, body)
+    await dao.snapshot.update(
+        con,
+        uid=job.uid,
+        job_state=job_state,
+        result=result,
+        stdout_digest=stdout_digest,
+        stderr_digest=await _acquire(con, stderr),
+        simhash=simhash,
+        same_as_uid=same_as.uid if same_as else None,
+    )
+
+
+def _fingerprint(
+    strategy: dao.strategy.Strategy, data: bytes
+) -> typing.Tuple[str, typing.Optional[int]]:
+    simhash = None
+    # Only near-duplicate matching needs it, and it costs far more.
+    if config.SIMHASH_DISTANCE is not None and strategy.media_type == "text/html":
+        simhash = storage.fingerprint.simhash(data)
+    return storage.fingerprint.digest(data), simhash
+
+
+async def _find_same_as(
+    con,
+    job: dao.snapshot.Snapshot,
+    digest: str,
+    simhash: typing.Optional[int],
+) -> typing.Optional[dao.snapshot.Snapshot]:
+    """Find the previous capture holding the same output as the job, if any."""
+    latest = await dao.snapshot.get_latest_capture(
+        con, webpage_uid=job.webpage_uid, strategy=job.strategy
+    )
+    if not latest or latest.uid == job.uid:
+        return None
+    if latest.stdout_digest == digest:
+        return latest
+    if (
+        config.SIMHASH_DISTANCE is not None
+        and simhash is not None
+        and latest.simhash is not None
+        and storage.fingerprint.distance(simhash, latest.simhash)
+        <= config.SIMHASH_DISTANCE
+    ):
+        return latest
+    return None
+
+
+def _index(job: dao.snapshot.Snapshot, stdout: bytes) -> None:
+    """Add the responses recorded by a warc snapshot to the CDXJ index."""
+    entries = []
+    for line in stdout.splitlines():
+        location = json.loads(line)
+        if location["record_type"] != "response":
+            continue
+        entries.append(
+            storage.cdxj.Entry(
+                url=location["target_uri"],
+                timestamp=storage.cdxj.timestamp(location["date"]),
+                filename=location["filename"],
+                offset=location["offset"],
+                length=location["length"],
+                snapshot_uid=job.uid.hex,
+            )
+        )
+    storage.cdxj.Index(config.CDXJ_DIR).add(entries)
+
+
+def _host(strategy: dao.strategy.Strategy, url: str) -> str:
+    """Name the host which the snapshot is going to send requests to."""
+    if strategy == dao.strategy.Strategy.internet_archive:
+        return "web.archive.org"
+    return urllib.parse.urlsplit(url).hostname or ""
+
+
+def _flow(snapshot: dao.snapshot.Snapshot) -> typing.Hashable:
+    """Group snapshots sharing a host fairly by transfer."""
+    # Recurring captures belong to no transfer and share a single flow.
+    return snapshot.transfer_uid or snapshot.priority
+
 
-    await client.send(snapshot.strategy.name, request)
+async def _refill(
+    con,
+    dispatcher: daemon.dispatch.Dispatcher,
+    queued: typing.Dict[uuid.UUID, dao.job.Priority],
+    cursors: typing.Dict[dao.job.Priority, int],
+    durations: daemon.duration.Durations,
+    now: float,
+) -> None:
+    """Queue ready snapshots past the cursor of every priority class.
 
-    reply = await client.recv()
-    return snapshot.uid, reply
+    Transfers with enough work queued for a host are passed over, so a large
+    transfer of a single site cannot fill the queues. Their snapshots stay
+    pending and come back once the cursor wraps around. Snapshots handed over
+    to a more urgent job are queued again in their new class and flow.
+    """
 
+    def push(ready: dao.snapshot.Ready) -> None:
+        held = queued.get(ready.snapshot.uid)
+        if held and held.value <= ready.snapshot.priority.value:
+            return
+        host = _host(ready.snapshot.strategy, ready.url)
+        flow = _flow(ready.snapshot)
+        if dispatcher.queued(host, flow) >= FLOW_WINDOW:
+            return
+        cost = 1.0
+        if config.SHORTEST_FIRST:
+            cost = durations.expected(ready.snapshot.strategy, host)
+        dispatcher.push(
+            host,
+            ready,
+            now,
+            flow=flow,
+            weight=ready.snapshot.priority.weight,
+            cost=cost,
+        )
+        queued[ready.snapshot.uid] = ready.snapshot.priority
+
+    # Retries are few and found by the not_before index, wherever they are.
+    for ready in await dao.snapshot.listmany_due_retries(
+        con, WINDOW, now=datetime.datetime.now(datetime.timezone.utc)
+    ):
+        push(ready)
+
+    wrapped = False
+    for priority in dao.job.Priority:
+        readies = await dao.snapshot.listmany_ready(
+            con, WINDOW, priority=priority, after=cursors[priority]
+        )
+        for ready in readies:
+            push(ready)
+
+        if len(readies) < WINDOW:
+            cursors[priority] = 0
+            wrapped = True
+        else:
+            cursors[priority] = readies[-1].rowid
+
+    if wrapped:
+        dispatcher.prune(now)
+
+
+async def _start(
+    con,
+    writer: db.writer.Writer,
+    endpoint: str,
+    ready: dao.snapshot.Ready,
+    deadline: float,
+) -> asyncio.Task:
+    job = ready.snapshot
+    await writer.submit(dao.snapshot.start, uid=job.uid)
+
+    request = [ready.url]
+    if job.source_uid:
+        source = await dao.snapshot.aget(con, uid=job.source_uid)
+        if source.job_state == dao.job.JobState.SUCCEEDED and source.stdout_digest:
+            # Reference to the body already in the artifact store.
+            reference = storage.artifact.read(source.stdout_digest)
+            request.append(reference.decode().strip())
+        else:
+            logger.info("Snapshot [ %s ] will fetch the page by itself.", job.uid)
+
+    return asyncio.create_task(_archive_file(endpoint, request, job, deadline))
+
+
+def _is_retryable(result: typing.Optional[typing.Dict[str, typing.Any]]) -> bool:
+    """Tell failures which may go away by themselves from the others."""
+    if result is None:
+        # No reply in time: no agent took the request, or the agent is gone.
+        return True
+    # Extractors exit with EX_TEMPFAIL on busy servers and network errors,
+    # and processes killed by a signal get a negative code.
+    return result["rc"] == os.EX_TEMPFAIL or result["rc"] < 0
+
+
+def _backoff(attempt: int) -> datetime.timedelta:
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1))
+    # Half of the delay is random, so snapshots failing together, like all
+    # those of a host going down, are not retried together.
+    return datetime.timedelta(seconds=random.uniform(delay / 2, delay))
 
-async def run(*, interval: int, endpoint: str):
+
+async def _seed(con, durations: daemon.duration.Durations) -> None:
+    """Learn how long snapshots take from the latest ones that succeeded."""
+    for duration in reversed(
+        await dao.snapshot.listmany_recent_durations(con, SEED_SIZE)
+    ):
+        host = _host(duration.strategy, duration.url)
+        durations.observe(duration.strategy, host, duration.wall_time)
+    logger.info("Learned durations for %d strategies and hosts.", len(durations))
+
+
+async def _finish(
+    con,
+    writer: db.writer.Writer,
+    job: dao.snapshot.Snapshot,
+    reply: typing.Optional[typing.List[bytes]],
+) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    """Record the outcome of the snapshot, returning the result of the agent."""
+    raw_result = result = stdout = stderr = None
+    if reply:
+        raw_result, stdout, stderr = reply
+        raw_result = raw_result.decode()
+        result = json.loads(raw_result)
+
+    if not result or result["rc"] != 0:
+        attempt = job.attempt + 1
+        if _is_retryable(result) and attempt < job.strategy.max_attempts:
+            not_before = datetime.datetime.now(datetime.timezone.utc) + _backoff(
+                attempt
+            )
+            logger.info(
+                "Snapshot [ %s ] failed attempt %d, will retry after %s.",
+                job.uid,
+                attempt,
+                not_before,
+            )
+            await writer.submit(
+                dao.snapshot.retry,
+                uid=job.uid,
+                not_before=not_before,
+                result=raw_result,
+            )
+        else:
+            await writer.submit(
+                _record,
+                job,
+                job_state=dao.job.JobState.FAILED,
+                result=raw_result,
+                stdout=await _put(stdout, job.strategy.media_type),
+                stderr=await _put(stderr, "text/plain"),
+            )
+        return result
+
+    if job.strategy == dao.strategy.Strategy.warc:
+        await asyncio.to_thread(_index, job, stdout)
+    digest = simhash = same_as = None
+    if stdout:
+        digest, simhash = await asyncio.to_thread(_fingerprint, job.strategy, stdout)
+        same_as = await _find_same_as(con, job, digest, simhash)
+
+    body = _body(job.strategy, stdout)
+    if same_as:
+        # Recapture without changes: point to the previous capture instead
+        # of storing the output again.
+        logger.info("Snapshot [ %s ] is unchanged since [ %s ].", job.uid, same_as.uid)
+        stdout = simhash = None
+    await writer.submit(
+        _record,
+        job,
+        job_state=dao.job.JobState.SUCCEEDED,
+        result=raw_result,
+        stdout=await _put(stdout, job.strategy.media_type, digest),
+        stderr=await _put(stderr, "text/plain"),
+        body=body,
+        simhash=simhash,
+        same_as=same_as,
+    )
+    return result
+
+
+async def run(*, interval: int, endpoint: str, writer: db.writer.Writer):
     async with db.connect() as con:
         # Must clean the dirty state before starting the real loop.
-        await dao.snapshot.update_state(
-            con, old_state=dao.job.JobState.EXECUTING, new_state=dao.job.JobState.FAILED
-        )
-        await con.commit()
+        await writer.submit(dao.snapshot.recover)
 
-        executing = set()
+        loop = asyncio.get_running_loop()
+        dispatcher = daemon.dispatch.Dispatcher(
+            rate=config.HOST_RATE,
+            burst=config.HOST_BURST,
+            concurrency=config.HOST_CONCURRENCY,
+            shortest_first=config.SHORTEST_FIRST,
+        )
+        durations = daemon.duration.Durations()
+        await _seed(con, durations)
+        queued = {}
+        cursors = dict.fromkeys(dao.job.Priority, 0)
+        refill_time = loop.time()
+        executing = {}
         while True:
-            if job := await dao.snapshot.get_by_state(
-                con, job_state=dao.job.JobState.PENDING
-            ):
-                await dao.snapshot.update(
-                    con, uid=job.uid, job_state=dao.job.JobState.EXECUTING
-                )
-                await con.commit()
+            now = loop.time()
+            if now >= refill_time:
+                await _refill(con, dispatcher, queued, cursors, durations, now)
+                refill_time = now + interval
 
-                webpage = await dao.webpage.aget(con, uid=job.webpage_uid)
-                url = urllib.parse.urlunsplit(webpage.url)
-
-                task = asyncio.create_task(
-                    _archive_file(
-                        endpoint, [job.strategy.name, url], job, job.strategy.timeout
-                    )
+            starting = []
+            while item := dispatcher.pop(now):
+                host, ready = item
+                if queued.get(ready.snapshot.uid) != ready.snapshot.priority:
+                    # Left behind when queued again with a higher priority,
+                    # and either that entry is still waiting or it ran.
+                    dispatcher.done(host, now)
+                    continue
+                del queued[ready.snapshot.uid]
+                deadline = durations.deadline(
+                    ready.snapshot.strategy, host, ready.snapshot.attempt
                 )
-                executing |= {task}
+                starting.append((host, _start(con, writer, endpoint, ready, deadline)))
+            if starting:
+                # Started together, so their writes are committed together.
+                hosts, coroutines = zip(*starting)
+                executing.update(zip(await asyncio.gather(*coroutines), hosts))
+
+            # Wake up for the next host allowed to run, or for a refill.
+            wake_time = refill_time
+            if (next_time := dispatcher.next_time()) is not None:
+                wake_time = min(wake_time, next_time)
+            timeout = max(wake_time - loop.time(), 0)
 
             if executing:
                 logger.debug("Awaiting for completion.")
-                done, executing = await asyncio.wait(
-                    executing, timeout=interval, return_when="FIRST_EXCEPTION"
+                done, _ = await asyncio.wait(
+                    executing, timeout=timeout, return_when="FIRST_COMPLETED"
                 )
 
                 logger.debug("Collecting results.")
                 # Collect results and ensure exceptions within the coroutine are raised
+                finished = []
                 for future in done:
-                    uid, reply = await future
-                    job_state = dao.job.JobState.FAILED
-                    if reply:
-                        raw_result, stdout, stderr = reply
-                        result = json.loads(raw_result)
-                        if result["rc"] == 0:
-                            job_state = dao.job.JobState.SUCCEEDED
-                        await dao.snapshot.update(
-                            con,
-                            uid=uid,
-                            job_state=job_state,
-                            result=raw_result,
-                            stdout=stdout,
-                            stderr=stderr,
-                        )
-                    else:
-                        await dao.snapshot.update(
-                            con,
-                            uid=uid,
-                            job_state=job_state,
+                    host = executing.pop(future)
+                    dispatcher.done(host, loop.time())
+                    job, reply = await future
+                    finished.append((host, job, _finish(con, writer, job, reply)))
+                results = await asyncio.gather(*(f for _, _, f in finished))
+                for (host, job, _), result in zip(finished, results):
+                    if result and result["rc"] == 0 and "usage" in result:
+                        durations.observe(
+                            job.strategy, host, result["usage"]["wall_time"]
                         )
-                    await con.commit()
             else:
-                await asyncio.sleep(interval)
+                await asyncio.sleep(timeout)
@@ -21,21 +21,32 @@ import logging
 
 import escriba.db as db
 import escriba.dao as dao
+import escriba.storage as storage
 
 logger = logging.getLogger(__name__)
 
 
-async def run(*, interval: int):
+async def run(*, interval: int, writer: db.writer.Writer):
     async with db.connect() as con:
         while True:
+            updates = []
             for job in await dao.snapshot.listmany_ready_for_title_update(
                 con,
                 100,
             ):
                 logger.debug("Got job ready for title update %s", job)
-                if not (title := job.stdout):
+                title = None
+                if job.stdout_digest:
+                    title = storage.artifact.read(job.stdout_digest).decode().strip()
+                if not title:
                     logger.warning("Job [ %s ] succeeded, but found no title.", job.uid)
-                await dao.webpage.update_title(con, uid=job.webpage_uid, title=title)
-                await con.commit()
+                # An empty title still marks the webpage as looked at, so the
+                # snapshot is not picked up again. It reads back as None.
+                updates.append(
+                    writer.submit(
+                        dao.webpage.update_title, uid=job.webpage_uid, title=title or ""
+                    )
+                )
+            await asyncio.gather(*updates)
 
             await asyncio.sleep(interval)
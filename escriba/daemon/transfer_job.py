@@ -18,62 +18,175 @@
 """
 import asyncio
 import logging
+import time
 import typing
 import urllib.parse
 
+import escriba.config as config
 import escriba.db as db
 import escriba.dao as dao
+import escriba.storage as storage
 
 logger = logging.getLogger(__name__)
 
 
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+# Query parameters which only tell where a visitor came from.
+_TRACKING_PARAMS = frozenset(
+    ("fbclid", "gclid", "dclid", "msclkid", "yclid", "mc_cid", "mc_eid", "_ga")
+)
+
+
+def _is_tracking(param: str) -> bool:
+    name = param.split("=", 1)[0].lower()
+    return name in _TRACKING_PARAMS or name.startswith("utm_")
+
+
+def _canonicalise(url: str) -> urllib.parse.SplitResult:
+    """Spell alike the URLs which surely lead to the same webpage.
+
+    For instance, http://Example.COM:80/a?b=1&utm_source=x&a=2#top becomes
+    http://example.com/a?a=2&b=1. The path is kept as given, and so are the
+    query parameters but for their order and those tracking visitors, as
+    servers may tell apart their spellings.
+    """
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc
+    try:
+        port = parts.port
+        valid = True
+    except ValueError:
+        # Left alone, for the snapshot to fail on it as given.
+        port, valid = None, False
+    if parts.hostname and valid:
+        host = parts.hostname
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            pass
+        if ":" in host:
+            host = f"[{host}]"
+        if port and port != _DEFAULT_PORTS.get(scheme):
+            host = f"{host}:{port}"
+        userinfo, at, _ = netloc.rpartition("@")
+        netloc = f"{userinfo}{at}{host}"
+    path = parts.path or ("/" if netloc else "")
+    # Sorting by name alone keeps the order of repeated parameters.
+    params = (p for p in parts.query.split("&") if p and not _is_tracking(p))
+    query = "&".join(sorted(params, key=lambda p: p.split("=", 1)[0]))
+    return urllib.parse.SplitResult(scheme, netloc, path, query, "")
+
+
 def _identify_transfer_urls(
     urls: str,
 ) -> typing.Generator[urllib.parse.SplitResult, None, None]:
     # We assume that duplicate URLs in the same transfer are a mistake,
-    # so we simply remove the duplicates with a set() operation.
-    for urlline in set(urls.splitlines()):
+    # so we simply remove the duplicates once canonicalised.
+    seen = set()
+    for urlline in urls.splitlines():
         urlline_stripped = urlline.strip()
         if not urlline_stripped:
             continue
-        yield urllib.parse.urlsplit(urlline_stripped)
+        url = _canonicalise(urlline_stripped)
+        if url not in seen:
+            seen.add(url)
+            yield url
+
+
+# Seconds between saving the URL filter, when it changed.
+SAVE_INTERVAL = 600
+
 
+def _load_seen() -> storage.bloom.BloomFilter:
+    """Load the filter of known URLs and add those inserted since it was saved.
 
-async def run(*, interval: int):
+    It is rebuilt from the whole table when missing or sized differently.
+    """
+    wanted = storage.bloom.BloomFilter.for_capacity(
+        config.URL_FILTER_CAPACITY, config.URL_FILTER_ERROR_RATE
+    )
+    with db.connect() as con:
+        last_rowid = dao.webpage.last_rowid(con)
+        seen, watermark = storage.bloom.load(config.URL_FILTER_PATH) or (wanted, 0)
+        if (seen.size, seen.hashes) != (wanted.size, wanted.hashes) or (
+            watermark > last_rowid
+        ):
+            # Resized, or saved for another database.
+            seen, watermark = wanted, 0
+        logger.info("Adding the URLs after rowid %d to the URL filter.", watermark)
+        for url in dao.webpage.iter_urls(con, after=watermark):
+            seen.add(url)
+    return seen
+
+
+async def _save_seen(con, seen: storage.bloom.BloomFilter) -> None:
+    # Every committed webpage is in the filter already, as they are added
+    # before their transaction commits.
+    watermark = await dao.webpage.alast_rowid(con)
+    await asyncio.to_thread(seen.dump, config.URL_FILTER_PATH, watermark=watermark)
+
+
+async def _expand(
+    con, job: dao.transfer_job.TransferJob, seen: storage.bloom.BloomFilter
+) -> None:
+    """Write intent creating the webpages of the transfer and their jobs."""
+    transfer = await dao.transfer.aget(con, uid=job.transfer_uid)
+    urls = [
+        urllib.parse.urlunsplit(url)
+        for url in _identify_transfer_urls(transfer.user_input)
+    ]
+    # Only the URLs the filter may have seen are looked up, all at once; the
+    # rest are surely new. A false positive costs no more than a lookup.
+    uids = await dao.webpage.aget_uids_by_url(con, [u for u in urls if u in seen])
+    if new := [url for url in urls if url not in uids]:
+        uids.update(await dao.webpage.create_many(con, new))
+        for url in new:
+            seen.add(url)
+    webpage_uids = [uids[url] for url in urls]
+    await dao.webpage.associate_many(con, webpage_uids, transfer_job_uid=job.uid)
+    for webpage_uid in webpage_uids:
+        _ = await dao.webpage_job.create(
+            con,
+            webpage_uid=webpage_uid,
+            job_state=dao.job.JobState.PENDING,
+            priority=transfer.priority,
+            transfer_uid=transfer.uid,
+        )
+    await dao.transfer_job.update(
+        con,
+        uid=job.uid,
+        job_state=dao.job.JobState.SUCCEEDED,
+    )
+
+
+async def run(*, interval: int, writer: db.writer.Writer):
+    seen = await asyncio.to_thread(_load_seen)
     async with db.connect() as con:
         # Must clean the dirty state before starting the real loop.
-        await dao.transfer_job.update_state(
-            con, old_state=dao.job.JobState.EXECUTING, new_state=dao.job.JobState.FAILED
+        await writer.submit(
+            dao.transfer_job.update_state,
+            old_state=dao.job.JobState.EXECUTING,
+            new_state=dao.job.JobState.FAILED,
         )
-        await con.commit()
-
-        while True:
-            if job := await dao.transfer_job.get_by_state(
-                con, job_state=dao.job.JobState.PENDING
-            ):
-                await dao.transfer_job.update(
-                    con,
-                    uid=job.uid,
-                    job_state=dao.job.JobState.EXECUTING,
-                )
-                await con.commit()
-
-                transfer = await dao.transfer.aget(con, uid=job.transfer_uid)
-                for url in _identify_transfer_urls(transfer.user_input):
-                    webpage_uid = await dao.webpage.create(
-                        con, url=url, transfer_job_uid=job.uid
-                    )
-                    _ = await dao.webpage_job.create(
-                        con,
-                        webpage_uid=webpage_uid,
-                        job_state=dao.job.JobState.PENDING,
+
+        dirty, saved = False, time.monotonic()
+        try:
+            while True:
+                if job := await dao.transfer_job.get_by_state(
+                    con, job_state=dao.job.JobState.PENDING
+                ):
+                    await writer.submit(
+                        dao.transfer_job.update,
+                        uid=job.uid,
+                        job_state=dao.job.JobState.EXECUTING,
                     )
-                await con.commit()
-
-                await dao.transfer_job.update(
-                    con,
-                    uid=job.uid,
-                    job_state=dao.job.JobState.SUCCEEDED,
-                )
-                await con.commit()
-            await asyncio.sleep(interval)
+                    await writer.submit(_expand, job, seen)
+                    dirty = True
+                if dirty and time.monotonic() - saved >= SAVE_INTERVAL:
+                    await _save_seen(con, seen)
+                    dirty, saved = False, time.monotonic()
+                await asyncio.sleep(interval)
+        finally:
+            if dirty:
+                await _save_seen(con, seen)
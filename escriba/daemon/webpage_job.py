@@ -17,14 +17,24 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
 import asyncio
+import datetime
 import logging
 import typing
+import uuid
 
 import escriba.db as db
 import escriba.dao as dao
 
 logger = logging.getLogger(__name__)
 
+BATCH_SIZE = 100
+
+_IN_FLIGHT = (dao.job.JobState.PENDING, dao.job.JobState.EXECUTING)
+
+_Captures = typing.Dict[
+    typing.Tuple[dao.strategy.Strategy, dao.job.JobState], dao.snapshot.Latest
+]
+
 
 def _identity_archive_strategies(
     *_,
@@ -33,39 +43,192 @@ def _identity_archive_strategies(
     yield from dao.strategy.Strategy
 
 
-async def run(*, interval: int):
+def _is_wanted(
+    strategy: dao.strategy.Strategy,
+    captures: _Captures,
+    now: datetime.datetime,
+    priority: dao.job.Priority,
+) -> bool:
+    # A snapshot on its way will be as fresh as a new one.
+    if any((strategy, state) in captures for state in _IN_FLIGHT):
+        return False
+    # Schedules promise a capture every period, however short.
+    if priority == dao.job.Priority.RECURRING:
+        return True
+    if succeeded := captures.get((strategy, dao.job.JobState.SUCCEEDED)):
+        return now - succeeded.creation_time >= strategy.freshness
+    return True
+
+
+def _reusable(
+    strategy: dao.strategy.Strategy, captures: _Captures
+) -> typing.Optional[uuid.UUID]:
+    """Snapshot of the strategy which others may still rely on."""
+    for state in (*_IN_FLIGHT, dao.job.JobState.SUCCEEDED):
+        if latest := captures.get((strategy, state)):
+            return latest.uid
+    return None
+
+
+async def _create(
+    con,
+    job: dao.webpage_job.WebpageJob,
+    strategy: dao.strategy.Strategy,
+    captures: _Captures,
+    now: datetime.datetime,
+    source_uid: typing.Optional[uuid.UUID] = None,
+) -> uuid.UUID:
+    # Snapshots keep the priority and transfer of the job that asked them.
+    uid = await dao.snapshot.create(
+        con,
+        webpage_uid=job.webpage_uid,
+        strategy=strategy,
+        job_state=dao.job.JobState.PENDING,
+        source_uid=source_uid,
+        priority=job.priority,
+        transfer_uid=job.transfer_uid,
+    )
+    # Later jobs for the same webpage in this batch coalesce with this one.
+    captures[strategy, dao.job.JobState.PENDING] = dao.snapshot.Latest(
+        uid=uid,
+        creation_time=now,
+        webpage_uid=job.webpage_uid,
+        strategy=strategy,
+        job_state=dao.job.JobState.PENDING,
+        priority=job.priority,
+        transfer_uid=job.transfer_uid,
+    )
+    return uid
+
+
+async def _take_over(
+    con, job: dao.webpage_job.WebpageJob, pending: typing.Optional[dao.snapshot.Latest]
+) -> None:
+    """Run a pending snapshot of a less urgent job as part of this one.
+
+    Otherwise an interactive submission coalescing with a bulk import would
+    wait for it, in its class and flow.
+    """
+    if not pending or pending.priority.value <= job.priority.value:
+        return
+    if not await dao.snapshot.promote(
+        con, pending.uid, priority=job.priority, transfer_uid=job.transfer_uid
+    ):
+        return
+    logger.info("Snapshot [ %s ] is now %s.", pending.uid, job.priority.name)
+    if pending.transfer_uid and pending.transfer_uid != job.transfer_uid:
+        # The transfer which asked for it reuses it from now on.
+        await dao.transfer.add_reused(
+            con, pending.transfer_uid, snapshot_uid=pending.uid
+        )
+    pending.priority = job.priority
+    pending.transfer_uid = job.transfer_uid or pending.transfer_uid
+
+
+async def _schedule(
+    con,
+    job: dao.webpage_job.WebpageJob,
+    captures: _Captures,
+    now: datetime.datetime,
+) -> None:
+    webpage = await dao.webpage.aget(con, uid=job.webpage_uid)
+    strategies = set(_identity_archive_strategies(webpage.url))
+    wanted = {s for s in strategies if _is_wanted(s, captures, now, job.priority)}
+    if skipped := strategies - wanted:
+        logger.info(
+            "Webpage [ %s ] is fresh enough for %s.",
+            webpage.uid,
+            ", ".join(sorted(s.name for s in skipped)),
+        )
+        for strategy in skipped:
+            await _take_over(
+                con, job, captures.get((strategy, dao.job.JobState.PENDING))
+            )
+            if job.transfer_uid and (reused_uid := _reusable(strategy, captures)):
+                await dao.transfer.add_reused(
+                    con, job.transfer_uid, snapshot_uid=reused_uid
+                )
+
+    # Retrieve the page once, then let every strategy which only needs the
+    # bytes read them from the artifact store. A fresh retrieval will do.
+    source_uid = None
+    if dao.strategy.Strategy.fetch in wanted:
+        wanted.remove(dao.strategy.Strategy.fetch)
+        source_uid = await _create(con, job, dao.strategy.Strategy.fetch, captures, now)
+    elif dao.strategy.Strategy.fetch in strategies:
+        source_uid = _reusable(dao.strategy.Strategy.fetch, captures)
+
+    for strategy in wanted:
+        await _create(
+            con,
+            job,
+            strategy,
+            captures,
+            now,
+            source_uid=source_uid if strategy.consumes_body else None,
+        )
+
+
+async def _start(con, jobs: typing.List[dao.webpage_job.WebpageJob]) -> None:
+    for job in jobs:
+        await dao.webpage_job.update(
+            con,
+            uid=job.uid,
+            job_state=dao.job.JobState.EXECUTING,
+        )
+
+
+async def _process(
+    con,
+    job: dao.webpage_job.WebpageJob,
+    captures: _Captures,
+    now: datetime.datetime,
+) -> None:
+    """Write intent scheduling the snapshots of the job."""
+    await _schedule(con, job, captures, now)
+    await dao.webpage_job.update(
+        con,
+        uid=job.uid,
+        job_state=dao.job.JobState.SUCCEEDED,
+    )
+
+
+async def run(*, interval: int, writer: db.writer.Writer):
     async with db.connect() as con:
         # Must clean the dirty state before starting the real loop.
-        await dao.webpage_job.update_state(
-            con, old_state=dao.job.JobState.EXECUTING, new_state=dao.job.JobState.FAILED
+        await writer.submit(
+            dao.webpage_job.update_state,
+            old_state=dao.job.JobState.EXECUTING,
+            new_state=dao.job.JobState.FAILED,
         )
-        await con.commit()
 
         while True:
-            if job := await dao.webpage_job.get_by_state(
-                con, job_state=dao.job.JobState.PENDING
+            if jobs := await dao.webpage_job.listmany_by_state(
+                con, BATCH_SIZE, job_state=dao.job.JobState.PENDING
             ):
-                await dao.webpage_job.update(
-                    con,
-                    uid=job.uid,
-                    job_state=dao.job.JobState.EXECUTING,
-                )
-                await con.commit()
-
-                webpage = await dao.webpage.aget(con, uid=job.webpage_uid)
-                for strategy in _identity_archive_strategies(webpage.url):
-                    _ = await dao.snapshot.create(
-                        con,
-                        webpage_uid=webpage.uid,
-                        strategy=strategy,
-                        job_state=dao.job.JobState.PENDING,
-                    )
-                await con.commit()
+                await writer.submit(_start, jobs)
+
+                # A single lookup tells what every webpage of the batch has.
+                captures: typing.Dict[uuid.UUID, _Captures] = {}
+                for latest in await dao.snapshot.listmany_latest_by_webpages(
+                    con, {job.webpage_uid for job in jobs}
+                ):
+                    captures.setdefault(latest.webpage_uid, {})[
+                        latest.strategy, latest.job_state
+                    ] = latest
 
-                await dao.webpage_job.update(
-                    con,
-                    uid=job.uid,
-                    job_state=dao.job.JobState.SUCCEEDED,
+                now = datetime.datetime.now(datetime.timezone.utc)
+                # Intents are applied in order, so later jobs for a webpage
+                # still coalesce with the snapshots created for earlier ones.
+                await asyncio.gather(
+                    *(
+                        writer.submit(
+                            _process,
+                            job,
+                            captures.setdefault(job.webpage_uid, {}),
+                            now,
+                        )
+                        for job in jobs
+                    )
                 )
-                await con.commit()
             await asyncio.sleep(interval)
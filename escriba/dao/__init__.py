@@ -16,9 +16,16 @@
     You should have received a copy of the GNU Affero General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
+# Lookup tables and row models come first, as the others build on them.
 import escriba.dao.job as job
-import escriba.dao.snapshot as snapshot
+import escriba.dao.model as model
 import escriba.dao.strategy as strategy
+
+import escriba.dao.artifact as artifact
+import escriba.dao.maintenance as maintenance
+import escriba.dao.page as page
+import escriba.dao.schedule as schedule
+import escriba.dao.snapshot as snapshot
 import escriba.dao.transfer as transfer
 import escriba.dao.transfer_job as transfer_job
 import escriba.dao.webpage as webpage
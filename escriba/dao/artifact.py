@@ -0,0 +1,85 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import datetime
+import logging
+import typing
+
+import escriba.storage as storage
+
+logger = logging.getLogger(__name__)
+
+
+async def acquire(connection, artifact: "storage.artifact.Artifact") -> None:
+    """Count one more reference to the artifact, recording it if new."""
+    await connection.execute(
+        "INSERT INTO artifact (digest, size, media_type, refcount)"
+        " VALUES (:digest, :size, :media_type, 1)"
+        " ON CONFLICT (digest) DO UPDATE"
+        " SET refcount=refcount + 1, released_time=NULL",
+        dict(
+            digest=artifact.digest,
+            size=artifact.size,
+            media_type=artifact.media_type,
+        ),
+    )
+
+
+async def retain(connection, digest: str) -> None:
+    """Count one more reference to an artifact known to be recorded."""
+    await connection.execute(
+        "UPDATE artifact SET refcount=refcount + 1, released_time=NULL"
+        " WHERE digest=:digest",
+        dict(digest=digest),
+    )
+
+
+async def release(connection, digest: str) -> None:
+    """Count one reference less, noting when the artifact became unused."""
+    await connection.execute(
+        "UPDATE artifact SET refcount=refcount - 1,"
+        " released_time=CASE WHEN refcount <= 1"
+        " THEN (CURRENT_TIMESTAMP || '+00:00') ELSE released_time END"
+        " WHERE digest=:digest",
+        dict(digest=digest),
+    )
+
+
+async def listmany_unreferenced(
+    connection, size: int, *, before: datetime.datetime
+) -> typing.Tuple[str, ...]:
+    """List artifacts nothing referenced since before the given moment."""
+    cursor = await connection.execute(
+        "SELECT digest FROM artifact"
+        " WHERE refcount <= 0 AND released_time < :before LIMIT :size",
+        dict(
+            size=size,
+            # Same layout as CURRENT_TIMESTAMP || '+00:00', so comparisons hold.
+            before=before.astimezone(datetime.timezone.utc).isoformat(
+                sep=" ", timespec="seconds"
+            ),
+        ),
+    )
+    return tuple(row["digest"] for row in await cursor.fetchall())
+
+
+async def delete(connection, digest: str) -> None:
+    await connection.execute(
+        "DELETE FROM artifact WHERE digest=:digest AND refcount <= 0",
+        dict(digest=digest),
+    )
@@ -0,0 +1,118 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import argparse
+import logging
+import sqlite3
+import time
+import typing
+
+import escriba.config as config
+import escriba.dao as dao
+
+logger = logging.getLogger(__name__)
+
+# Rows like the ones the DAO reads, made up by SQLite, so the decoding is
+# measured apart from any table or index.
+_UID = "lower(hex(randomblob(16)))"
+_TIME = "datetime(1700000000 + i, 'unixepoch') || '+00:00'"
+_ROWS = {
+    dao.transfer.Transfer: (
+        f"{_UID} AS uid, {_TIME} AS creation_time,"
+        " 'https://example.com/' || i AS user_input, 1 + i % 3 AS priority_uid"
+    ),
+    dao.transfer_job.TransferJob: (
+        f"{_UID} AS uid, {_TIME} AS creation_time, {_TIME} AS modified_time,"
+        f" {_UID} AS transfer_uid, 1 + i % 4 AS job_state_uid"
+    ),
+    dao.webpage.Webpage: (
+        f"{_UID} AS uid, {_TIME} AS creation_time, {_TIME} AS modified_time,"
+        " 'https://example.com/path/' || i || '?q=' || i AS url,"
+        " 'Title ' || i AS title, NULL AS internet_archive,"
+        f" {_UID} AS transfer_job_uid, {_UID} AS transfer_uid"
+    ),
+    dao.webpage_job.WebpageJob: (
+        f"{_UID} AS uid, {_TIME} AS creation_time, {_TIME} AS modified_time,"
+        f" {_UID} AS webpage_uid, 1 + i % 4 AS job_state_uid,"
+        f" 1 + i % 3 AS priority_uid, {_UID} AS transfer_uid"
+    ),
+    dao.snapshot.Snapshot: (
+        f"{_UID} AS uid, {_TIME} AS creation_time, {_TIME} AS modified_time,"
+        f" {_UID} AS webpage_uid, 4 AS strategy_uid, 1 + i % 4 AS job_state_uid,"
+        f" {_UID} AS source_uid, {_UID} AS stdout_digest, NULL AS stderr_digest,"
+        " i AS simhash, NULL AS same_as_uid, 1 + i % 3 AS priority_uid,"
+        f" {_UID} AS transfer_uid, i % 3 AS attempt, NULL AS not_before"
+    ),
+}
+
+
+def _rows(columns: str, count: int) -> typing.List[sqlite3.Row]:
+    con = sqlite3.connect(":memory:")
+    con.row_factory = sqlite3.Row
+    return con.execute(
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)"
+        f" SELECT {columns} FROM n",
+        (count,),
+    ).fetchall()
+
+
+def _read_uid(obj) -> None:
+    obj.uid
+
+
+def _read_all(obj) -> None:
+    for field in obj._fields:
+        getattr(obj, field.name)
+
+
+def measure(
+    model: typing.Type[dao.model.Model],
+    rows: typing.Sequence[sqlite3.Row],
+    read: typing.Callable,
+    repeat: int,
+) -> float:
+    """Rows per second turned into models and read, the best of a few runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for obj in map(model.from_row, rows):
+            read(obj)
+        best = min(best, time.perf_counter() - start)
+    return len(rows) / best
+
+
+def main(count: int, repeat: int) -> None:
+    print(f"{'model':<12} {'uid only':>12} {'all fields':>12}  (rows/s)")
+    for model, columns in _ROWS.items():
+        rows = _rows(columns, count)
+        print(
+            f"{model.__name__:<12}"
+            f" {measure(model, rows, _read_uid, repeat):>12,.0f}"
+            f" {measure(model, rows, _read_all, repeat):>12,.0f}"
+        )
+
+
+if __name__ == "__main__":
+    config.configure_logger(logger)
+    argparser = argparse.ArgumentParser(
+        description="Measure how fast the DAO turns rows into models."
+    )
+    argparser.add_argument("--rows", type=int, default=20000)
+    argparser.add_argument("--repeat", type=int, default=5)
+    args = argparser.parse_args()
+    main(args.rows, args.repeat)
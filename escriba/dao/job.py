@@ -27,3 +27,27 @@ class JobState(enum.Enum):
     EXECUTING = 2
     SUCCEEDED = 3
     FAILED = 4
+
+
+class Priority(enum.Enum):
+    """Class of service of a job, the lower the more urgent."""
+
+    INTERACTIVE = 1
+    BULK = 2
+    RECURRING = 3
+
+    @property
+    def weight(self) -> float:
+        """Share of the work given to jobs of this class, relative to others.
+
+        Shares are weighted rather than strict, so a steady flow of urgent
+        jobs slows down the others without starving them.
+        """
+        if self == self.INTERACTIVE:
+            weight = 8.0
+        elif self == self.BULK:
+            weight = 2.0
+        else:
+            weight = 1.0
+
+        return weight
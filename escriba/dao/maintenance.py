@@ -0,0 +1,95 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import dataclasses
+import datetime
+import json
+import logging
+import sqlite3
+import typing
+
+import escriba.dao as dao
+
+logger = logging.getLogger(__name__)
+
+_PAGE_KEY = ("uid",)
+
+
+@dataclasses.dataclass
+class Step:
+    uid: int
+    creation_time: datetime.datetime
+    step: str
+    duration: float
+    detail: typing.Dict[str, typing.Any]
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row):
+        return cls(**_fields_from_row(row))
+
+
+def _fields_from_row(row: sqlite3.Row):
+    return dict(
+        uid=row["uid"],
+        creation_time=datetime.datetime.fromisoformat(row["creation_time"]),
+        step=row["step"],
+        duration=row["duration"],
+        detail=json.loads(row["detail"]) if row["detail"] else {},
+    )
+
+
+async def create(
+    connection,
+    *,
+    step: str,
+    duration: float,
+    detail: typing.Optional[typing.Dict[str, typing.Any]] = None,
+) -> None:
+    await connection.execute(
+        "INSERT INTO maintenance_log (step, duration, detail)"
+        " VALUES (:step, :duration, :detail)",
+        dict(
+            step=step,
+            duration=duration,
+            detail=json.dumps(detail) if detail else None,
+        ),
+    )
+
+
+async def prune(connection, *, keep: int) -> None:
+    """Forget all but the latest steps."""
+    await connection.execute(
+        "DELETE FROM maintenance_log"
+        " WHERE uid <= (SELECT MAX(uid) FROM maintenance_log) - :keep",
+        dict(keep=keep),
+    )
+
+
+def listmany(
+    connection, size: int, *, token: typing.Optional[str] = None
+) -> "dao.page.Page[Step]":
+    """List a page of steps, latest first."""
+    condition, order, params = dao.page.clause(_PAGE_KEY, token)
+    cursor = connection.execute(
+        f"SELECT * FROM maintenance_log WHERE {condition} ORDER BY {order}"
+        " LIMIT :size",
+        dict(params, size=size + 1),
+    )
+    return dao.page.make(
+        cursor.fetchall(), size, token, columns=_PAGE_KEY, build=Step.from_row
+    )
@@ -0,0 +1,137 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import logging
+import sqlite3
+import typing
+
+logger = logging.getLogger(__name__)
+
+T = typing.TypeVar("T")
+
+_MISSING = object()
+
+
+class Field:
+    """Attribute decoded from its column on first access, then kept.
+
+    Columns holding NULL or an empty string take the default instead. A
+    field without a default must be given, either by its column or on
+    construction.
+    """
+
+    __slots__ = ("name", "column", "decode", "default", "slot")
+
+    def __init__(
+        self,
+        decode: typing.Optional[typing.Callable[[typing.Any], typing.Any]] = None,
+        *,
+        column: typing.Optional[str] = None,
+        default: typing.Any = _MISSING,
+    ):
+        self.decode = decode
+        self.column = column
+        self.default = default
+        self.name = self.slot = None
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.name = name
+        self.column = self.column or name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return self.slot.__get__(obj)
+        except AttributeError:
+            pass
+        value = self._from_row(obj._row)
+        self.slot.__set__(obj, value)
+        return value
+
+    def __set__(self, obj, value) -> None:
+        self.slot.__set__(obj, value)
+
+    def _from_row(self, row: typing.Optional[sqlite3.Row]):
+        try:
+            raw = row[self.column]
+        except (IndexError, TypeError):
+            # Not selected by the query, or built without a row.
+            raw = None
+        if raw is None or raw == "":
+            if self.default is _MISSING:
+                raise AttributeError(f"Field {self.name!r} has no value.")
+            return self.default
+        return self.decode(raw) if self.decode else raw
+
+
+class Model:
+    """Row of a query, whose fields are decoded only when they are read.
+
+    Listings mostly need a few fields of each row, so parsing UUIDs, dates
+    and URLs upfront is wasted. Subclasses declare Field attributes and are
+    decorated with slotted(), which gives every field a slot of its own.
+    """
+
+    __slots__ = ("_row",)
+
+    _fields: typing.Tuple[Field, ...] = ()
+
+    def __init__(self, **fields):
+        self._row = None
+        for name, value in fields.items():
+            if not isinstance(getattr(type(self), name, None), Field):
+                raise TypeError(f"Unexpected field {name!r}.")
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls: typing.Type[T], row: sqlite3.Row) -> T:
+        obj = cls.__new__(cls)
+        obj._row = row
+        return obj
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(
+            getattr(self, f.name) == getattr(other, f.name) for f in self._fields
+        )
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{f.name}={getattr(self, f.name)!r}" for f in self._fields)
+        return f"{type(self).__name__}({fields})"
+
+
+def slotted(cls: typing.Type[T]) -> typing.Type[T]:
+    """Rebuild the class with a slot behind each of its fields."""
+    fields = {
+        name: value for name, value in vars(cls).items() if isinstance(value, Field)
+    }
+    namespace = {
+        name: value
+        for name, value in vars(cls).items()
+        if name not in ("__dict__", "__weakref__")
+    }
+    namespace["__slots__"] = tuple(f"_{name}_value" for name in fields)
+    new = type(cls.__name__, cls.__bases__, namespace)
+    for name, field in fields.items():
+        field.slot = vars(new)[f"_{name}_value"]
+    new._fields = (*getattr(cls, "_fields", ()), *fields.values())
+    return new
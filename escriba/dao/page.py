@@ -0,0 +1,136 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import base64
+import binascii
+import dataclasses
+import json
+import logging
+import sqlite3
+import typing
+
+logger = logging.getLogger(__name__)
+
+T = typing.TypeVar("T")
+
+Key = typing.Tuple[typing.Union[str, int, float], ...]
+
+
+class InvalidToken(ValueError):
+    """The page token was not made by this module, or for another listing."""
+
+
+@dataclasses.dataclass(frozen=True)
+class Page(typing.Generic[T]):
+    """Items listed newest first, with tokens for the pages around them.
+
+    Pages are found by the key of the item at their border, rather than by
+    counting the items before them, so a deep page costs as much as the
+    first, and items inserted meanwhile do not shift the pages.
+    """
+
+    items: typing.Tuple[T, ...]
+    # Token for the older items, if any.
+    next: typing.Optional[str] = None
+    # Token for the newer items, if any.
+    prev: typing.Optional[str] = None
+
+    def __iter__(self) -> typing.Iterator[T]:
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+def _encode(key: Key, *, backward: bool) -> str:
+    raw = json.dumps([backward, *key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode(token: str, width: int) -> typing.Tuple[Key, bool]:
+    """Key of the border item, and whether the page lies before it."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        backward, *key = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as exc:
+        raise InvalidToken(f"Invalid page token {token!r}.") from exc
+    if (
+        not isinstance(backward, bool)
+        or len(key) != width
+        or not all(isinstance(value, (str, int, float)) for value in key)
+    ):
+        raise InvalidToken(f"Invalid page token {token!r}.")
+    return tuple(key), backward
+
+
+def clause(
+    columns: typing.Sequence[str], token: typing.Optional[str]
+) -> typing.Tuple[str, str, typing.Dict[str, typing.Any]]:
+    """SQL condition, ordering and parameters selecting the page of the token.
+
+    The columns must identify a row and be covered by an index, in that
+    order, for the condition to be a range scan of the index.
+    """
+    backward = False
+    condition = "1"
+    params = {}
+    if token is not None:
+        key, backward = decode(token, len(columns))
+        params = {f"key{i}": value for i, value in enumerate(key)}
+        condition = "({}) {} ({})".format(
+            ", ".join(columns),
+            ">" if backward else "<",
+            ", ".join(f":{name}" for name in params),
+        )
+    direction = "ASC" if backward else "DESC"
+    order = ", ".join(f"{column} {direction}" for column in columns)
+    return condition, order, params
+
+
+def make(
+    rows: typing.Sequence[sqlite3.Row],
+    size: int,
+    token: typing.Optional[str],
+    *,
+    columns: typing.Sequence[str],
+    build: typing.Callable[[sqlite3.Row], T],
+) -> Page[T]:
+    """Build the page out of at most size + 1 rows read after clause().
+
+    The extra row only tells whether there are more items beyond the page.
+    Rows must carry the key columns under their unqualified names.
+    """
+    backward = token is not None and decode(token, len(columns))[1]
+    more = len(rows) > size
+    rows = list(rows[:size])
+    if backward:
+        rows.reverse()
+    if not rows:
+        return Page(items=())
+
+    def key(row: sqlite3.Row) -> Key:
+        return tuple(row[column.rpartition(".")[2]] for column in columns)
+
+    # Coming from a page means there are items on its side.
+    older = more if not backward else True
+    newer = more if backward else token is not None
+    return Page(
+        items=tuple(build(row) for row in rows),
+        next=_encode(key(rows[-1]), backward=False) if older else None,
+        prev=_encode(key(rows[0]), backward=True) if newer else None,
+    )
@@ -0,0 +1,190 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import dataclasses
+import datetime
+import enum
+import logging
+import random
+import sqlite3
+import typing
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Fraction of the period by which due times are moved back and forth, so
+# schedules created together drift apart instead of firing at once.
+JITTER = 0.1
+
+
+class Recurrence(enum.Enum):
+    hourly = 1
+    daily = 2
+    weekly = 3
+
+    @property
+    def period(self) -> datetime.timedelta:
+        if self == self.hourly:
+            period = datetime.timedelta(hours=1)
+        elif self == self.daily:
+            period = datetime.timedelta(days=1)
+        else:
+            period = datetime.timedelta(weeks=1)
+
+        return period
+
+
+@dataclasses.dataclass
+class Schedule:
+    webpage_uid: uuid.UUID
+    creation_time: datetime.datetime
+    recurrence: Recurrence
+    next_due: datetime.datetime
+    modified_time: typing.Optional[datetime.datetime] = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row):
+        return cls(**_fields_from_row(row))
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _format(moment: datetime.datetime) -> str:
+    # Same layout as CURRENT_TIMESTAMP || '+00:00', so comparisons hold.
+    return moment.astimezone(datetime.timezone.utc).isoformat(
+        sep=" ", timespec="seconds"
+    )
+
+
+def first_due(
+    recurrence: Recurrence, now: typing.Optional[datetime.datetime] = None
+) -> datetime.datetime:
+    """Spread the first capture anywhere within the first period."""
+    return (now or _now()) + recurrence.period * random.random()
+
+
+def next_due(recurrence: Recurrence, due: datetime.datetime) -> datetime.datetime:
+    """One period after the last due time, give or take the jitter."""
+    return due + recurrence.period * (1 + JITTER * random.uniform(-1, 1))
+
+
+def _fields_from_row(row: sqlite3.Row):
+    fields = dict(
+        webpage_uid=uuid.UUID(row["webpage_uid"]),
+        creation_time=datetime.datetime.fromisoformat(row["creation_time"]),
+        recurrence=Recurrence(row["recurrence_uid"]),
+        next_due=datetime.datetime.fromisoformat(row["next_due"]),
+    )
+    if raw_modified_time := row["modified_time"]:
+        fields["modified_time"] = datetime.datetime.fromisoformat(raw_modified_time)
+    return fields
+
+
+def _upsert(
+    connection,
+    *,
+    webpage_uid: uuid.UUID,
+    recurrence: Recurrence,
+    next_due: datetime.datetime,
+):
+    return connection.execute(
+        "INSERT INTO schedule (webpage_uid, recurrence_uid, next_due)"
+        " VALUES (:webpage_uid, :recurrence_uid, :next_due)"
+        " ON CONFLICT (webpage_uid) DO UPDATE"
+        " SET recurrence_uid=excluded.recurrence_uid, next_due=excluded.next_due",
+        dict(
+            webpage_uid=webpage_uid.hex,
+            recurrence_uid=recurrence.value,
+            next_due=_format(next_due),
+        ),
+    )
+
+
+def _delete(connection, *, webpage_uid: uuid.UUID):
+    return connection.execute(
+        "DELETE FROM schedule WHERE webpage_uid=:webpage_uid",
+        dict(webpage_uid=webpage_uid.hex),
+    )
+
+
+def _read(connection, *, webpage_uid: uuid.UUID):
+    return connection.execute(
+        "SELECT * from schedule WHERE webpage_uid=:webpage_uid",
+        dict(webpage_uid=webpage_uid.hex),
+    )
+
+
+def _read_due(connection, size: int, *, until: datetime.datetime):
+    return connection.execute(
+        "SELECT * from schedule WHERE next_due <= :until ORDER BY next_due"
+        " LIMIT :size",
+        dict(until=_format(until), size=size),
+    )
+
+
+def update(connection, *, webpage_uid: uuid.UUID, recurrence: Recurrence) -> None:
+    """Capture the webpage again on every period from now on."""
+    _upsert(
+        connection,
+        webpage_uid=webpage_uid,
+        recurrence=recurrence,
+        next_due=first_due(recurrence),
+    )
+
+
+def remove(connection, *, webpage_uid: uuid.UUID) -> None:
+    _delete(connection, webpage_uid=webpage_uid)
+
+
+def get(connection, *, webpage_uid: uuid.UUID) -> typing.Optional[Schedule]:
+    cursor = _read(connection, webpage_uid=webpage_uid)
+    if row := cursor.fetchone():
+        return Schedule.from_row(row)
+
+
+async def listmany_due(
+    connection, size: int, *, until: datetime.datetime
+) -> typing.Tuple[Schedule, ...]:
+    """List the schedules due up to the given moment, soonest first."""
+    cursor = await _read_due(connection, size, until=until)
+    return tuple(Schedule.from_row(row) for row in await cursor.fetchall())
+
+
+async def advance(connection, schedule: Schedule) -> bool:
+    """Move the schedule to its next due time.
+
+    Nothing happens, and False is returned, if the schedule was changed or
+    removed since it was read. A schedule left behind by more than a period,
+    say because the daemon was down, restarts from now instead of catching
+    up on every period it missed.
+    """
+    due = next_due(schedule.recurrence, schedule.next_due)
+    if due <= (now := _now()):
+        due = next_due(schedule.recurrence, now)
+    cursor = await connection.execute(
+        "UPDATE schedule SET next_due=:next_due"
+        " WHERE webpage_uid=:webpage_uid AND next_due=:due",
+        dict(
+            webpage_uid=schedule.webpage_uid.hex,
+            due=_format(schedule.next_due),
+            next_due=_format(due),
+        ),
+    )
+    return cursor.rowcount == 1
@@ -19,6 +19,7 @@
 import dataclasses
 import datetime
 import enum
+import json
 import logging
 import sqlite3
 import typing
@@ -29,25 +30,124 @@ import escriba.dao as dao
 logger = logging.getLogger(__name__)
 
 
+@dao.model.slotted
+class Snapshot(dao.model.Model):
+    """Metadata of a snapshot, as listings and queues need it.
+
+    The result reported by the agent is kept apart, see Full.
+    """
+
+    uid: uuid.UUID = dao.model.Field(uuid.UUID)
+    creation_time: datetime.datetime = dao.model.Field(datetime.datetime.fromisoformat)
+    webpage_uid: uuid.UUID = dao.model.Field(uuid.UUID)
+    job_state: enum.Enum = dao.model.Field(dao.job.JobState, column="job_state_uid")
+    strategy: "dao.strategy.Strategy" = dao.model.Field(
+        dao.strategy.Strategy, column="strategy_uid"
+    )
+    modified_time: typing.Optional[datetime.datetime] = dao.model.Field(
+        datetime.datetime.fromisoformat, default=None
+    )
+    source_uid: typing.Optional[uuid.UUID] = dao.model.Field(uuid.UUID, default=None)
+    stdout_digest: typing.Optional[str] = dao.model.Field(default=None)
+    stderr_digest: typing.Optional[str] = dao.model.Field(default=None)
+    simhash: typing.Optional[int] = dao.model.Field(default=None)
+    same_as_uid: typing.Optional[uuid.UUID] = dao.model.Field(uuid.UUID, default=None)
+    priority: "dao.job.Priority" = dao.model.Field(
+        dao.job.Priority, column="priority_uid", default=None
+    )
+    transfer_uid: typing.Optional[uuid.UUID] = dao.model.Field(uuid.UUID, default=None)
+    attempt: int = dao.model.Field(default=0)
+    not_before: typing.Optional[datetime.datetime] = dao.model.Field(
+        datetime.datetime.fromisoformat, default=None
+    )
+
+    @property
+    def unchanged(self) -> bool:
+        """Whether the output is the one of an earlier capture, see same_as_uid."""
+        return self.same_as_uid is not None
+
+
+@dao.model.slotted
+class Full(Snapshot):
+    """Snapshot along with the result reported by the agent, as JSON."""
+
+    result: typing.Optional[str] = dao.model.Field(default=None)
+
+
+@dataclasses.dataclass
+class ResourceUsage:
+    """Resources spent by the agents running snapshots of a strategy."""
+
+    strategy: "dao.strategy.Strategy"
+    count: int
+    wall_time: float
+    user_time: float
+    system_time: float
+    max_rss: int
+    stdout_size: int
+    stderr_size: int
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row):
+        return cls(
+            strategy=dao.strategy.Strategy(row["strategy_uid"]),
+            count=row["count"],
+            wall_time=row["wall_time"],
+            user_time=row["user_time"],
+            system_time=row["system_time"],
+            max_rss=row["max_rss"],
+            stdout_size=row["stdout_size"],
+            stderr_size=row["stderr_size"],
+        )
+
+
 @dataclasses.dataclass
-class Snapshot:
+class Latest:
+    """Most recent snapshot of a webpage, by strategy and state."""
+
     uid: uuid.UUID
     creation_time: datetime.datetime
     webpage_uid: uuid.UUID
-    job_state: enum.Enum
     strategy: "dao.strategy.Strategy"
-    modified_time: typing.Optional[datetime.datetime] = None
-    result: str = None
-    stdout: str = None
-    stderr: str = None
+    job_state: enum.Enum
+    priority: enum.Enum
+    transfer_uid: typing.Optional[uuid.UUID]
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row):
+        return cls(
+            uid=uuid.UUID(row["uid"]),
+            creation_time=datetime.datetime.fromisoformat(row["creation_time"]),
+            webpage_uid=uuid.UUID(row["webpage_uid"]),
+            strategy=dao.strategy.Strategy(row["strategy_uid"]),
+            job_state=dao.job.JobState(row["job_state_uid"]),
+            priority=dao.job.Priority(row["priority_uid"]),
+            transfer_uid=row["transfer_uid"] and uuid.UUID(row["transfer_uid"]),
+        )
+
+
+@dataclasses.dataclass
+class Ready:
+    """Snapshot ready to run, with its position in the table and its URL."""
+
+    rowid: int
+    snapshot: Snapshot
+    url: str
 
     @classmethod
     def from_row(cls, row: sqlite3.Row):
-        return cls(**_fields_from_row(row))
+        return cls(rowid=row["rowid"], snapshot=Snapshot.from_row(row), url=row["url"])
 
 
 async def create(
-    connection, *, webpage_uid: uuid.UUID, strategy: enum.Enum, job_state: enum.Enum
+    connection,
+    *,
+    webpage_uid: uuid.UUID,
+    strategy: enum.Enum,
+    job_state: enum.Enum,
+    source_uid: typing.Optional[uuid.UUID] = None,
+    priority: enum.Enum = dao.job.Priority.INTERACTIVE,
+    transfer_uid: typing.Optional[uuid.UUID] = None,
 ) -> uuid.UUID:
     uid = uuid.uuid4()
     await _create(
@@ -56,10 +156,43 @@ async def create(
         job_state=job_state,
         strategy=strategy,
         webpage_uid=webpage_uid,
+        source_uid=source_uid,
+        priority=priority,
+        transfer_uid=transfer_uid,
     )
     return uid
 
 
+# Every column of the snapshot table. Results live in snapshot_result, so
+# rows stay small and many of them fit in each page of the table.
+_COLUMNS = (
+    "uid",
+    "creation_time",
+    "modified_time",
+    "webpage_uid",
+    "strategy_uid",
+    "job_state_uid",
+    "source_uid",
+    "stdout_digest",
+    "stderr_digest",
+    "simhash",
+    "same_as_uid",
+    "priority_uid",
+    "transfer_uid",
+    "attempt",
+    "not_before",
+)
+_SELECT = ", ".join(_COLUMNS)
+_SELECT_S = ", ".join(f"s.{column}" for column in _COLUMNS)
+
+
+def _format(moment: datetime.datetime) -> str:
+    # Same layout as CURRENT_TIMESTAMP || '+00:00', so comparisons hold.
+    return moment.astimezone(datetime.timezone.utc).isoformat(
+        sep=" ", timespec="seconds"
+    )
+
+
 def _create(
     connection,
     *,
@@ -67,61 +200,176 @@ def _create(
     job_state: enum.Enum,
     strategy: enum.Enum,
     webpage_uid: uuid.UUID,
+    source_uid: typing.Optional[uuid.UUID] = None,
+    priority: enum.Enum = dao.job.Priority.INTERACTIVE,
+    transfer_uid: typing.Optional[uuid.UUID] = None,
 ):
     return connection.execute(
-        "INSERT INTO snapshot (uid, webpage_uid, strategy_uid, job_state_uid)"
-        " VALUES (:uid, :webpage_uid, :strategy_uid, :job_state_uid);",
+        "INSERT INTO snapshot (uid, webpage_uid, strategy_uid, job_state_uid,"
+        " source_uid, priority_uid, transfer_uid)"
+        " VALUES (:uid, :webpage_uid, :strategy_uid, :job_state_uid,"
+        " :source_uid, :priority_uid, :transfer_uid);",
         dict(
             uid=uid.hex,
             webpage_uid=webpage_uid.hex,
             strategy_uid=strategy.value,
             job_state_uid=job_state.value,
+            source_uid=source_uid.hex if source_uid else None,
+            priority_uid=priority.value,
+            transfer_uid=transfer_uid.hex if transfer_uid else None,
         ),
     )
 
 
-def _read_by_webpage(connection, *, webpage_uid: uuid.UUID):
+def _read(connection, *, uid: uuid.UUID):
     return connection.execute(
-        "SELECT * from snapshot"
-        " WHERE webpage_uid=:webpage_uid"
-        " ORDER BY creation_time DESC",
-        dict(webpage_uid=webpage_uid.hex),
+        f"SELECT {_SELECT} from snapshot WHERE uid=:uid", dict(uid=uid.hex)
+    )
+
+
+# Newest first, ties broken by insertion order, along snapshot_webpage.
+_PAGE_KEY = ("creation_time", "rowid")
+
+
+def _read_by_webpage(
+    connection, size: int, *, webpage_uid: uuid.UUID, token: typing.Optional[str]
+):
+    condition, order, params = dao.page.clause(_PAGE_KEY, token)
+    return connection.execute(
+        f"SELECT {_SELECT}, rowid from snapshot"
+        f" WHERE webpage_uid=:webpage_uid AND {condition}"
+        f" ORDER BY {order}"
+        " LIMIT :size",
+        dict(params, webpage_uid=webpage_uid.hex, size=size + 1),
     )
 
 
 def _read_by_state(connection, *, job_state: enum.Enum):
     return connection.execute(
-        "SELECT * from snapshot"
+        f"SELECT {_SELECT} from snapshot"
         " WHERE job_state_uid=:job_state_uid"
         " ORDER BY creation_time DESC",
         dict(job_state_uid=job_state.value),
     )
 
 
-def _fields_from_row(row: sqlite3.Row):
-    fields = dict(
-        uid=uuid.UUID(row["uid"]),
-        creation_time=datetime.datetime.fromisoformat(row["creation_time"]),
-        job_state=dao.job.JobState(row["job_state_uid"]),
-        strategy=dao.strategy.Strategy(row["strategy_uid"]),
-        webpage_uid=uuid.UUID(row["webpage_uid"]),
+def _read_ready(connection, size: int, *, priority: enum.Enum, after: int):
+    # Snapshots consuming the output of another one must wait until their
+    # source is finished, either succeeding or failing. Walking by rowid
+    # lets the caller resume where it stopped, whatever the backlog size.
+    # Retries are left to _read_due_retries.
+    return connection.execute(
+        f"SELECT s.rowid, {_SELECT_S}, w.url from snapshot as s"
+        " JOIN webpage as w ON w.uid=s.webpage_uid"
+        " LEFT JOIN snapshot as f ON f.uid=s.source_uid"
+        " WHERE s.job_state_uid=:pending AND s.priority_uid=:priority"
+        " AND s.rowid > :after AND s.not_before IS NULL"
+        " AND (s.source_uid IS NULL OR f.job_state_uid IN (:succeeded, :failed))"
+        " ORDER BY s.rowid"
+        " LIMIT :size",
+        dict(
+            size=size,
+            after=after,
+            priority=priority.value,
+            pending=dao.job.JobState.PENDING.value,
+            succeeded=dao.job.JobState.SUCCEEDED.value,
+            failed=dao.job.JobState.FAILED.value,
+        ),
+    )
+
+
+def _read_due_retries(connection, size: int, *, now: datetime.datetime):
+    # The unary + keeps SQLite off the job state index, as the partial index
+    # on not_before holds just the few snapshots waiting for a retry.
+    return connection.execute(
+        f"SELECT s.rowid, {_SELECT_S}, w.url from snapshot as s"
+        " JOIN webpage as w ON w.uid=s.webpage_uid"
+        " WHERE s.not_before <= :now AND +s.job_state_uid=:pending"
+        " ORDER BY s.not_before"
+        " LIMIT :size",
+        dict(now=_format(now), pending=dao.job.JobState.PENDING.value, size=size),
+    )
+
+
+def _read_latest_capture(connection, *, webpage_uid: uuid.UUID, strategy: enum.Enum):
+    # Unchanged snapshots point to the capture holding their output, so only
+    # snapshots with an output of their own need to be compared.
+    return connection.execute(
+        f"SELECT {_SELECT} from snapshot"
+        " WHERE webpage_uid=:webpage_uid"
+        " AND strategy_uid=:strategy_uid"
+        " AND job_state_uid=:succeeded"
+        " AND same_as_uid IS NULL"
+        " AND stdout_digest IS NOT NULL"
+        " ORDER BY creation_time DESC"
+        " LIMIT 1",
+        dict(
+            webpage_uid=webpage_uid.hex,
+            strategy_uid=strategy.value,
+            succeeded=dao.job.JobState.SUCCEEDED.value,
+        ),
+    )
+
+
+def _read_latest_by_webpages(connection, *, webpage_uids: typing.Iterable[uuid.UUID]):
+    # SQLite fills the bare uid column from the row holding the maximum, and
+    # walks the (webpage, strategy, state, creation_time) index to find it.
+    return connection.execute(
+        "SELECT uid, MAX(creation_time) AS creation_time, webpage_uid,"
+        " strategy_uid, job_state_uid, priority_uid, transfer_uid"
+        " FROM snapshot"
+        " WHERE webpage_uid IN (SELECT value FROM json_each(:webpage_uids))"
+        " AND job_state_uid IN (:pending, :executing, :succeeded)"
+        " GROUP BY webpage_uid, strategy_uid, job_state_uid",
+        dict(
+            webpage_uids=json.dumps([uid.hex for uid in webpage_uids]),
+            pending=dao.job.JobState.PENDING.value,
+            executing=dao.job.JobState.EXECUTING.value,
+            succeeded=dao.job.JobState.SUCCEEDED.value,
+        ),
     )
-    if raw_modified_time := row["modified_time"]:
-        fields["modified_time"] = datetime.datetime.fromisoformat(raw_modified_time)
-    if raw_result := row["result"]:
-        fields["result"] = raw_result
-    if raw_stdout := row["stdout"]:
-        fields["stdout"] = raw_stdout
-    if raw_stderr := row["stderr"]:
-        fields["stderr"] = raw_stderr
-    return fields
 
 
 def listmany_by_webpage(
-    connection, size: int, *, webpage_uid: uuid.UUID
-) -> typing.Tuple[Snapshot, ...]:
-    cursor = _read_by_webpage(connection, webpage_uid=webpage_uid)
-    return tuple(Snapshot.from_row(row) for row in cursor.fetchmany(size))
+    connection,
+    size: int,
+    *,
+    webpage_uid: uuid.UUID,
+    token: typing.Optional[str] = None,
+) -> "dao.page.Page[Snapshot]":
+    """List a page of snapshots of the webpage, newest first."""
+    cursor = _read_by_webpage(connection, size, webpage_uid=webpage_uid, token=token)
+    return dao.page.make(
+        cursor.fetchall(), size, token, columns=_PAGE_KEY, build=Snapshot.from_row
+    )
+
+
+def _read_full(connection, *, uid: uuid.UUID):
+    return connection.execute(
+        f"SELECT {_SELECT_S}, r.result from snapshot as s"
+        " LEFT JOIN snapshot_result as r ON r.snapshot_uid=s.uid"
+        " WHERE s.uid=:uid",
+        dict(uid=uid.hex),
+    )
+
+
+def get_full(connection, uid: uuid.UUID) -> Full:
+    """Get the snapshot along with its result, when it is needed."""
+    cursor = _read_full(connection, uid=uid)
+    row = cursor.fetchone()
+    return Full.from_row(row)
+
+
+async def aget_full(connection, uid: uuid.UUID) -> Full:
+    cursor = await _read_full(connection, uid=uid)
+    row = await cursor.fetchone()
+    return Full.from_row(row)
+
+
+async def aget(connection, uid: uuid.UUID) -> Snapshot:
+    cursor = await _read(connection, uid=uid)
+    row = await cursor.fetchone()
+    return Snapshot.from_row(row)
 
 
 async def get_by_state(
@@ -132,6 +380,75 @@ async def get_by_state(
         return Snapshot.from_row(row)
 
 
+async def listmany_due_retries(
+    connection, size: int, *, now: datetime.datetime
+) -> typing.Tuple[Ready, ...]:
+    """List the snapshots waiting for a retry which may run by now."""
+    cursor = await _read_due_retries(connection, size, now=now)
+    return tuple(Ready.from_row(row) for row in await cursor.fetchall())
+
+
+async def get_latest_capture(
+    connection, *, webpage_uid: uuid.UUID, strategy: enum.Enum
+) -> typing.Optional[Snapshot]:
+    """Get the newest succeeded snapshot which stored an output of its own."""
+    cursor = await _read_latest_capture(
+        connection, webpage_uid=webpage_uid, strategy=strategy
+    )
+    if row := await cursor.fetchone():
+        return Snapshot.from_row(row)
+
+
+async def listmany_latest_by_webpages(
+    connection, webpage_uids: typing.Iterable[uuid.UUID]
+) -> typing.Tuple[Latest, ...]:
+    """List the latest pending, executing and succeeded snapshots at once.
+
+    There is at most one of each state for every strategy of every webpage.
+    """
+    cursor = await _read_latest_by_webpages(connection, webpage_uids=webpage_uids)
+    return tuple(Latest.from_row(row) for row in await cursor.fetchall())
+
+
+async def listmany_ready(
+    connection, size: int, *, priority: enum.Enum, after: int = 0
+) -> typing.Tuple[Ready, ...]:
+    """List pending snapshots whose source, if any, is already finished.
+
+    Only snapshots of the given priority past the given position are listed,
+    see Ready.rowid, so each priority class is walked on its own.
+    """
+    cursor = await _read_ready(connection, size, priority=priority, after=after)
+    return tuple(Ready.from_row(row) for row in await cursor.fetchall())
+
+
+async def promote(
+    connection,
+    uid: uuid.UUID,
+    *,
+    priority: enum.Enum,
+    transfer_uid: typing.Optional[uuid.UUID],
+) -> bool:
+    """Hand a pending snapshot over to a more urgent job.
+
+    The snapshot takes the priority and transfer of the job, so it is run
+    in its class and flow. Nothing happens, and False is returned, if the
+    snapshot started or is as urgent already.
+    """
+    cursor = await connection.execute(
+        "UPDATE snapshot SET priority_uid=:priority_uid,"
+        " transfer_uid=COALESCE(:transfer_uid, transfer_uid)"
+        " WHERE uid=:uid AND job_state_uid=:pending AND priority_uid > :priority_uid",
+        dict(
+            uid=uid.hex,
+            priority_uid=priority.value,
+            transfer_uid=transfer_uid and transfer_uid.hex,
+            pending=dao.job.JobState.PENDING.value,
+        ),
+    )
+    return cursor.rowcount == 1
+
+
 def _update_state_by_uid(connection, *, uid: uuid.UUID, job_state: enum.Enum):
     return connection.execute(
         "UPDATE snapshot SET job_state_uid=:job_state_uid WHERE uid=:uid",
@@ -144,20 +461,94 @@ def _update_result_by_uid(
     *,
     uid: uuid.UUID,
     job_state: enum.Enum,
-    result: str,
-    stdout: typing.Optional[str] = None,
-    stderr: typing.Optional[str] = None,
+    stdout_digest: typing.Optional[str] = None,
+    stderr_digest: typing.Optional[str] = None,
+    simhash: typing.Optional[int] = None,
+    same_as_uid: typing.Optional[uuid.UUID] = None,
 ):
     return connection.execute(
         "UPDATE snapshot"
-        " SET job_state_uid=:job_state_uid,result=:result,stdout=:stdout,stderr=:stderr"
+        " SET job_state_uid=:job_state_uid,"
+        "stdout_digest=:stdout_digest,stderr_digest=:stderr_digest,"
+        "simhash=:simhash,same_as_uid=:same_as_uid"
         " WHERE uid=:uid",
         dict(
             uid=uid.hex,
             job_state_uid=job_state.value,
-            result=result,
-            stdout=stdout,
-            stderr=stderr,
+            stdout_digest=stdout_digest,
+            stderr_digest=stderr_digest,
+            simhash=simhash,
+            same_as_uid=same_as_uid.hex if same_as_uid else None,
+        ),
+    )
+
+
+async def _write_result(
+    connection, *, uid: uuid.UUID, result: typing.Optional[str]
+) -> None:
+    if result is None:
+        await connection.execute(
+            "DELETE FROM snapshot_result WHERE snapshot_uid=:uid", dict(uid=uid.hex)
+        )
+    else:
+        await connection.execute(
+            "INSERT INTO snapshot_result (snapshot_uid, result)"
+            " VALUES (:uid, :result)"
+            " ON CONFLICT (snapshot_uid) DO UPDATE SET result=excluded.result",
+            dict(uid=uid.hex, result=result),
+        )
+
+
+async def start(connection, *, uid: uuid.UUID):
+    """Mark the snapshot as executing, counting one more attempt."""
+    await connection.execute(
+        "UPDATE snapshot"
+        " SET job_state_uid=:executing, attempt=attempt + 1, not_before=NULL"
+        " WHERE uid=:uid",
+        dict(uid=uid.hex, executing=dao.job.JobState.EXECUTING.value),
+    )
+
+
+async def retry(
+    connection,
+    *,
+    uid: uuid.UUID,
+    not_before: datetime.datetime,
+    result: typing.Optional[str] = None,
+):
+    """Put the snapshot back in the queue, to run no sooner than not_before.
+
+    The result of the failed attempt is kept for reference.
+    """
+    await _write_result(connection, uid=uid, result=result)
+    await connection.execute(
+        "UPDATE snapshot"
+        " SET job_state_uid=:pending, not_before=:not_before"
+        " WHERE uid=:uid",
+        dict(
+            uid=uid.hex,
+            pending=dao.job.JobState.PENDING.value,
+            not_before=_format(not_before),
+        ),
+    )
+
+
+async def recover(connection):
+    """Deal with the snapshots interrupted by a restart of the daemon.
+
+    They are tried again, right away, while they have attempts left.
+    """
+    max_attempts = json.dumps({s.value: s.max_attempts for s in dao.strategy.Strategy})
+    await connection.execute(
+        "UPDATE snapshot SET job_state_uid=CASE"
+        " WHEN attempt < json_extract(:max_attempts, '$.\"' || strategy_uid || '\"')"
+        " THEN :pending ELSE :failed END"
+        " WHERE job_state_uid=:executing",
+        dict(
+            max_attempts=max_attempts,
+            pending=dao.job.JobState.PENDING.value,
+            failed=dao.job.JobState.FAILED.value,
+            executing=dao.job.JobState.EXECUTING.value,
         ),
     )
 
@@ -175,17 +566,21 @@ async def update(
     uid: uuid.UUID,
     job_state: enum.Enum,
     result: typing.Optional[str] = None,
-    stdout: typing.Optional[str] = None,
-    stderr: typing.Optional[str] = None,
+    stdout_digest: typing.Optional[str] = None,
+    stderr_digest: typing.Optional[str] = None,
+    simhash: typing.Optional[int] = None,
+    same_as_uid: typing.Optional[uuid.UUID] = None,
 ):
     if result:
+        await _write_result(connection, uid=uid, result=result)
         await _update_result_by_uid(
             connection,
             uid=uid,
             job_state=job_state,
-            result=result,
-            stdout=stdout,
-            stderr=stderr,
+            stdout_digest=stdout_digest,
+            stderr_digest=stderr_digest,
+            simhash=simhash,
+            same_as_uid=same_as_uid,
         )
     else:
         await _update_state_by_uid(connection, uid=uid, job_state=job_state)
@@ -195,7 +590,7 @@ async def listmany_ready_for_title_update(
     connection, size: int
 ) -> typing.Tuple[Snapshot, ...]:
     cursor = await connection.execute(
-        "SELECT s.* from snapshot as s"
+        f"SELECT {_SELECT_S} from snapshot as s"
         " JOIN webpage as w ON s.webpage_uid=w.uid"
         " JOIN job_state as j ON s.job_state_uid=j.uid"
         " JOIN strategy as t on s.strategy_uid=t.uid"
@@ -203,22 +598,87 @@ async def listmany_ready_for_title_update(
         " AND t.name='title'"
         " AND w.title is NULL"
         " ORDER BY s.creation_time DESC"
+        " LIMIT :size",
+        dict(size=size),
     )
-    return tuple(Snapshot.from_row(row) for row in await cursor.fetchmany(size))
+    return tuple(Snapshot.from_row(row) for row in await cursor.fetchall())
 
 
 async def listmany_ready_for_archivedotorg_update(
     connection, size: int
 ) -> typing.Tuple[Snapshot, ...]:
     cursor = await connection.execute(
-        "SELECT s.* from snapshot as s"
+        f"SELECT {_SELECT_S} from snapshot as s"
         " JOIN webpage as w ON s.webpage_uid=w.uid"
         " JOIN job_state as j ON s.job_state_uid=j.uid"
         " JOIN strategy as t on s.strategy_uid=t.uid"
         " WHERE j.name='SUCCEEDED'"
         " AND t.name='internet_archive'"
         " AND w.internet_archive is NULL"
-        " AND json_extract(result, '$.rc')=0"
         " ORDER BY s.creation_time DESC"
+        " LIMIT :size",
+        dict(size=size),
+    )
+    return tuple(Snapshot.from_row(row) for row in await cursor.fetchall())
+
+
+def _read_resource_usage(connection):
+    return connection.execute(
+        "SELECT strategy_uid, COUNT(*) AS count,"
+        " TOTAL(json_extract(result, '$.usage.wall_time')) AS wall_time,"
+        " TOTAL(json_extract(result, '$.usage.user_time')) AS user_time,"
+        " TOTAL(json_extract(result, '$.usage.system_time')) AS system_time,"
+        " MAX(json_extract(result, '$.usage.max_rss')) AS max_rss,"
+        " SUM(json_extract(result, '$.usage.stdout_size')) AS stdout_size,"
+        " SUM(json_extract(result, '$.usage.stderr_size')) AS stderr_size"
+        " FROM snapshot as s"
+        " JOIN snapshot_result as r ON r.snapshot_uid=s.uid"
+        " WHERE json_extract(result, '$.usage') IS NOT NULL"
+        " GROUP BY strategy_uid"
+        " ORDER BY strategy_uid"
+    )
+
+
+@dataclasses.dataclass
+class Duration:
+    """Wall time spent by the agent running a succeeded snapshot."""
+
+    strategy: "dao.strategy.Strategy"
+    url: str
+    wall_time: float
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row):
+        return cls(
+            strategy=dao.strategy.Strategy(row["strategy_uid"]),
+            url=row["url"],
+            wall_time=row["wall_time"],
+        )
+
+
+async def listmany_recent_durations(
+    connection, size: int
+) -> typing.Tuple[Duration, ...]:
+    """List how long the latest succeeded snapshots took, newest first."""
+    cursor = await connection.execute(
+        "SELECT s.strategy_uid, w.url,"
+        " json_extract(r.result, '$.usage.wall_time') AS wall_time"
+        " FROM snapshot as s"
+        " JOIN snapshot_result as r ON r.snapshot_uid=s.uid"
+        " JOIN webpage as w ON w.uid=s.webpage_uid"
+        " WHERE s.job_state_uid=:succeeded AND wall_time IS NOT NULL"
+        " ORDER BY s.rowid DESC"
+        " LIMIT :size",
+        dict(succeeded=dao.job.JobState.SUCCEEDED.value, size=size),
     )
-    return tuple(Snapshot.from_row(row) for row in await cursor.fetchmany(size))
+    return tuple(Duration.from_row(row) for row in await cursor.fetchall())
+
+
+def listmany_resource_usage(connection) -> typing.Tuple[ResourceUsage, ...]:
+    """Aggregate the resource usage reported by agents for each strategy.
+
+    Times are totals in seconds, sizes are totals in bytes and max_rss is
+    the peak resident set size in bytes among all the snapshots.
+    """
+    cursor = _read_resource_usage(connection)
+    return tuple(ResourceUsage.from_row(row) for row in cursor.fetchall())
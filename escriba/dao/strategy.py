@@ -16,6 +16,7 @@
     You should have received a copy of the GNU Affero General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
+import datetime
 import enum
 import logging
 
@@ -27,6 +28,7 @@ class Strategy(enum.Enum):
     internet_archive = 1
     title = 2
     favicon = 3
+    fetch = 4
 
     # simple extractors
     curl = 10
@@ -47,6 +49,75 @@ class Strategy(enum.Enum):
     git = 40
     ytdlp = 41
 
+    @property
+    def consumes_body(self) -> bool:
+        """Whether the strategy reads the body retrieved by the fetch strategy.
+
+        Such strategies wait for the fetch and take a reference to its body
+        instead of downloading the page once again. Only the extractors
+        accepting that reference may be listed here.
+        """
+        return self == self.title
+
+    @property
+    def max_attempts(self) -> int:
+        """How many times a snapshot may run before failing for good.
+
+        Only failures deemed transient by the agent are tried again.
+        Browser and media strategies are costly, so they give up sooner.
+        """
+        if self == self.internet_archive:
+            max_attempts = 5
+        elif self.value < 20 or self == self.git:
+            max_attempts = 3
+        else:
+            max_attempts = 2
+
+        return max_attempts
+
+    @property
+    def freshness(self) -> datetime.timedelta:
+        """How long a successful capture spares running the strategy again.
+
+        Details about the page hardly change, while its contents may change
+        at any time. Downloading media is expensive enough to wait longer.
+        """
+        if self in (self.internet_archive, self.title, self.favicon):
+            freshness = datetime.timedelta(days=1)
+        elif self in (self.git, self.ytdlp):
+            freshness = datetime.timedelta(days=1)
+        else:
+            freshness = datetime.timedelta(hours=1)
+
+        return freshness
+
+    @property
+    def media_type(self) -> str:
+        """Media type of what the strategy writes to stdout."""
+        if self in (self.fetch, self.internet_archive, self.title):
+            media_type = "text/plain"
+        elif self == self.favicon:
+            media_type = "image/x-icon"
+        elif self == self.warc:
+            media_type = "application/warc"
+        elif self == self.pdf:
+            media_type = "application/pdf"
+        elif self == self.screenshot:
+            media_type = "image/png"
+        elif self in (
+            self.curl,
+            self.wget,
+            self.dom,
+            self.singlefile,
+            self.readability,
+            self.mercury,
+        ):
+            media_type = "text/html"
+        else:
+            media_type = "application/octet-stream"
+
+        return media_type
+
     @property
     def timeout(self) -> int:
         if self.value < 20:  # informational or simple strategies
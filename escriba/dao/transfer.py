@@ -16,59 +16,71 @@
     You should have received a copy of the GNU Affero General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
+import collections
 import dataclasses
 import datetime
+import json
 import logging
-import sqlite3
 import typing
 import uuid
 
+import escriba.dao as dao
+
 logger = logging.getLogger(__name__)
 
 
-def create(connection, *, user_input: str) -> uuid.UUID:
+def create(
+    connection,
+    *,
+    user_input: str,
+    priority: "dao.job.Priority" = dao.job.Priority.INTERACTIVE,
+) -> uuid.UUID:
     uid = uuid.uuid4()
     connection.execute(
-        "INSERT INTO transfer (uid, user_input) VALUES (:uid, :user_input);",
-        dict(uid=uid.hex, user_input=user_input),
+        "INSERT INTO transfer (uid, user_input, priority_uid)"
+        " VALUES (:uid, :user_input, :priority_uid);",
+        dict(uid=uid.hex, user_input=user_input, priority_uid=priority.value),
     )
     return uid
 
 
-def _read(connection, *, uid: uuid.UUID = None):
-    if uid:
-        cursor = connection.execute(
-            "SELECT * from transfer WHERE uid=:uid", dict(uid=uid.hex)
-        )
-    else:
-        cursor = connection.execute(
-            "SELECT * from transfer ORDER BY creation_time DESC"
-        )
-    return cursor
+def _read(connection, *, uid: uuid.UUID):
+    return connection.execute(
+        "SELECT * from transfer WHERE uid=:uid", dict(uid=uid.hex)
+    )
 
 
-@dataclasses.dataclass
-class Transfer:
-    uid: uuid.UUID
-    creation_time: datetime.datetime
-    user_input: str
+# Newest first, ties broken by insertion order, along transfer_creation_time.
+_PAGE_KEY = ("creation_time", "rowid")
 
-    @classmethod
-    def from_row(cls, row: sqlite3.Row):
-        return cls(**_fields_from_row(row))
+
+def _read_page(connection, size: int, *, token: typing.Optional[str]):
+    condition, order, params = dao.page.clause(_PAGE_KEY, token)
+    return connection.execute(
+        f"SELECT *, rowid from transfer WHERE {condition} ORDER BY {order}"
+        " LIMIT :size",
+        dict(params, size=size + 1),
+    )
 
 
-def _fields_from_row(row: sqlite3.Row):
-    return dict(
-        uid=uuid.UUID(row["uid"]),
-        creation_time=datetime.datetime.fromisoformat(row["creation_time"]),
-        user_input=row["user_input"],
+@dao.model.slotted
+class Transfer(dao.model.Model):
+    uid: uuid.UUID = dao.model.Field(uuid.UUID)
+    creation_time: datetime.datetime = dao.model.Field(datetime.datetime.fromisoformat)
+    user_input: str = dao.model.Field(default="")
+    priority: "dao.job.Priority" = dao.model.Field(
+        dao.job.Priority, column="priority_uid", default=None
     )
 
 
-def listmany(connection, size: int) -> typing.Tuple[Transfer, ...]:
-    cursor = _read(connection)
-    return tuple(Transfer.from_row(row) for row in cursor.fetchmany(size))
+def listmany(
+    connection, size: int, *, token: typing.Optional[str] = None
+) -> "dao.page.Page[Transfer]":
+    """List a page of transfers, newest first, starting from the first page."""
+    cursor = _read_page(connection, size, token=token)
+    return dao.page.make(
+        cursor.fetchall(), size, token, columns=_PAGE_KEY, build=Transfer.from_row
+    )
 
 
 def get(connection, uid: uuid.UUID) -> Transfer:
@@ -81,3 +93,91 @@ async def aget(connection, uid: uuid.UUID) -> Transfer:
     cursor = await _read(connection, uid=uid)
     row = await cursor.fetchone()
     return Transfer.from_row(row)
+
+
+@dataclasses.dataclass
+class Progress:
+    """How many snapshots are in each state.
+
+    Reused snapshots were captured for someone else and count as done. The
+    ones reused while still on their way count in their state until then.
+    """
+
+    pending: int = 0
+    executing: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    reused: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.pending + self.executing + self.done
+
+    @property
+    def done(self) -> int:
+        return self.succeeded + self.failed + self.reused
+
+    def add(
+        self, job_state: "dao.job.JobState", count: int, *, reused: bool = False
+    ) -> None:
+        if reused and job_state == dao.job.JobState.SUCCEEDED:
+            name = "reused"
+        else:
+            name = job_state.name.lower()
+        setattr(self, name, getattr(self, name) + count)
+
+
+async def add_reused(connection, uid: uuid.UUID, *, snapshot_uid: uuid.UUID) -> None:
+    """Count a snapshot the transfer reused in its progress."""
+    await connection.execute(
+        "INSERT INTO transfer_reuse VALUES (:uid, :snapshot_uid)"
+        " ON CONFLICT DO NOTHING",
+        dict(uid=uid.hex, snapshot_uid=snapshot_uid.hex),
+    )
+
+
+def _read_progress(connection, *, uids: typing.Iterable[uuid.UUID]):
+    # Reused snapshots the transfer asked for itself are counted already.
+    return connection.execute(
+        "WITH wanted (uid) AS (SELECT value FROM json_each(:uids))"
+        " SELECT transfer_uid, strategy_uid, job_state_uid, count, 0 AS reused"
+        " FROM transfer_progress"
+        " WHERE transfer_uid IN wanted AND count > 0"
+        " UNION ALL"
+        " SELECT r.transfer_uid, s.strategy_uid, s.job_state_uid, COUNT(*), 1"
+        " FROM transfer_reuse AS r JOIN snapshot AS s ON s.uid = r.snapshot_uid"
+        " WHERE r.transfer_uid IN wanted AND s.transfer_uid IS NOT r.transfer_uid"
+        " GROUP BY r.transfer_uid, s.strategy_uid, s.job_state_uid",
+        dict(uids=json.dumps([uid.hex for uid in uids])),
+    )
+
+
+def get_progress(
+    connection, uid: uuid.UUID
+) -> typing.Dict["dao.strategy.Strategy", Progress]:
+    """Progress of the snapshots of a transfer, per strategy."""
+    progress = collections.defaultdict(Progress)
+    for row in _read_progress(connection, uids=(uid,)):
+        progress[dao.strategy.Strategy(row["strategy_uid"])].add(
+            dao.job.JobState(row["job_state_uid"]),
+            row["count"],
+            reused=row["reused"],
+        )
+    return dict(sorted(progress.items(), key=lambda item: item[0].value))
+
+
+def getmany_progress(
+    connection, uids: typing.Iterable[uuid.UUID]
+) -> typing.Dict[uuid.UUID, Progress]:
+    """Progress of the snapshots of each transfer, all strategies together.
+
+    Transfers without snapshots yet get an empty progress.
+    """
+    progress = collections.defaultdict(Progress)
+    for row in _read_progress(connection, uids=uids):
+        progress[uuid.UUID(row["transfer_uid"])].add(
+            dao.job.JobState(row["job_state_uid"]),
+            row["count"],
+            reused=row["reused"],
+        )
+    return progress
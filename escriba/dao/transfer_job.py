@@ -16,11 +16,9 @@
     You should have received a copy of the GNU Affero General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
-import dataclasses
 import datetime
 import enum
 import logging
-import sqlite3
 import typing
 import uuid
 
@@ -29,17 +27,15 @@ import escriba.dao as dao
 logger = logging.getLogger(__name__)
 
 
-@dataclasses.dataclass
-class TransferJob:
-    uid: uuid.UUID
-    creation_time: datetime.datetime
-    transfer_uid: uuid.UUID
-    job_state: enum.Enum
-    modified_time: typing.Optional[datetime.datetime] = None
-
-    @classmethod
-    def from_row(cls, row: sqlite3.Row):
-        return cls(**_fields_from_row(row))
+@dao.model.slotted
+class TransferJob(dao.model.Model):
+    uid: uuid.UUID = dao.model.Field(uuid.UUID)
+    creation_time: datetime.datetime = dao.model.Field(datetime.datetime.fromisoformat)
+    transfer_uid: uuid.UUID = dao.model.Field(uuid.UUID)
+    job_state: enum.Enum = dao.model.Field(dao.job.JobState, column="job_state_uid")
+    modified_time: typing.Optional[datetime.datetime] = dao.model.Field(
+        datetime.datetime.fromisoformat, default=None
+    )
 
 
 def create(
@@ -58,12 +54,13 @@ def create(
     return uid
 
 
-def _read_by_transfer(connection, *, transfer_uid: uuid.UUID):
+def _read_by_transfer(connection, size: int, *, transfer_uid: uuid.UUID):
     return connection.execute(
         "SELECT * from transfer_job"
         " WHERE transfer_uid=:transfer_uid"
-        " ORDER BY creation_time DESC",
-        dict(transfer_uid=transfer_uid.hex),
+        " ORDER BY creation_time DESC"
+        " LIMIT :size",
+        dict(transfer_uid=transfer_uid.hex, size=size),
     )
 
 
@@ -76,23 +73,11 @@ def _read_by_state(connection, *, job_state: enum.Enum):
     )
 
 
-def _fields_from_row(row: sqlite3.Row):
-    fields = dict(
-        uid=uuid.UUID(row["uid"]),
-        creation_time=datetime.datetime.fromisoformat(row["creation_time"]),
-        job_state=dao.job.JobState(row["job_state_uid"]),
-        transfer_uid=uuid.UUID(row["transfer_uid"]),
-    )
-    if raw_modified_time := row["modified_time"]:
-        fields["modified_time"] = datetime.datetime.fromisoformat(raw_modified_time)
-    return fields
-
-
 def listmany_by_transfer(
     connection, size: int, *, transfer_uid: uuid.UUID
 ) -> typing.Tuple[TransferJob, ...]:
-    cursor = _read_by_transfer(connection, transfer_uid=transfer_uid)
-    return tuple(TransferJob.from_row(row) for row in cursor.fetchmany(size))
+    cursor = _read_by_transfer(connection, size, transfer_uid=transfer_uid)
+    return tuple(TransferJob.from_row(row) for row in cursor.fetchall())
 
 
 async def get_by_state(
@@ -116,6 +101,6 @@ async def update(connection, *, uid: uuid.UUID, job_state: enum.Enum):
 
 async def update_state(connection, old_state: enum.Enum, new_state: enum.Enum):
     return await connection.execute(
-        "UPDATE transfer_job SET job_state_uid=:old_uid WHERE job_state_uid=:new_uid",
+        "UPDATE transfer_job SET job_state_uid=:new_uid WHERE job_state_uid=:old_uid",
         dict(old_uid=old_state.value, new_uid=new_state.value),
     )
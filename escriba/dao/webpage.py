@@ -16,31 +16,37 @@
     You should have received a copy of the GNU Affero General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
-import dataclasses
 import datetime
+import hashlib
+import json
 import logging
-import sqlite3
 import typing
 import urllib.parse
 import uuid
 
+import escriba.dao as dao
+
 logger = logging.getLogger(__name__)
 
 
-@dataclasses.dataclass
-class Webpage:
-    uid: uuid.UUID
-    url: urllib.parse.SplitResult
-    creation_time: datetime.datetime
-    transfer_job_uid: uuid.UUID
-    transfer_uid: uuid.UUID
-    title: typing.Optional[str] = None
-    internet_archive: typing.Optional[urllib.parse.SplitResult] = None
-    modified_time: typing.Optional[datetime.datetime] = None
-    alt_title: str = dataclasses.field(init=False)
-
-    def __post_init__(self):
-        self.alt_title = "".join(
+@dao.model.slotted
+class Webpage(dao.model.Model):
+    uid: uuid.UUID = dao.model.Field(uuid.UUID)
+    url: urllib.parse.SplitResult = dao.model.Field(urllib.parse.urlsplit)
+    creation_time: datetime.datetime = dao.model.Field(datetime.datetime.fromisoformat)
+    transfer_job_uid: uuid.UUID = dao.model.Field(uuid.UUID)
+    transfer_uid: uuid.UUID = dao.model.Field(uuid.UUID)
+    title: typing.Optional[str] = dao.model.Field(default=None)
+    internet_archive: typing.Optional[urllib.parse.SplitResult] = dao.model.Field(
+        urllib.parse.urlsplit, default=None
+    )
+    modified_time: typing.Optional[datetime.datetime] = dao.model.Field(
+        datetime.datetime.fromisoformat, default=None
+    )
+
+    @property
+    def alt_title(self) -> str:
+        return "".join(
             (
                 self.url.netloc,
                 self.url.path,
@@ -55,67 +61,174 @@ class Webpage:
             return self.title
         return self.alt_title
 
-    @classmethod
-    def from_row(cls, row: sqlite3.Row):
-        return cls(**_fields_from_row(row))
 
+def _url_key(url: str) -> int:
+    """Hash a URL into the signed 64 bit integer that sqlite stores."""
+    digest = hashlib.blake2b(url.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
 
-async def create(
-    connection, *, url: urllib.parse.SplitResult, transfer_job_uid: uuid.UUID
-):
-    url = urllib.parse.urlunsplit(url)
+
+def _keyed(urls: typing.Iterable[str]) -> str:
+    return json.dumps([(_url_key(url), url) for url in urls])
+
+
+async def aget_uids_by_url(
+    connection, urls: typing.Collection[str]
+) -> typing.Dict[str, uuid.UUID]:
+    """Resolve in one query the uid of those URLs which are known."""
     cursor = await connection.execute(
-        "SELECT uid FROM webpage WHERE url=:url", dict(url=url)
+        "SELECT w.uid, w.url FROM json_each(:urls) AS u"
+        " JOIN webpage AS w ON w.url_key=json_extract(u.value, '$[0]')"
+        " AND w.url=json_extract(u.value, '$[1]')",
+        dict(urls=_keyed(urls)),
     )
-    row = await cursor.fetchone()
-    if row:
-        uid = uuid.UUID(row["uid"])
-    else:
-        uid = uuid.uuid4()
-        await connection.execute(
-            "INSERT INTO webpage (uid, url) VALUES (:uid, :url)",
-            dict(uid=uid.hex, url=url),
-        )
-    await connection.execute(
+    return {row["url"]: uuid.UUID(row["uid"]) for row in await cursor.fetchall()}
+
+
+async def create_many(
+    connection, urls: typing.Collection[str]
+) -> typing.Dict[str, uuid.UUID]:
+    """Insert the webpages of URLs believed to be new and return their uids.
+
+    Any URL which turns out to be known already keeps its webpage.
+    """
+    uids = {url: uuid.uuid4() for url in urls}
+    cursor = await connection.execute(
+        "INSERT INTO webpage (uid, url_key, url)"
+        " SELECT json_extract(u.value, '$[2]'), json_extract(u.value, '$[0]'),"
+        " json_extract(u.value, '$[1]') FROM json_each(:webpages) AS u"
+        " WHERE NOT EXISTS (SELECT 1 FROM webpage AS w"
+        " WHERE w.url_key=json_extract(u.value, '$[0]')"
+        " AND w.url=json_extract(u.value, '$[1]'))"
+        " RETURNING url",
+        dict(
+            webpages=json.dumps(
+                [(_url_key(url), url, uid.hex) for url, uid in uids.items()]
+            )
+        ),
+    )
+    created = {row["url"] for row in await cursor.fetchall()}
+    if existing := uids.keys() - created:
+        uids.update(await aget_uids_by_url(connection, existing))
+    return uids
+
+
+async def associate_many(
+    connection, uids: typing.Iterable[uuid.UUID], *, transfer_job_uid: uuid.UUID
+) -> None:
+    await connection.executemany(
         "INSERT INTO webpage_transfer_job_association (webpage_uid, transfer_job_uid)"
         " VALUES (:webpage_uid, :transfer_job_uid)",
-        dict(webpage_uid=uid.hex, transfer_job_uid=transfer_job_uid.hex),
+        (
+            dict(webpage_uid=uid.hex, transfer_job_uid=transfer_job_uid.hex)
+            for uid in uids
+        ),
+    )
+
+
+def iter_urls(connection, *, after: int = 0) -> typing.Iterator[str]:
+    """Yield every URL of the webpages inserted after the given rowid."""
+    cursor = connection.execute(
+        "SELECT url FROM webpage WHERE rowid > :after", dict(after=after)
     )
-    return uid
+    return (row["url"] for row in cursor)
+
+
+def _read_last_rowid(connection):
+    return connection.execute("SELECT ifnull(max(rowid), 0) FROM webpage")
+
+
+def last_rowid(connection) -> int:
+    return _read_last_rowid(connection).fetchone()[0]
+
+
+async def alast_rowid(connection) -> int:
+    cursor = await _read_last_rowid(connection)
+    return (await cursor.fetchone())[0]
 
 
 def listmany_by_transfer(
-    connection, size: int, *, transfer_uid: uuid.UUID
-) -> typing.Tuple[Webpage, ...]:
-    cursor = _read_by_transfer(connection, transfer_uid=transfer_uid)
-    return tuple(Webpage.from_row(row) for row in cursor.fetchmany(size))
-
-
-def _fields_from_row(row: sqlite3.Row):
-    fields = dict(
-        uid=uuid.UUID(row["uid"]),
-        url=urllib.parse.urlsplit(row["url"]),
-        creation_time=datetime.datetime.fromisoformat(row["creation_time"]),
-        transfer_job_uid=uuid.UUID(row["transfer_job_uid"]),
-        transfer_uid=uuid.UUID(row["transfer_uid"]),
+    connection,
+    size: int,
+    *,
+    transfer_uid: uuid.UUID,
+    token: typing.Optional[str] = None,
+) -> "dao.page.Page[Webpage]":
+    """List a page of webpages of the transfer, latest added first."""
+    cursor = _read_by_transfer(connection, size, transfer_uid=transfer_uid, token=token)
+    return dao.page.make(
+        cursor.fetchall(), size, token, columns=_PAGE_KEY, build=Webpage.from_row
     )
-    if raw_modified_time := row["modified_time"]:
-        fields["modified_time"] = datetime.datetime.fromisoformat(raw_modified_time)
-    if raw_title := row["title"]:
-        fields["title"] = raw_title
-    if raw_internet_archive := row["internet_archive"]:
-        fields["internet_archive"] = urllib.parse.urlsplit(raw_internet_archive)
-    return fields
 
 
-def _read_by_transfer(connection, *, transfer_uid: uuid.UUID):
+# Latest added to the transfer first. Webpages are shared among transfers,
+# so their creation time may predate it.
+_PAGE_KEY = ("transfer_job_rowid", "rowid")
+
+
+def _read_by_transfer(
+    connection, size: int, *, transfer_uid: uuid.UUID, token: typing.Optional[str]
+):
+    # Rows are walked job by job, then along the association index. Bounding
+    # each rowid on its own, rather than comparing both at once, lets SQLite
+    # seek the border of the page in both indexes.
+    condition, direction, params = "1", "DESC", {}
+    if token is not None:
+        (job, association), backward = dao.page.decode(token, len(_PAGE_KEY))
+        params = dict(job=job, association=association)
+        if backward:
+            condition = (
+                "j.rowid >= :job AND a.rowid >"
+                " CASE WHEN j.rowid = :job THEN :association ELSE 0 END"
+            )
+            direction = "ASC"
+        else:
+            condition = (
+                "j.rowid <= :job AND a.rowid <"
+                " CASE WHEN j.rowid = :job THEN :association ELSE :max_rowid END"
+            )
+            params["max_rowid"] = 2**63 - 1
     return connection.execute(
-        "SELECT w.*, a.transfer_job_uid, j.transfer_uid from webpage as w"
-        " JOIN webpage_transfer_job_association as a ON a.webpage_uid=w.uid"
-        " JOIN transfer_job as j ON j.uid=a.transfer_job_uid"
-        " WHERE j.transfer_uid=:transfer_uid"
-        " ORDER BY w.creation_time DESC",
-        dict(transfer_uid=transfer_uid.hex),
+        "SELECT w.*, a.transfer_job_uid, j.transfer_uid,"
+        " j.rowid AS transfer_job_rowid, a.rowid"
+        " from transfer_job as j"
+        " JOIN webpage_transfer_job_association as a ON a.transfer_job_uid=j.uid"
+        " JOIN webpage as w ON w.uid=a.webpage_uid"
+        f" WHERE j.transfer_uid=:transfer_uid AND {condition}"
+        f" ORDER BY j.rowid {direction}, a.rowid {direction}"
+        " LIMIT :size",
+        dict(params, transfer_uid=transfer_uid.hex, size=size + 1),
+    )
+
+
+# Relevance first, the higher the better, as pages list items in descending
+# order of their key.
+_SEARCH_KEY = ("s.score", "s.rowid")
+
+
+def _match(terms: str) -> str:
+    """Query matching every term given, whatever characters they hold."""
+    # Quoting keeps the user from writing FTS5 syntax by accident.
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in terms.split())
+
+
+def search(
+    connection, terms: str, size: int, *, token: typing.Optional[str] = None
+) -> dao.page.Page[Webpage]:
+    """Webpages whose title or URL hold every term, the most relevant first."""
+    if not terms.strip():
+        return dao.page.Page(items=())
+    condition, order, params = dao.page.clause(_SEARCH_KEY, token)
+    cursor = connection.execute(
+        "SELECT w.*, s.score, s.rowid AS rowid FROM ("
+        "  SELECT rowid, -rank AS score FROM webpage_search"
+        "  WHERE webpage_search MATCH :match"
+        ") AS s JOIN webpage AS w ON w.rowid=s.rowid"
+        f" WHERE {condition} ORDER BY {order} LIMIT :size",
+        dict(params, match=_match(terms), size=size + 1),
+    )
+    return dao.page.make(
+        cursor.fetchall(), size, token, columns=_SEARCH_KEY, build=Webpage.from_row
     )
 
 
@@ -150,6 +263,6 @@ async def update_title(connection, uid: uuid.UUID, title: str):
 
 async def update_archivedotorg(connection, uid: uuid.UUID, archived_url: str):
     await connection.execute(
-        "UPDATE webpage SET archivedotorg=:archived_url WHERE uid=:uid",
+        "UPDATE webpage SET internet_archive=:archived_url WHERE uid=:uid",
         dict(uid=uid.hex, archived_url=archived_url),
     )
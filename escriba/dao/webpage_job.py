@@ -16,11 +16,9 @@
     You should have received a copy of the GNU Affero General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
-import dataclasses
 import datetime
 import enum
 import logging
-import sqlite3
 import typing
 import uuid
 
@@ -29,82 +27,127 @@ import escriba.dao as dao
 logger = logging.getLogger(__name__)
 
 
-@dataclasses.dataclass
-class WebpageJob:
-    uid: uuid.UUID
-    creation_time: datetime.datetime
-    webpage_uid: uuid.UUID
-    job_state: enum.Enum
-    modified_time: typing.Optional[datetime.datetime] = None
-
-    @classmethod
-    def from_row(cls, row: sqlite3.Row):
-        return cls(**_fields_from_row(row))
+@dao.model.slotted
+class WebpageJob(dao.model.Model):
+    uid: uuid.UUID = dao.model.Field(uuid.UUID)
+    creation_time: datetime.datetime = dao.model.Field(datetime.datetime.fromisoformat)
+    webpage_uid: uuid.UUID = dao.model.Field(uuid.UUID)
+    job_state: enum.Enum = dao.model.Field(dao.job.JobState, column="job_state_uid")
+    modified_time: typing.Optional[datetime.datetime] = dao.model.Field(
+        datetime.datetime.fromisoformat, default=None
+    )
+    priority: "dao.job.Priority" = dao.model.Field(
+        dao.job.Priority, column="priority_uid", default=None
+    )
+    transfer_uid: typing.Optional[uuid.UUID] = dao.model.Field(uuid.UUID, default=None)
 
 
 async def create(
-    connection, *, webpage_uid: uuid.UUID, job_state: enum.Enum
+    connection,
+    *,
+    webpage_uid: uuid.UUID,
+    job_state: enum.Enum,
+    priority: enum.Enum = dao.job.Priority.INTERACTIVE,
+    transfer_uid: typing.Optional[uuid.UUID] = None,
 ) -> uuid.UUID:
     uid = uuid.uuid4()
-    await _create(connection, uid=uid, job_state=job_state, webpage_uid=webpage_uid)
+    await _create(
+        connection,
+        uid=uid,
+        job_state=job_state,
+        webpage_uid=webpage_uid,
+        priority=priority,
+        transfer_uid=transfer_uid,
+    )
     return uid
 
 
 def _create(
-    connection, *, uid: uuid.UUID, job_state: enum.Enum, webpage_uid: uuid.UUID
+    connection,
+    *,
+    uid: uuid.UUID,
+    job_state: enum.Enum,
+    webpage_uid: uuid.UUID,
+    priority: enum.Enum = dao.job.Priority.INTERACTIVE,
+    transfer_uid: typing.Optional[uuid.UUID] = None,
 ):
     return connection.execute(
-        "INSERT INTO webpage_job (uid, webpage_uid, job_state_uid)"
-        " VALUES (:uid, :webpage_uid, :job_state_uid);",
+        "INSERT INTO webpage_job"
+        " (uid, webpage_uid, job_state_uid, priority_uid, transfer_uid)"
+        " VALUES (:uid, :webpage_uid, :job_state_uid, :priority_uid, :transfer_uid);",
         dict(
             uid=uid.hex,
             webpage_uid=webpage_uid.hex,
             job_state_uid=job_state.value,
+            priority_uid=priority.value,
+            transfer_uid=transfer_uid.hex if transfer_uid else None,
         ),
     )
 
 
-def _read_by_webpage(connection, *, webpage_uid: uuid.UUID):
+async def create_many(
+    connection,
+    *,
+    webpage_uids: typing.Iterable[uuid.UUID],
+    job_state: enum.Enum,
+    priority: enum.Enum = dao.job.Priority.INTERACTIVE,
+) -> typing.Tuple[uuid.UUID, ...]:
+    params = [
+        dict(
+            uid=uuid.uuid4().hex,
+            webpage_uid=uid.hex,
+            job_state_uid=job_state.value,
+            priority_uid=priority.value,
+        )
+        for uid in webpage_uids
+    ]
+    await connection.executemany(
+        "INSERT INTO webpage_job (uid, webpage_uid, job_state_uid, priority_uid)"
+        " VALUES (:uid, :webpage_uid, :job_state_uid, :priority_uid);",
+        params,
+    )
+    return tuple(uuid.UUID(p["uid"]) for p in params)
+
+
+def _read_by_webpage(connection, size: int, *, webpage_uid: uuid.UUID):
     return connection.execute(
         "SELECT * from webpage_job"
         " WHERE webpage_uid=:webpage_uid"
-        " ORDER BY creation_time DESC",
-        dict(webpage_uid=webpage_uid.hex),
+        " ORDER BY creation_time DESC"
+        " LIMIT :size",
+        dict(webpage_uid=webpage_uid.hex, size=size),
     )
 
 
-def _read_by_state(connection, *, job_state: enum.Enum):
+def _read_by_state(connection, size: int, *, job_state: enum.Enum):
+    # Most urgent first, then oldest first, straight from the index.
     return connection.execute(
         "SELECT * from webpage_job"
         " WHERE job_state_uid=:job_state_uid"
-        " ORDER BY creation_time DESC",
-        dict(job_state_uid=job_state.value),
-    )
-
-
-def _fields_from_row(row: sqlite3.Row):
-    fields = dict(
-        uid=uuid.UUID(row["uid"]),
-        creation_time=datetime.datetime.fromisoformat(row["creation_time"]),
-        job_state=dao.job.JobState(row["job_state_uid"]),
-        webpage_uid=uuid.UUID(row["webpage_uid"]),
+        " ORDER BY priority_uid, rowid"
+        " LIMIT :size",
+        dict(job_state_uid=job_state.value, size=size),
     )
-    if raw_modified_time := row["modified_time"]:
-        fields["modified_time"] = datetime.datetime.fromisoformat(raw_modified_time)
-    return fields
 
 
 def listmany_by_webpage(
     connection, size: int, *, webpage_uid: uuid.UUID
 ) -> typing.Tuple[WebpageJob, ...]:
-    cursor = _read_by_webpage(connection, webpage_uid=webpage_uid)
-    return tuple(WebpageJob.from_row(row) for row in cursor.fetchmany(size))
+    cursor = _read_by_webpage(connection, size, webpage_uid=webpage_uid)
+    return tuple(WebpageJob.from_row(row) for row in cursor.fetchall())
+
+
+async def listmany_by_state(
+    connection, size: int, *, job_state: enum.Enum
+) -> typing.Tuple[WebpageJob, ...]:
+    cursor = await _read_by_state(connection, size, job_state=job_state)
+    return tuple(WebpageJob.from_row(row) for row in await cursor.fetchall())
 
 
 async def get_by_state(
     connection, *, job_state: enum.Enum
 ) -> typing.Optional[WebpageJob]:
-    cursor = await _read_by_state(connection, job_state=job_state)
+    cursor = await _read_by_state(connection, 1, job_state=job_state)
     if row := await cursor.fetchone():
         return WebpageJob.from_row(row)
 
@@ -122,6 +165,6 @@ async def update(connection, *, uid: uuid.UUID, job_state: enum.Enum):
 
 async def update_state(connection, old_state: enum.Enum, new_state: enum.Enum):
     return await connection.execute(
-        "UPDATE webpage_job SET job_state_uid=:old_uid WHERE job_state_uid=:new_uid",
+        "UPDATE webpage_job SET job_state_uid=:new_uid WHERE job_state_uid=:old_uid",
         dict(old_uid=old_state.value, new_uid=new_state.value),
     )
@@ -17,24 +17,59 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
 import logging
+import re
+import typing
 
 import flask
 
+import escriba.config as config
 import escriba.db as db
 import escriba.dao as dao
+import escriba.storage as storage
 
 logger = logging.getLogger(__name__)
 
 bp = flask.Blueprint("dashboard", __name__)
 
+# Transfers with more URLs than this are imports, not someone waiting.
+BULK_SIZE = 20
+
+# Connections for the pages which only read, while writes take their own.
+_pool = db.pool.Pool()
+
+# Items on each page of a listing.
+PAGE_SIZE = 20
+
+# Headers of an archived response which still make sense when replaying it.
+_REPLAY_HEADERS = frozenset(("content-encoding", "content-language", "content-type"))
+# Archived pages are served from the origin of the dashboard, whose forms
+# take no credentials. A sandbox without scripts, forms nor the origin of
+# the dashboard keeps any page captured from acting on it.
+_REPLAY_POLICY = (
+    ("Content-Security-Policy", "sandbox"),
+    ("X-Content-Type-Options", "nosniff"),
+)
+
+
+@bp.errorhandler(dao.page.InvalidToken)
+def invalid_token_handler(error):
+    return str(error), 400
+
+
+def _page_token() -> typing.Optional[str]:
+    return flask.request.args.get("page")
+
 
 @bp.route("/", methods=["GET", "POST"])
 def index_view():
     if flask.request.method == "POST":
         urls = flask.request.form["urls"]
         # TODO assert user input has lower and upper boundaries
+        priority = dao.job.Priority.INTERACTIVE
+        if sum(1 for line in urls.splitlines() if line.strip()) > BULK_SIZE:
+            priority = dao.job.Priority.BULK
         with db.connect() as con:
-            transfer_uid = dao.transfer.create(con, user_input=urls)
+            transfer_uid = dao.transfer.create(con, user_input=urls, priority=priority)
             job_state_uid = dao.job.JobState.PENDING
             _ = dao.transfer_job.create(
                 con,
@@ -45,23 +80,103 @@ def index_view():
 
         return flask.redirect(flask.url_for("dashboard.index_view"))
 
-    with db.connect() as con:
-        transfers = dao.transfer.listmany(con, 20)
+    with _pool.connection() as con:
+        transfers = dao.transfer.listmany(con, PAGE_SIZE, token=_page_token())
+        progress = dao.transfer.getmany_progress(con, (t.uid for t in transfers))
 
-    return flask.render_template("index.html", transfers=transfers)
+    return flask.render_template("index.html", transfers=transfers, progress=progress)
 
 
 @bp.route("/transfer/<uuid:transfer_uid>")
 def transfer_view(transfer_uid):
-    with db.connect() as con:
+    with _pool.connection() as con:
         transfer = dao.transfer.get(con, uid=transfer_uid)
-        webpages = dao.webpage.listmany_by_transfer(con, 20, transfer_uid=transfer_uid)
-    return flask.render_template("transfer.html", transfer=transfer, webpages=webpages)
+        progress = dao.transfer.get_progress(con, uid=transfer_uid)
+        webpages = dao.webpage.listmany_by_transfer(
+            con, PAGE_SIZE, transfer_uid=transfer_uid, token=_page_token()
+        )
+    return flask.render_template(
+        "transfer.html", transfer=transfer, progress=progress, webpages=webpages
+    )
 
 
 @bp.route("/webpage/<uuid:webpage_uid>")
 def webpage_view(webpage_uid):
-    with db.connect() as con:
+    with _pool.connection() as con:
         webpage = dao.webpage.get(con, uid=webpage_uid)
-        snapshots = dao.snapshot.listmany_by_webpage(con, 20, webpage_uid=webpage_uid)
-    return flask.render_template("webpage.html", webpage=webpage, snapshots=snapshots)
+        snapshots = dao.snapshot.listmany_by_webpage(
+            con, PAGE_SIZE, webpage_uid=webpage_uid, token=_page_token()
+        )
+        schedule = dao.schedule.get(con, webpage_uid=webpage_uid)
+    return flask.render_template(
+        "webpage.html",
+        webpage=webpage,
+        snapshots=snapshots,
+        schedule=schedule,
+        recurrences=dao.schedule.Recurrence,
+    )
+
+
+@bp.route("/webpage/<uuid:webpage_uid>/schedule", methods=["POST"])
+def schedule_view(webpage_uid):
+    name = flask.request.form.get("recurrence")
+    with db.connect() as con:
+        if name in dao.schedule.Recurrence.__members__:
+            dao.schedule.update(
+                con,
+                webpage_uid=webpage_uid,
+                recurrence=dao.schedule.Recurrence[name],
+            )
+        else:
+            dao.schedule.remove(con, webpage_uid=webpage_uid)
+        con.commit()
+
+    return flask.redirect(
+        flask.url_for("dashboard.webpage_view", webpage_uid=webpage_uid)
+    )
+
+
+@bp.route("/search")
+def search_view():
+    terms = flask.request.args.get("q", "")
+    with _pool.connection() as con:
+        webpages = dao.webpage.search(con, terms, PAGE_SIZE, token=_page_token())
+    return flask.render_template("search.html", terms=terms, webpages=webpages)
+
+
+@bp.route("/maintenance")
+def maintenance_view():
+    with _pool.connection() as con:
+        steps = dao.maintenance.listmany(con, PAGE_SIZE, token=_page_token())
+    return flask.render_template("maintenance.html", steps=steps)
+
+
+@bp.route("/replay/<timestamp>/<path:url>")
+def replay_view(timestamp, url):
+    if not timestamp.isdigit() or len(timestamp) > 14:
+        flask.abort(404)
+
+    # The routing merges the slashes after the scheme and drops the query.
+    url = re.sub(r"^(https?):/+", r"\1://", url)
+    if query := flask.request.query_string.decode():
+        url = f"{url}?{query}"
+
+    index = storage.cdxj.Index(config.CDXJ_DIR)
+    if not (entry := index.closest(url, timestamp)):
+        flask.abort(404)
+
+    try:
+        _, block = storage.warc.read_record(
+            entry.filename, entry.offset, entry.length, directory=config.WARC_DIR
+        )
+    except FileNotFoundError:
+        logger.warning("WARC file %s of %s is missing.", entry.filename, url)
+        flask.abort(404)
+    response = storage.warc.parse_response(block)
+    headers = [
+        (name, value)
+        for name, value in response.getheaders()
+        if name.lower() in _REPLAY_HEADERS
+    ]
+    headers.extend(_REPLAY_POLICY)
+    return flask.Response(response.read(), status=response.status, headers=headers)
@@ -18,16 +18,33 @@
 """
 import importlib.resources
 import logging
+import os
 import sqlite3
+import typing
 
 import escriba.config as config
 import escriba.db.connection as connection
+import escriba.db.pool as pool
+import escriba.db.writer as writer
 
 logger = logging.getLogger(__name__)
 
+CHECKPOINT_MODES = ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+AUTO_VACUUM_INCREMENTAL = 2
 
-def connect() -> connection.Connection:
-    """Create and return a connection proxy to the sqlite database."""
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+def connect(*, synchronous: str = "NORMAL") -> connection.Connection:
+    """Create and return a connection proxy to the sqlite database.
+
+    In WAL mode, NORMAL commits may be lost on power failure until the next
+    checkpoint, while FULL syncs the WAL on every commit.
+    Reference: https://www.sqlite.org/pragma.html#pragma_synchronous
+    """
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"Unknown synchronous mode {synchronous!r}.")
 
     def connector() -> sqlite3.Connection:
         logger.debug("Creating a new sqlite3 connection.")
@@ -35,7 +52,7 @@ def connect() -> connection.Connection:
             config.DB_URI, timeout=1, detect_types=sqlite3.PARSE_DECLTYPES
         )
         conn.executescript(
-            "PRAGMA journal_mode=WAL; PRAGMA synchronous = 1; BEGIN; PRAGMA busy_timeout = 30000; END;"
+            f"PRAGMA journal_mode=WAL; PRAGMA synchronous = {synchronous}; BEGIN; PRAGMA busy_timeout = 30000; END;"
         )
         conn.row_factory = sqlite3.Row
         return conn
@@ -43,6 +60,15 @@ def connect() -> connection.Connection:
     return connection.Connection(connector, iter_chunk_size=64)
 
 
+async def optimize(con) -> None:
+    """Let sqlite refresh the statistics its query planner relies on."""
+    # Recommended once in a while for long-lived connections, rather than
+    # only before closing them.
+    # Reference: https://www.sqlite.org/pragma.html#pragma_optimize
+    logger.debug("Attempting to optimize the database.")
+    await con.execute("PRAGMA optimize;")
+
+
 def recreate_database():
     """Clear the existing data and create new tables."""
     create_schema = importlib.resources.read_text(__package__, "schema.sql")
@@ -51,11 +77,32 @@ def recreate_database():
         cursor = con.executescript(create_schema)
         con.commit()
         logger.debug("Recreate database operation returned %r", cursor.fetchone())
+        # The auto_vacuum mode only changes for a database file created before
+        # it was set, unless the file is rebuilt.
+        if con.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            con.executescript("PRAGMA auto_vacuum = INCREMENTAL; VACUUM;")
+
 
+async def checkpoint(con, mode: str = "PASSIVE") -> typing.Tuple[int, int, int]:
+    """Copy the WAL back into the database.
 
-async def checkpoint():
-    """Executes a wal checkpoint pragma."""
-    logger.debug("Running sqlite3 checkpoint.")
+    Return whether it was blocked, the frames in the WAL and the frames
+    copied. Only TRUNCATE shrinks the WAL file, but it waits for writers.
+    Reference: https://www.sqlite.org/pragma.html#pragma_wal_checkpoint
+    """
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError(f"Unknown checkpoint mode {mode!r}.")
+    logger.debug("Running sqlite3 %s checkpoint.", mode)
     # Without this, in aproximately 2 hours, a 176K database generated a WAL of 4M in size.
-    cursor = await connect().executescript("PRAGMA wal_checkpoint;")
-    logger.debug("Checkpoint operation returned %r", cursor.fetchone())
+    cursor = await con.execute(f"PRAGMA wal_checkpoint({mode});")
+    busy, log, checkpointed = await cursor.fetchone()
+    logger.debug("Checkpoint operation returned %r", (busy, log, checkpointed))
+    return busy, log, checkpointed
+
+
+def wal_size() -> int:
+    """Size in bytes of the WAL file, which grows until a TRUNCATE checkpoint."""
+    try:
+        return os.path.getsize(f"{config.DB_URI}-wal")
+    except OSError:
+        return 0
@@ -32,19 +32,6 @@ class Connection(aiosqlite.Connection):
         if self._connection is None:
             return
 
-        # To achieve the best long-term query performance it is recommended
-        # that applications run "PRAGMA optimize" (with no arguments) just
-        # before closing each database connection. This pragma is usually
-        # a no-op or nearly so and is very fast.
-        #
-        # Reference: https://www.sqlite.org/pragma.html#pragma_optimize
-        try:
-            logger.debug("Attempting to optimize the database.")
-            await self._execute(self._conn.executescript, "PRAGMA optimize;")
-        except Exception:
-            logger.warning("Exception occurred while optimizing the database.")
-            raise
-
         try:
             logger.debug("Closing a sqlite3 connection.")
             await self._execute(self._conn.close)
@@ -55,6 +42,18 @@ class Connection(aiosqlite.Connection):
             self._running = False
             self._connection = None
 
+    async def repeat(self, sql: str, times: int) -> None:
+        """Execute sql that many times in a row, in a single round trip.
+
+        For the statements which do a step of their work per execution.
+        """
+
+        def repeat():
+            for _ in range(times):
+                self._conn.execute(sql)
+
+        await self._execute(repeat)
+
     def __enter__(self) -> typing.Self:
         """Connect to the actual sqlite database."""
         if self._connection is None:
@@ -72,19 +71,6 @@ class Connection(aiosqlite.Connection):
         if self._connection is None:
             return
 
-        # To achieve the best long-term query performance it is recommended
-        # that applications run "PRAGMA optimize" (with no arguments) just
-        # before closing each database connection. This pragma is usually
-        # a no-op or nearly so and is very fast.
-        #
-        # Reference: https://www.sqlite.org/pragma.html#pragma_optimize
-        try:
-            logger.debug("Attempting to optimize the database.")
-            self._connection.executescript("PRAGMA optimize;")
-        except Exception:
-            logger.warning("Exception occurred while optimizing the database.")
-            raise
-
         try:
             logger.debug("Closing a sqlite3 connection.")
             self._connection.close()
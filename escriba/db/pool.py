@@ -0,0 +1,125 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import contextlib
+import logging
+import queue
+import sqlite3
+import threading
+import typing
+
+import escriba.config as config
+
+logger = logging.getLogger(__name__)
+
+# Statements each connection keeps prepared, enough for every query of the
+# dashboard.
+CACHED_STATEMENTS = 256
+# Seconds to wait for a connection when all of them are in use.
+TIMEOUT = 30
+
+
+class Pool:
+    """Long-lived read-only connections shared by the threads of the dashboard.
+
+    Opening a connection, and setting it up, costs more than most of the
+    queries of a page. Connections are rather borrowed for a request and
+    returned afterwards, keeping their prepared statements. The most recently
+    returned connection is borrowed first, so the few connections in use
+    stay warm while the others sit idle.
+    """
+
+    def __init__(self, *, size: int = config.DB_POOL_SIZE):
+        self.size = size
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def _open(self) -> sqlite3.Connection:
+        logger.debug("Creating a new read-only sqlite3 connection.")
+        conn = sqlite3.connect(
+            config.DB_URI,
+            timeout=1,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            cached_statements=CACHED_STATEMENTS,
+        )
+        try:
+            conn.executescript("PRAGMA busy_timeout = 30000; PRAGMA query_only = 1;")
+        except Exception:
+            conn.close()
+            raise
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=TIMEOUT)
+        except queue.Empty:
+            raise sqlite3.OperationalError("No database connection available.")
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._opened -= 1
+        try:
+            conn.close()
+        except Exception:
+            logger.warning("Exception occurred while closing connection.")
+
+    @contextlib.contextmanager
+    def connection(self) -> typing.Generator[sqlite3.Connection, None, None]:
+        """Borrow a connection for the duration of the block."""
+        conn = self._acquire()
+        try:
+            yield conn
+        except sqlite3.Error:
+            # The connection may be the culprit, so do not hand it out again.
+            self._discard(conn)
+            raise
+        except BaseException:
+            self._idle.put(conn)
+            raise
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self) -> None:
+        """Close the idle connections, like when the application stops."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
@@ -1,3 +1,7 @@
+-- Let the maintenance daemon give free pages back to the filesystem.
+-- Must come before any table is created, and outside transactions.
+PRAGMA auto_vacuum = INCREMENTAL;
+
 ----------------------------
 --BEGIN script transaction--
 ----------------------------
@@ -15,8 +19,13 @@ DROP TABLE IF EXISTS transfer;
 CREATE TABLE transfer (
     uid TEXT PRIMARY KEY,
     creation_time TEXT DEFAULT (CURRENT_TIMESTAMP || '+00:00') NOT NULL,
-    user_input TEXT
+    user_input TEXT,
+    priority_uid INTEGER DEFAULT 1 NOT NULL,
+
+    FOREIGN KEY (priority_uid)
+        REFERENCES priority (uid)
 );
+CREATE INDEX transfer_creation_time ON transfer (creation_time);
 
 DROP TABLE IF EXISTS transfer_job;
 CREATE TABLE transfer_job (
@@ -31,13 +40,15 @@ CREATE TABLE transfer_job (
     FOREIGN KEY (job_state_uid)
         REFERENCES job_state (uid)
 );
+CREATE INDEX transfer_job_transfer ON transfer_job (transfer_uid);
 CREATE TRIGGER update_transfer_job_modified_time
     AFTER UPDATE
     OF job_state_uid
     ON transfer_job
     FOR EACH ROW
 BEGIN
-    UPDATE transfer_job SET modified_time = (CURRENT_TIMESTAMP || '+00:00');
+    UPDATE transfer_job SET modified_time = (CURRENT_TIMESTAMP || '+00:00')
+        WHERE uid = NEW.uid;
 END;
 
 DROP TABLE IF EXISTS job_state;
@@ -52,22 +63,78 @@ INSERT INTO job_state (uid, name) VALUES
     (4, "FAILED")
 ;
 
+DROP TABLE IF EXISTS priority;
+CREATE TABLE priority (
+    uid INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+INSERT INTO priority (uid, name) VALUES
+    (1, "INTERACTIVE"),
+    (2, "BULK"),
+    (3, "RECURRING")
+;
+
 DROP TABLE IF EXISTS webpage;
 CREATE TABLE webpage (
   uid TEXT PRIMARY KEY,
   creation_time TEXT DEFAULT (CURRENT_TIMESTAMP || '+00:00') NOT NULL,
   modified_time TEXT,
-  url TEXT UNIQUE NOT NULL,
+  -- Canonical URL, identified by a 64 bit hash of it rather than by an
+  -- index of the whole text. Hashes may collide, so the URL is compared too.
+  url TEXT NOT NULL,
+  url_key INTEGER NOT NULL,
   title TEXT,
   internet_archive TEXT
 );
+CREATE INDEX webpage_url_key ON webpage (url_key);
 CREATE TRIGGER update_webpage_modified_time
     AFTER UPDATE
     OF title
     ON webpage
     FOR EACH ROW
 BEGIN
-    UPDATE webpage SET modified_time = (CURRENT_TIMESTAMP || '+00:00');
+    UPDATE webpage SET modified_time = (CURRENT_TIMESTAMP || '+00:00')
+        WHERE uid = NEW.uid;
+END;
+
+-- Full-text index of the webpages, reading their text from webpage itself.
+-- Reference: https://www.sqlite.org/fts5.html#external_content_tables
+DROP TABLE IF EXISTS webpage_search;
+CREATE VIRTUAL TABLE webpage_search USING fts5 (
+    title,
+    url,
+    content = 'webpage',
+    content_rowid = 'rowid',
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+-- Rank a term found in the title above one found in the URL.
+INSERT INTO webpage_search (webpage_search, rank) VALUES ('rank', 'bm25(2.0, 1.0)');
+CREATE TRIGGER webpage_search_insert
+    AFTER INSERT
+    ON webpage
+    FOR EACH ROW
+BEGIN
+    INSERT INTO webpage_search (rowid, title, url)
+        VALUES (NEW.rowid, NEW.title, NEW.url);
+END;
+CREATE TRIGGER webpage_search_update
+    AFTER UPDATE
+    OF title, url
+    ON webpage
+    FOR EACH ROW
+BEGIN
+    INSERT INTO webpage_search (webpage_search, rowid, title, url)
+        VALUES ('delete', OLD.rowid, OLD.title, OLD.url);
+    INSERT INTO webpage_search (rowid, title, url)
+        VALUES (NEW.rowid, NEW.title, NEW.url);
+END;
+CREATE TRIGGER webpage_search_delete
+    AFTER DELETE
+    ON webpage
+    FOR EACH ROW
+BEGIN
+    INSERT INTO webpage_search (webpage_search, rowid, title, url)
+        VALUES ('delete', OLD.rowid, OLD.title, OLD.url);
 END;
 
 DROP TABLE IF EXISTS webpage_transfer_job_association;
@@ -76,6 +143,8 @@ CREATE TABLE webpage_transfer_job_association (
     transfer_job_uid TEXT,
     PRIMARY KEY (webpage_uid, transfer_job_uid)
 );
+CREATE INDEX webpage_transfer_job_association_transfer_job
+    ON webpage_transfer_job_association (transfer_job_uid);
 
 DROP TABLE IF EXISTS webpage_job;
 CREATE TABLE webpage_job (
@@ -84,19 +153,27 @@ CREATE TABLE webpage_job (
     modified_time TEXT,
     webpage_uid TEXT NOT NULL,
     job_state_uid INTEGER NOT NULL,
+    priority_uid INTEGER DEFAULT 1 NOT NULL,
+    transfer_uid TEXT,
 
     FOREIGN KEY (webpage_uid)
         REFERENCES webpage (uid),
     FOREIGN KEY (job_state_uid)
-        REFERENCES job_state (uid)
+        REFERENCES job_state (uid),
+    FOREIGN KEY (priority_uid)
+        REFERENCES priority (uid),
+    FOREIGN KEY (transfer_uid)
+        REFERENCES transfer (uid)
 );
+CREATE INDEX webpage_job_job_state ON webpage_job (job_state_uid, priority_uid);
 CREATE TRIGGER update_webpage_job_modified_time
     AFTER UPDATE
     OF job_state_uid
     ON webpage_job
     FOR EACH ROW
 BEGIN
-    UPDATE webpage_job SET modified_time = (CURRENT_TIMESTAMP || '+00:00');
+    UPDATE webpage_job SET modified_time = (CURRENT_TIMESTAMP || '+00:00')
+        WHERE uid = NEW.uid;
 END;
 
 DROP TABLE IF EXISTS snapshot;
@@ -107,26 +184,170 @@ CREATE TABLE snapshot (
     webpage_uid TEXT NOT NULL,
     strategy_uid INTEGER NOT NULL,
     job_state_uid INTEGER NOT NULL,
-    result TEXT,
-    stdout TEXT,
-    stderr TEXT,
+    source_uid TEXT,
+    stdout_digest TEXT,
+    stderr_digest TEXT,
+    simhash INTEGER,
+    same_as_uid TEXT,
+    priority_uid INTEGER DEFAULT 1 NOT NULL,
+    transfer_uid TEXT,
+    attempt INTEGER DEFAULT 0 NOT NULL,
+    not_before TEXT,
 
     FOREIGN KEY (webpage_uid)
         REFERENCES webpage (uid),
     FOREIGN KEY (strategy_uid)
         REFERENCES strategy (uid),
     FOREIGN KEY (job_state_uid)
-        REFERENCES job_state (uid)
+        REFERENCES job_state (uid),
+    FOREIGN KEY (source_uid)
+        REFERENCES snapshot (uid),
+    FOREIGN KEY (same_as_uid)
+        REFERENCES snapshot (uid),
+    FOREIGN KEY (priority_uid)
+        REFERENCES priority (uid),
+    FOREIGN KEY (transfer_uid)
+        REFERENCES transfer (uid),
+    FOREIGN KEY (stdout_digest)
+        REFERENCES artifact (digest),
+    FOREIGN KEY (stderr_digest)
+        REFERENCES artifact (digest)
 );
+CREATE INDEX snapshot_webpage_strategy
+    ON snapshot (webpage_uid, strategy_uid, job_state_uid, creation_time);
+CREATE INDEX snapshot_webpage ON snapshot (webpage_uid, creation_time);
+CREATE INDEX snapshot_job_state ON snapshot (job_state_uid, priority_uid);
+CREATE INDEX snapshot_not_before ON snapshot (not_before)
+    WHERE not_before IS NOT NULL;
 CREATE TRIGGER update_snapshot_modified_time
     AFTER UPDATE
     OF job_state_uid
     ON snapshot
     FOR EACH ROW
 BEGIN
-    UPDATE snapshot SET modified_time = (CURRENT_TIMESTAMP || '+00:00');
+    UPDATE snapshot SET modified_time = (CURRENT_TIMESTAMP || '+00:00')
+        WHERE uid = NEW.uid;
 END;
 
+-- How many snapshots of each transfer are in each state, per strategy, so
+-- its progress is read without counting them. Kept by the triggers below,
+-- in the transaction changing the snapshots.
+DROP TABLE IF EXISTS transfer_progress;
+CREATE TABLE transfer_progress (
+    transfer_uid TEXT NOT NULL,
+    strategy_uid INTEGER NOT NULL,
+    job_state_uid INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (transfer_uid, strategy_uid, job_state_uid)
+) WITHOUT ROWID;
+CREATE TRIGGER transfer_progress_insert
+    AFTER INSERT
+    ON snapshot
+    FOR EACH ROW
+    WHEN NEW.transfer_uid IS NOT NULL
+BEGIN
+    INSERT INTO transfer_progress
+        VALUES (NEW.transfer_uid, NEW.strategy_uid, NEW.job_state_uid, 1)
+        ON CONFLICT DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER transfer_progress_update
+    AFTER UPDATE
+    OF transfer_uid, strategy_uid, job_state_uid
+    ON snapshot
+    FOR EACH ROW
+    WHEN OLD.transfer_uid IS NOT NEW.transfer_uid
+        OR OLD.strategy_uid IS NOT NEW.strategy_uid
+        OR OLD.job_state_uid IS NOT NEW.job_state_uid
+BEGIN
+    UPDATE transfer_progress SET count = count - 1
+        WHERE transfer_uid = OLD.transfer_uid
+        AND strategy_uid = OLD.strategy_uid
+        AND job_state_uid = OLD.job_state_uid;
+    INSERT INTO transfer_progress
+        SELECT NEW.transfer_uid, NEW.strategy_uid, NEW.job_state_uid, 1
+        WHERE NEW.transfer_uid IS NOT NULL
+        ON CONFLICT DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER transfer_progress_delete
+    AFTER DELETE
+    ON snapshot
+    FOR EACH ROW
+    WHEN OLD.transfer_uid IS NOT NULL
+BEGIN
+    UPDATE transfer_progress SET count = count - 1
+        WHERE transfer_uid = OLD.transfer_uid
+        AND strategy_uid = OLD.strategy_uid
+        AND job_state_uid = OLD.job_state_uid;
+END;
+
+-- Snapshots each transfer relies on without having asked for them, because
+-- a fresh or in-flight one from earlier could be reused. They count in its
+-- progress in whatever state they are.
+DROP TABLE IF EXISTS transfer_reuse;
+CREATE TABLE transfer_reuse (
+    transfer_uid TEXT NOT NULL,
+    snapshot_uid TEXT NOT NULL,
+    PRIMARY KEY (transfer_uid, snapshot_uid)
+) WITHOUT ROWID;
+
+DROP TABLE IF EXISTS snapshot_result;
+CREATE TABLE snapshot_result (
+    snapshot_uid TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+
+    FOREIGN KEY (snapshot_uid)
+        REFERENCES snapshot (uid)
+);
+
+DROP TABLE IF EXISTS artifact;
+CREATE TABLE artifact (
+    digest TEXT PRIMARY KEY,
+    creation_time TEXT DEFAULT (CURRENT_TIMESTAMP || '+00:00') NOT NULL,
+    size INTEGER NOT NULL,
+    media_type TEXT NOT NULL,
+    refcount INTEGER NOT NULL,
+    -- When the last reference went away, so artifacts just stored are not
+    -- collected before the snapshot referencing them is recorded.
+    released_time TEXT
+);
+CREATE INDEX artifact_unreferenced ON artifact (released_time)
+    WHERE refcount <= 0;
+
+DROP TABLE IF EXISTS schedule;
+CREATE TABLE schedule (
+    webpage_uid TEXT PRIMARY KEY,
+    creation_time TEXT DEFAULT (CURRENT_TIMESTAMP || '+00:00') NOT NULL,
+    modified_time TEXT,
+    recurrence_uid INTEGER NOT NULL,
+    next_due TEXT NOT NULL,
+
+    FOREIGN KEY (webpage_uid)
+        REFERENCES webpage (uid),
+    FOREIGN KEY (recurrence_uid)
+        REFERENCES recurrence (uid)
+);
+CREATE INDEX schedule_next_due ON schedule (next_due);
+CREATE TRIGGER update_schedule_modified_time
+    AFTER UPDATE
+    OF recurrence_uid
+    ON schedule
+    FOR EACH ROW
+BEGIN
+    UPDATE schedule SET modified_time = (CURRENT_TIMESTAMP || '+00:00')
+        WHERE webpage_uid = NEW.webpage_uid;
+END;
+
+DROP TABLE IF EXISTS recurrence;
+CREATE TABLE recurrence (
+    uid INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+INSERT INTO recurrence (uid, name) VALUES
+    (1, "hourly"),
+    (2, "daily"),
+    (3, "weekly")
+;
+
 DROP TABLE IF EXISTS strategy;
 CREATE TABLE strategy (
     uid INTEGER PRIMARY KEY,
@@ -136,6 +357,7 @@ INSERT INTO strategy (uid, name) VALUES
     (1, "internet_archive"),
     (2, "title"),
     (3, "favicon"),
+    (4, "fetch"),
 
     (10, "curl"),
     (11, "wget"),
@@ -152,6 +374,18 @@ INSERT INTO strategy (uid, name) VALUES
     (40, "git"),
     (41, "ytdlp")
 ;
+
+DROP TABLE IF EXISTS maintenance_log;
+CREATE TABLE maintenance_log (
+    uid INTEGER PRIMARY KEY,
+    creation_time TEXT DEFAULT (CURRENT_TIMESTAMP || '+00:00') NOT NULL,
+    step TEXT NOT NULL,
+    -- Seconds it took
+    duration REAL NOT NULL,
+    -- JSON object telling what the step did
+    detail TEXT
+);
+
 --------------------------
 --END script transaction--
 --------------------------
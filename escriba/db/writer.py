@@ -0,0 +1,129 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import asyncio
+import dataclasses
+import logging
+import typing
+
+import escriba.db as db
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for more writes before committing, and the most writes
+# committed at once.
+GROUP_DELAY = 0.005
+MAX_BATCH = 256
+
+
+@dataclasses.dataclass
+class _Intent:
+    fn: typing.Callable[..., typing.Awaitable]
+    args: typing.Tuple
+    kwargs: typing.Dict[str, typing.Any]
+    future: asyncio.Future
+
+
+class Writer:
+    """Apply the writes of every daemon through one connection, in groups.
+
+    SQLite allows one writer at a time, and every commit waits for the disk.
+    Rather than each daemon committing its own rows and contending for the
+    lock, daemons submit write intents: coroutine functions taking the
+    connection as first argument, like the DAO ones. Intents arriving within
+    a few milliseconds of each other are applied in a single transaction,
+    each one within its own savepoint so a failure rolls back that intent
+    only, and committed together.
+    """
+
+    def __init__(self, *, delay: float = GROUP_DELAY, max_batch: int = MAX_BATCH):
+        self.delay = delay
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def submit(
+        self, fn: typing.Callable[..., typing.Awaitable], /, *args, **kwargs
+    ):
+        """Apply fn(connection, *args, **kwargs) and wait until it is committed.
+
+        Return what fn returned, or raise what fn or the commit raised.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_Intent(fn, args, kwargs, future))
+        return await future
+
+    async def _collect(self) -> typing.List[_Intent]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.delay
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            if (timeout := deadline - loop.time()) <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _apply(self, con, batch: typing.List[_Intent]) -> None:
+        outcomes = []
+        try:
+            # Take the write lock upfront rather than upgrading to it midway.
+            await con.execute("BEGIN IMMEDIATE")
+            for intent in batch:
+                if intent.future.cancelled():
+                    outcomes.append(None)
+                    continue
+                await con.execute("SAVEPOINT intent")
+                try:
+                    result = await intent.fn(con, *intent.args, **intent.kwargs)
+                except Exception as exc:
+                    await con.execute("ROLLBACK TO intent")
+                    await con.execute("RELEASE intent")
+                    outcomes.append((None, exc))
+                else:
+                    await con.execute("RELEASE intent")
+                    outcomes.append((result, None))
+            await con.commit()
+        except Exception as exc:
+            logger.exception("Could not commit %d writes.", len(batch))
+            await con.rollback()
+            for intent in batch:
+                if not intent.future.done():
+                    intent.future.set_exception(exc)
+            return
+
+        for intent, outcome in zip(batch, outcomes):
+            if outcome is None or intent.future.done():
+                continue
+            result, exc = outcome
+            if exc is None:
+                intent.future.set_result(result)
+            else:
+                intent.future.set_exception(exc)
+        logger.debug("Committed %d writes at once.", len(batch))
+
+    async def run(self) -> None:
+        # Submitters are told their writes are durable, so every commit syncs
+        # the WAL. Committing in groups is what keeps that affordable.
+        async with db.connect(synchronous="FULL") as con:
+            while True:
+                await self._apply(con, await self._collect())
@@ -17,20 +17,105 @@
     You should have received a copy of the GNU Affero General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
+import argparse
+import contextlib
 import json
 import logging
-import sys
+import os
+import sqlite3
+import time
 import typing
+import urllib.parse
 
+import session
 import util
 
-_ARCHIVE_API = "http://archive.org/wayback/available"
+_ARCHIVE_API = os.environ.get(
+    "ESCRIBA_WAYBACK_API", "http://archive.org/wayback/available"
+)
 IO_BYTES_COUNT = 1024 * 1024
+# How many urls are resolved by a single request to the API.
+BATCH_SIZE = 50
+# Seconds an answer is reused. Missing captures may appear sooner.
+CACHE_TTL = 7 * 24 * 60 * 60
+CACHE_MISS_TTL = 60 * 60
+CACHE_PATH = os.environ.get(
+    "ESCRIBA_WAYBACK_CACHE", os.path.join(session.CACHE_HOME, "wayback.sqlite3")
+)
 
 logger = logging.getLogger(__name__)
 
 
-def main(url: str) -> typing.Optional[str]:
+def _normalise(url: str) -> str:
+    """Ignore the differences that never matter to the Wayback Machine."""
+    parts = urllib.parse.urlsplit(url.strip())
+    netloc = parts.hostname or ""
+    if parts.port and parts.port != {"http": 80, "https": 443}.get(parts.scheme):
+        netloc = f"{netloc}:{parts.port}"
+    return urllib.parse.urlunsplit(
+        (parts.scheme.lower(), netloc, parts.path or "/", parts.query, "")
+    )
+
+
+@contextlib.contextmanager
+def _cache():
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    con = sqlite3.connect(CACHE_PATH, timeout=10)
+    try:
+        con.executescript(
+            "PRAGMA journal_mode=WAL;"
+            "CREATE TABLE IF NOT EXISTS availability ("
+            " url TEXT NOT NULL,"
+            " timestamp TEXT NOT NULL,"
+            " archived_url TEXT,"
+            " expiry REAL NOT NULL,"
+            " PRIMARY KEY (url, timestamp)"
+            ");"
+        )
+        yield con
+    finally:
+        con.close()
+
+
+def _read_cache(
+    con, urls: typing.Iterable[str], timestamp: str
+) -> typing.Dict[str, typing.Optional[str]]:
+    urls = list(urls)
+    cursor = con.execute(
+        "SELECT url, archived_url FROM availability"
+        f" WHERE timestamp=? AND expiry>? AND url IN ({','.join('?' * len(urls))})",
+        (timestamp, time.time(), *urls),
+    )
+    return dict(cursor.fetchall())
+
+
+def _write_cache(
+    con, found: typing.Dict[str, typing.Optional[str]], timestamp: str
+) -> None:
+    now = time.time()
+    con.executemany(
+        "INSERT OR REPLACE INTO availability (url, timestamp, archived_url, expiry)"
+        " VALUES (?, ?, ?, ?)",
+        (
+            (
+                url,
+                timestamp,
+                archived,
+                now + (CACHE_TTL if archived else CACHE_MISS_TTL),
+            )
+            for url, archived in found.items()
+        ),
+    )
+
+
+def _closest(result: dict) -> typing.Optional[str]:
+    if closest := (result.get("archived_snapshots") or {}).get("closest"):
+        return closest["url"]
+
+
+def _query(
+    urls: typing.List[str], timestamp: str, api: str
+) -> typing.Dict[str, typing.Optional[str]]:
     """
     https://archive.org/help/wayback_api.php
 
@@ -41,20 +126,68 @@ def main(url: str) -> typing.Optional[str]:
 
     ex:
         http://archive.org/wayback/available?url=example.com&timestamp=20060101
-    """
-    timestamp = "20110101"
-    params = f"url={url}&timestamp={timestamp}" if timestamp else f"url={url}"
 
-    with util.openurl(f"{_ARCHIVE_API}?{params}") as rep:
+    The API also accepts many urls POSTed at once, answering with a list
+    of results in the same order.
+    """
+    params = dict(url=urls)
+    if timestamp:
+        params["timestamp"] = timestamp
+
+    if len(urls) == 1:
+        query = urllib.parse.urlencode(params, doseq=True)
+        opened = util.openurl(f"{api}?{query}")
+    else:
+        opened = util.openurl(api, data=params)
+    with opened as rep:
         page = rep.read(IO_BYTES_COUNT)
 
     logger.info("Received response from Archive API: %r", page)
     response = json.loads(page)
-
-    if response["archived_snapshots"]:
-        return response["archived_snapshots"]["closest"]["url"]
+    results = response.get("results", [response])
+    if len(results) != len(urls):
+        raise ValueError(f"Expected {len(urls)} results, got {len(results)}.")
+    return {url: _closest(result) for url, result in zip(urls, results)}
+
+
+def lookup_many(
+    urls: typing.Iterable[str],
+    timestamp: typing.Optional[str] = None,
+    *,
+    api: str = _ARCHIVE_API,
+) -> typing.Dict[str, typing.Optional[str]]:
+    """Map each url to its closest capture on the Wayback Machine, if any."""
+    timestamp = timestamp or ""
+    normalised = {url: _normalise(url) for url in urls}
+    with _cache() as con:
+        found = {}
+        pending = list(dict.fromkeys(normalised.values()))
+        for start in range(0, len(pending), BATCH_SIZE):
+            found |= _read_cache(con, pending[start : start + BATCH_SIZE], timestamp)
+
+        missing = [url for url in pending if url not in found]
+        logger.debug("Found %d urls in cache, %d missing.", len(found), len(missing))
+        for start in range(0, len(missing), BATCH_SIZE):
+            answered = _query(missing[start : start + BATCH_SIZE], timestamp, api)
+            with con:
+                _write_cache(con, answered, timestamp)
+            found |= answered
+
+    return {url: found[normal] for url, normal in normalised.items()}
+
+
+def main(url: str, timestamp: typing.Optional[str] = None) -> typing.Optional[str]:
+    return lookup_many([url], timestamp)[url]
 
 
 if __name__ == "__main__":
     util.configure_logger(logger)
-    print(main(sys.argv[1]))
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("url", nargs="+")
+    argparser.add_argument(
+        "--timestamp", help="look up the capture closest to YYYYMMDDhhmmss"
+    )
+    args = argparser.parse_args()
+    with util.exit_on_transient_failure(logger):
+        for archived_url in lookup_many(args.url, args.timestamp).values():
+            print(archived_url)
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import json
+import logging
+import sys
+import typing
+
+import escriba.storage.artifact as artifact
+
+import util
+
+logger = logging.getLogger(__name__)
+
+
+def main(url: str) -> typing.Dict[str, typing.Any]:
+    """Retrieve the page once and keep its body in the artifact store.
+
+    The returned reference lets other extractors read the body instead of
+    downloading it again.
+    """
+    with util.openurl(url) as rep:
+        content_type = rep.headers.get("Content-Type")
+        media_type = (content_type or "application/octet-stream").split(";")[0]
+        body = artifact.put_stream(rep, media_type=media_type.strip().lower())
+        logger.info("Stored %d bytes from %s as %s.", body.size, url, body.digest)
+        return dict(
+            digest=body.digest,
+            size=body.size,
+            media_type=body.media_type,
+            url=rep.geturl(),
+            content_type=content_type,
+        )
+
+
+if __name__ == "__main__":
+    util.configure_logger(logger)
+    with util.exit_on_transient_failure(logger):
+        print(json.dumps(main(sys.argv[1])))
@@ -0,0 +1,539 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import collections
+import contextlib
+import hashlib
+import http.client
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import typing
+import urllib.error
+import urllib.parse
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is an optional dependency
+    brotli = None
+
+CHUNK_SIZE = 16 * 1024
+TIMEOUT = 30
+MAX_REDIRECTS = 10
+MAX_IDLE_CONNECTIONS_PER_HOST = 4
+DNS_CACHE_TTL = 300
+USER_AGENT = "Escriba"
+CACHE_HOME = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "escriba"
+)
+CACHE_DIR = os.environ.get("ESCRIBA_HTTP_CACHE", os.path.join(CACHE_HOME, "http"))
+# Bytes the HTTP cache may hold. Past it, the least recently used entries go
+# until it is down to CACHE_TRIM of the limit.
+CACHE_LIMIT = int(os.environ.get("ESCRIBA_HTTP_CACHE_LIMIT", 1024**3))
+CACHE_TRIM = 0.9
+
+# Headers describing the transfer of a body, which are meaningless once the
+# body was decoded and stored in the cache.
+_TRANSFER_HEADERS = frozenset(
+    ("content-encoding", "content-length", "transfer-encoding")
+)
+_REDIRECT_STATUSES = frozenset((301, 302, 303, 307, 308))
+
+logger = logging.getLogger(__name__)
+
+
+class _Resolver:
+    """Cache the results of getaddrinfo, which the stdlib never does."""
+
+    def __init__(self, ttl: int = DNS_CACHE_TTL):
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _getaddrinfo(self, host: str, port: int):
+        key = (host, port)
+        with self._lock:
+            if (entry := self._cache.get(key)) and entry[0] > time.monotonic():
+                return entry[1]
+
+        addrinfos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, addrinfos)
+        return addrinfos
+
+    def create_connection(self, address, timeout=None, source_address=None):
+        """Drop-in replacement for socket.create_connection."""
+        host, port = address
+        error = None
+        for family, type_, proto, _, sockaddr in self._getaddrinfo(host, port):
+            sock = socket.socket(family, type_, proto)
+            try:
+                if timeout is not None:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as exc:
+                error = exc
+                sock.close()
+
+        with self._lock:
+            self._cache.pop((host, port), None)
+        raise error or OSError(f"getaddrinfo returned nothing for {host}")
+
+
+class _Pool:
+    """Keep idle keep-alive connections, grouped by origin."""
+
+    def __init__(self, resolver: _Resolver, timeout: float):
+        self.resolver = resolver
+        self.timeout = timeout
+        self._idle = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+    def acquire(self, origin: typing.Tuple[str, str, int]):
+        """Return a connection to origin and whether it was used before."""
+        with self._lock:
+            if idle := self._idle.get(origin):
+                return idle.pop(), True
+
+        scheme, host, port = origin
+        cls = (
+            http.client.HTTPSConnection
+            if scheme == "https"
+            else http.client.HTTPConnection
+        )
+        conn = cls(host, port, timeout=self.timeout)
+        conn._create_connection = self.resolver.create_connection
+        return conn, False
+
+    def release(self, origin: typing.Tuple[str, str, int], conn):
+        with self._lock:
+            idle = self._idle[origin]
+            if len(idle) < MAX_IDLE_CONNECTIONS_PER_HOST:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, collections.defaultdict(collections.deque)
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class _IdentityDecoder:
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class _BrotliDecoder:
+    def __init__(self):
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.process(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _decoder_for(content_encoding: typing.Optional[str]):
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        # Automatically detect either a gzip or a zlib header.
+        return zlib.decompressobj(wbits=32 + zlib.MAX_WBITS)
+    if encoding == "br" and brotli:
+        return _BrotliDecoder()
+    if encoding != "identity":
+        logger.warning("Unsupported content encoding %r.", encoding)
+    return _IdentityDecoder()
+
+
+class _Cache:
+    """On-disk cache of response bodies that may be revalidated.
+
+    Entries are written only after the whole body was read, so a reader
+    which stops early never leaves a truncated entry behind. Serving an
+    entry touches it, so the oldest modification times belong to the least
+    recently used entries, which are evicted first once over the limit.
+    """
+
+    def __init__(self, root: str, limit: int = CACHE_LIMIT):
+        self.root = root
+        self.limit = limit
+        # Bytes held, counted on the first write. Other processes may share
+        # the directory, so this is an estimate corrected on every eviction.
+        self._size: typing.Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, url: str) -> typing.Optional[dict]:
+        try:
+            with open(f"{self._path(url)}.json") as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def open_body(self, url: str) -> typing.BinaryIO:
+        path = f"{self._path(url)}.body"
+        fp = open(path, "rb")
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return fp
+
+    def forget(self, url: str):
+        for suffix in (".json", ".body"):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(f"{self._path(url)}{suffix}")
+
+    def writer(self, url: str, status: int, headers) -> "_CacheWriter":
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = dict(
+            url=url,
+            status=status,
+            headers=[
+                (name, value)
+                for name, value in headers.items()
+                if name.lower() not in _TRANSFER_HEADERS
+            ],
+            etag=headers.get("ETag"),
+            last_modified=headers.get("Last-Modified"),
+        )
+        return _CacheWriter(self, path, meta)
+
+    def _entries(self) -> typing.List[typing.Tuple[float, int, str]]:
+        """List the modification time, size and path of every entry."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.endswith(".body"):
+                    continue
+                path = os.path.join(dirpath, filename[: -len(".body")])
+                try:
+                    body = os.stat(f"{path}.body")
+                    size = body.st_size + os.stat(f"{path}.json").st_size
+                except FileNotFoundError:
+                    continue
+                entries.append((body.st_mtime, size, path))
+        return entries
+
+    def added(self, size: int):
+        """Account for an entry just written, evicting others if over the limit."""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += size
+            if self._size <= self.limit:
+                return
+
+            entries = sorted(self._entries())
+            self._size = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, path in entries:
+                if self._size <= self.limit * CACHE_TRIM:
+                    break
+                for suffix in (".json", ".body"):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(f"{path}{suffix}")
+                self._size -= size
+                evicted += 1
+        logger.debug("Evicted %d entries from the HTTP cache.", evicted)
+
+
+class _CacheWriter:
+    def __init__(self, cache: _Cache, path: str, meta: dict):
+        self.cache = cache
+        self.path = path
+        self.meta = meta
+        self._size = 0
+        self._file = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), prefix=".tmp-", delete=False
+        )
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        self._size += len(data)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self._file.name, f"{self.path}.body")
+        with tempfile.NamedTemporaryFile(
+            "w", dir=os.path.dirname(self.path), prefix=".tmp-", delete=False
+        ) as fp:
+            json.dump(self.meta, fp)
+        os.replace(fp.name, f"{self.path}.json")
+        self.cache.added(self._size + os.path.getsize(f"{self.path}.json"))
+
+    def discard(self):
+        self._file.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._file.name)
+
+
+def _make_headers(pairs) -> http.client.HTTPMessage:
+    headers = http.client.HTTPMessage()
+    for name, value in pairs:
+        headers[name] = value
+    return headers
+
+
+class Response:
+    """A file-like response whose body is decoded as it is read.
+
+    Once the body is exhausted the connection goes back to the pool. Closing
+    the response earlier discards the connection, as whatever was left
+    unread would poison the next request.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        status: int,
+        headers: http.client.HTTPMessage,
+        raw: typing.BinaryIO,
+        *,
+        release: typing.Callable[[bool], None],
+        decoder=None,
+        cache_writer: typing.Optional[_CacheWriter] = None,
+    ):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self._raw = raw
+        self._release = release
+        self._decoder = decoder or _IdentityDecoder()
+        self._cache_writer = cache_writer
+        self._buffer = bytearray()
+        self._eof = False
+        self._closed = False
+
+    def geturl(self) -> str:
+        return self.url
+
+    def getheader(self, name: str, default=None):
+        return self.headers.get(name, default)
+
+    def read(self, amt: int = -1) -> bytes:
+        while not self._eof and (amt < 0 or len(self._buffer) < amt):
+            if raw := self._raw.read(CHUNK_SIZE):
+                data = self._decoder.decompress(raw)
+            else:
+                data = self._decoder.flush()
+                self._eof = True
+            if self._cache_writer:
+                self._cache_writer.write(data)
+            self._buffer += data
+
+        if self._eof:
+            self._finish()
+
+        if amt < 0 or amt >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            data = bytes(self._buffer[:amt])
+            del self._buffer[:amt]
+        return data
+
+    def _finish(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._cache_writer:
+            try:
+                self._cache_writer.commit()
+            except OSError as exc:
+                logger.warning(
+                    "Could not store %s in the HTTP cache. %s", self.url, exc
+                )
+        self._release(self._eof)
+        self._raw.close()
+
+    def close(self):
+        if self._closed:
+            return
+        if self._cache_writer:
+            self._cache_writer.discard()
+            self._cache_writer = None
+        self._finish()
+
+    def __enter__(self) -> typing.Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+class Session:
+    """HTTP client sharing connections, DNS results and a disk cache.
+
+    Sessions are thread-safe, so long-lived processes should keep a single
+    instance around for all their requests.
+    """
+
+    def __init__(
+        self, *, cache_dir: typing.Optional[str] = None, timeout: float = TIMEOUT
+    ):
+        self._pool = _Pool(_Resolver(), timeout)
+        self._cache = _Cache(cache_dir) if cache_dir else None
+
+    def close(self):
+        self._pool.clear()
+
+    def _request(self, method: str, parts, body, headers):
+        origin = (
+            parts.scheme,
+            parts.hostname,
+            parts.port or (443 if parts.scheme == "https" else 80),
+        )
+        target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        while True:
+            conn, reused = self._pool.acquire(origin)
+            try:
+                conn.request(method, target, body=body, headers=headers)
+                rep = conn.getresponse()
+            except (
+                http.client.RemoteDisconnected,
+                BrokenPipeError,
+                ConnectionResetError,
+            ):
+                conn.close()
+                if not reused:
+                    raise
+                # The server closed the idle connection in the meantime.
+                logger.debug("Reconnecting to %s.", parts.hostname)
+                continue
+            except Exception:
+                conn.close()
+                raise
+
+            def release(reusable: bool, conn=conn):
+                if reusable and not rep.will_close:
+                    self._pool.release(origin, conn)
+                else:
+                    conn.close()
+
+            return rep, release
+
+    def _from_cache(self, url: str, cached: dict) -> Response:
+        logger.debug("Serving %s from the HTTP cache.", url)
+        return Response(
+            url,
+            cached["status"],
+            _make_headers(cached["headers"]),
+            self._cache.open_body(url),
+            release=lambda _: None,
+        )
+
+    def _cache_writer(self, url: str, rep) -> typing.Optional[_CacheWriter]:
+        if not rep.getheader("ETag") and not rep.getheader("Last-Modified"):
+            return None
+        if "no-store" in rep.getheader("Cache-Control", "").lower():
+            return None
+        try:
+            return self._cache.writer(url, rep.status, rep.msg)
+        except OSError as exc:
+            logger.warning("Could not write to the HTTP cache. %s", exc)
+
+    def open(
+        self,
+        url: str,
+        *,
+        data: typing.Optional[bytes] = None,
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+    ) -> Response:
+        """Request url, following redirects, and return the response.
+
+        Error statuses raise urllib.error.HTTPError, just like urlopen.
+        """
+        method = "GET" if data is None else "POST"
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ("http", "https"):
+                raise ValueError("Invalid URL scheme")
+
+            request_headers = {
+                "Accept-Encoding": "gzip, deflate, br" if brotli else "gzip, deflate",
+                "User-Agent": USER_AGENT,
+                **(headers or {}),
+            }
+            cached = None
+            if self._cache and method == "GET" and (cached := self._cache.lookup(url)):
+                if cached["etag"]:
+                    request_headers["If-None-Match"] = cached["etag"]
+                if cached["last_modified"]:
+                    request_headers["If-Modified-Since"] = cached["last_modified"]
+
+            rep, release = self._request(method, parts, data, request_headers)
+            status = rep.status
+
+            if status in _REDIRECT_STATUSES or (status == 304 and cached):
+                # Bodies of redirects and revalidations are meaningless.
+                rep.read(CHUNK_SIZE)
+                release(rep.isclosed())
+                if status == 304:
+                    try:
+                        return self._from_cache(url, cached)
+                    except OSError:
+                        # The body vanished. Ask again, unconditionally.
+                        self._cache.forget(url)
+                        return self.open(url, headers=headers)
+
+                if not (location := rep.getheader("Location")):
+                    raise urllib.error.HTTPError(url, status, rep.reason, rep.msg, None)
+                url = urllib.parse.urljoin(url, location)
+                if status == 303 or (status in (301, 302) and method == "POST"):
+                    method, data = "GET", None
+                continue
+
+            if status >= 400:
+                release(False)
+                raise urllib.error.HTTPError(url, status, rep.reason, rep.msg, None)
+
+            return Response(
+                url,
+                status,
+                rep.msg,
+                rep,
+                release=release,
+                decoder=_decoder_for(rep.getheader("Content-Encoding")),
+                cache_writer=(
+                    self._cache_writer(url, rep)
+                    if self._cache and method == "GET" and status == 200
+                    else None
+                ),
+            )
+
+        raise urllib.error.HTTPError(url, status, "Too many redirects", rep.msg, None)
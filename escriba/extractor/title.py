@@ -17,56 +17,191 @@
     You should have received a copy of the GNU Affero General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
+import argparse
+import codecs
+import dataclasses
+import html.parser
+import json
 import logging
-import sys
+import re
 import typing
 import urllib.error
+import urllib.parse
 
 import archivedotorg
 import util
 
+# Give up looking for the end of <head> after reading this many bytes.
 IO_BYTES_COUNT = 1024 * 1024
+CHUNK_SIZE = 4 * 1024
+DEFAULT_CHARSET = "utf-8"
+
+# Elements which may only appear inside <head>. Anything else implies that
+# the document body has started.
+_HEAD_TAGS = frozenset(
+    ("base", "link", "meta", "noscript", "script", "style", "template", "title")
+)
+_META_CHARSET = re.compile(
+    rb"<meta[^>]+charset\s*=\s*[\"']?\s*([a-zA-Z0-9_:.-]+)", re.IGNORECASE
+)
 
 logger = logging.getLogger(__name__)
 
 
-def main(url: str) -> typing.Optional[str]:
-    if title := _obtain_title(url):
-        return title
-
-    logger.info("Could not obtain title directly.")
-
-    if archived_url := archivedotorg.main(url):
-        logger.info("Extracting title from archived url: %r", archived_url)
-        return _obtain_title(archived_url)
-
-
-def _obtain_title(url: str) -> typing.Optional[str]:
+@dataclasses.dataclass
+class Head:
+    """Metadata found inside the <head> of a HTML document."""
+
+    title: typing.Optional[str] = None
+    canonical: typing.Optional[str] = None
+    icons: typing.List[str] = dataclasses.field(default_factory=list)
+    og_title: typing.Optional[str] = None
+
+
+class _HeadParser(html.parser.HTMLParser):
+    def __init__(self, url: str):
+        super().__init__(convert_charrefs=True)
+        self.head = Head()
+        self.base_url = url
+        self.done = False
+        self._title = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in _HEAD_TAGS and tag != "head" and tag != "html":
+            self.done = True
+            return
+
+        attrs = {name: value or "" for name, value in attrs}
+        if tag == "title":
+            if self.head.title is None:
+                self._title = []
+        elif tag == "base" and attrs.get("href"):
+            self.base_url = urllib.parse.urljoin(self.base_url, attrs["href"])
+        elif tag == "link" and attrs.get("href"):
+            rel = attrs.get("rel", "").lower().split()
+            href = urllib.parse.urljoin(self.base_url, attrs["href"])
+            if "canonical" in rel and self.head.canonical is None:
+                self.head.canonical = href
+            if "icon" in rel or "apple-touch-icon" in rel:
+                self.head.icons.append(href)
+        elif tag == "meta":
+            if attrs.get("property", "").lower() == "og:title":
+                self.head.og_title = _collapse_whitespace(attrs.get("content", ""))
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self._title is not None:
+            self.head.title = _collapse_whitespace("".join(self._title))
+            self._title = None
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data):
+        if self._title is not None:
+            self._title.append(data)
+
+
+def _collapse_whitespace(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _sniff_charset(headers, chunk: bytes) -> str:
+    """Find out the document encoding, honouring the precedence of the
+    byte order mark, then the HTTP header, then the <meta> prescan."""
+    if chunk.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if chunk.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+
+    candidates = [headers.get_content_charset()]
+    if match := _META_CHARSET.search(chunk[:1024]):
+        candidates.append(match.group(1).decode("ascii"))
+
+    for charset in candidates:
+        if not charset:
+            continue
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            logger.info("Ignoring unknown charset %r.", charset)
+
+    return DEFAULT_CHARSET
+
+
+def obtain_head(
+    url: str, reference: typing.Optional[typing.Dict[str, typing.Any]] = None
+) -> typing.Optional[Head]:
+    """Read the document just until the end of <head> and parse it.
+
+    When given a reference to the body already fetched, it is read from
+    the artifact store instead of the network.
+    """
     try:
-        with util.openurl(url) as rep:
-            page = rep.read(IO_BYTES_COUNT)
+        with util.openbody(reference) if reference else util.openurl(url) as rep:
+            parser = _HeadParser(rep.geturl())
+            decoder = None
+            received = 0
+            while not parser.done and received < IO_BYTES_COUNT:
+                chunk = rep.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if decoder is None:
+                    charset = _sniff_charset(rep.headers, chunk)
+                    logger.debug("Decoding document as %s.", charset)
+                    decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+                parser.feed(decoder.decode(chunk))
     except urllib.error.HTTPError as exc:
         logger.info("Could not open url. %s", exc)
         return
 
-    left, _, _ = page.partition(b"</title>")
+    logger.debug("Read %d bytes to parse the document head.", received)
+    return parser.head
 
-    if not left:
-        logger.info("Coult not find title tag.")
+
+def _obtain_title(
+    url: str, reference: typing.Optional[typing.Dict[str, typing.Any]] = None
+) -> typing.Optional[str]:
+    if not (head := obtain_head(url, reference)):
         return
 
-    _, _, title = left.partition(b"<title>")
+    if not head.title:
+        logger.info("Coult not find title tag.")
 
-    title = title.decode()
+    return head.title
 
-    # deal with whitespaces
-    title = "".join(title.splitlines()).strip()
-    while title.find("  ") != -1:
-        title = title.replace("  ", " ")
 
-    return title
+def main(
+    url: str, reference: typing.Optional[typing.Dict[str, typing.Any]] = None
+) -> typing.Optional[str]:
+    if title := _obtain_title(url, reference):
+        return title
+
+    logger.info("Could not obtain title directly.")
+
+    if archived_url := archivedotorg.main(url):
+        logger.info("Extracting title from archived url: %r", archived_url)
+        return _obtain_title(archived_url)
 
 
 if __name__ == "__main__":
     util.configure_logger(logger)
-    print(main(sys.argv[1]))
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("url")
+    argparser.add_argument(
+        "reference",
+        nargs="?",
+        type=json.loads,
+        help="body already in the artifact store, as printed by fetch.py",
+    )
+    argparser.add_argument(
+        "--head",
+        action="store_true",
+        help="print every metadata found in <head> as JSON",
+    )
+    args = argparser.parse_args()
+    with util.exit_on_transient_failure(logger):
+        if args.head:
+            head = obtain_head(args.url, args.reference)
+            print(json.dumps(dataclasses.asdict(head) if head else None))
+        else:
+            print(main(args.url, args.reference))
@@ -17,10 +17,23 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
 import contextlib
+import http.client
 import logging
+import os
 import sys
+import typing
 import urllib.error
-import urllib.request
+import urllib.parse
+
+import escriba.storage.artifact as artifact
+
+import session
+
+# Every extractor in this process shares connections, DNS and HTTP cache.
+SESSION = session.Session(cache_dir=session.CACHE_DIR)
+
+# Statuses telling the request may succeed if tried again later.
+_TRANSIENT_STATUSES = frozenset((408, 425, 429, 500, 502, 503, 504))
 
 
 def configure_logger(log: logging.Logger, level: str = "INFO") -> None:
@@ -44,18 +57,59 @@ def configure_logger(log: logging.Logger, level: str = "INFO") -> None:
 
 
 @contextlib.contextmanager
-def openurl(url: str):
-    """Avoid security warning
+def exit_on_transient_failure(log: logging.Logger):
+    """Exit with EX_TEMPFAIL on failures which may go away by themselves.
 
-    Issue: [B310:blacklist] Audit url open for permitted schemes.
-    Allowing use of file:/ or custom schemes is often unexpected.
-    CWE: CWE-22 (https://cwe.mitre.org/data/definitions/22.html)
+    Busy servers, timeouts and network errors are such failures. The agent
+    reports the exit code, so the snapshot is tried again later. Any other
+    failure propagates as usual, exiting with 1.
+    """
+    try:
+        yield
+    except urllib.error.HTTPError as exc:
+        if exc.code not in _TRANSIENT_STATUSES:
+            raise
+        log.error("Server is not ready, try again later. %s", exc)
+        sys.exit(os.EX_TEMPFAIL)
+    except OSError as exc:
+        log.error("Transient failure, try again later. %s", exc)
+        sys.exit(os.EX_TEMPFAIL)
+
+
+@contextlib.contextmanager
+def openurl(url: str, data: typing.Optional[typing.Dict[str, typing.Any]] = None):
+    """Open url through the shared session.
+
+    When data is given, it is POSTed as an urlencoded form. Only http and
+    https are allowed, as file:/ or custom schemes are often unexpected
+    (CWE-22). Error statuses raise urllib.error.HTTPError.
+    """
+    if data is None:
+        rep = SESSION.open(url)
+    else:
+        rep = SESSION.open(
+            url,
+            data=urllib.parse.urlencode(data, doseq=True).encode(),
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+    with rep:
+        yield rep
+
+
+@contextlib.contextmanager
+def openbody(reference: typing.Dict[str, typing.Any]):
+    """Open a body kept in the artifact store by the fetch extractor.
 
-    More Info:
-    https://bandit.readthedocs.io/en/1.7.4/blacklists/blacklist_calls.html
+    It reads just like the response to the request which retrieved it.
     """
-    req = urllib.request.Request(url, method="GET")
-    if req.type not in ("http", "https"):
-        raise ValueError("Invalid URL scheme")
-    with urllib.request.urlopen(req) as rep:  # nosec B310
+    headers = http.client.HTTPMessage()
+    if content_type := reference.get("content_type"):
+        headers["Content-Type"] = content_type
+    with session.Response(
+        reference["url"],
+        200,
+        headers,
+        artifact.open_artifact(reference["digest"]),
+        release=lambda _: None,
+    ) as rep:
         yield rep
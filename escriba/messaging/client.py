@@ -72,10 +72,12 @@ class Client(MDP.MajorDomoBase):
             request = [request]
         await self._send(service.encode(), [s.encode() for s in request])
 
-    async def recv(self) -> typing.Optional[typing.List[str]]:
+    async def recv(
+        self, decode: bool = True
+    ) -> typing.Optional[typing.List[typing.Union[str, bytes]]]:
         reply = await self._recv()
         if reply:
-            return [b.decode() for b in reply]
+            return [b.decode() for b in reply] if decode else reply
 
     def _reconnect_to_broker(self):
         """Connect or reconnect to broker"""
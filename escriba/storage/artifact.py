@@ -0,0 +1,190 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import contextlib
+import dataclasses
+import gzip
+import logging
+import os
+import tempfile
+import typing
+
+import escriba.config as config
+import escriba.storage.fingerprint as fingerprint
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Media types which are worth compressing. Everything else is most likely
+# compressed already, like images, videos, PDFs and gzipped WARCs.
+_COMPRESSIBLE_MEDIA_TYPES = frozenset(
+    (
+        "application/javascript",
+        "application/json",
+        "application/xhtml+xml",
+        "application/xml",
+        "image/svg+xml",
+        "image/x-icon",
+    )
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class Artifact:
+    digest: str
+    size: int
+    media_type: str
+
+
+def _is_compressible(media_type: str) -> bool:
+    return media_type.startswith("text/") or media_type in _COMPRESSIBLE_MEDIA_TYPES
+
+
+def path(digest: str, *, root: typing.Optional[str] = None) -> str:
+    """Locate an artifact, nested under its first two bytes like git does."""
+    return os.path.join(root or config.ARTIFACT_DIR, digest[:2], digest[2:4], digest)
+
+
+def _locate(digest: str) -> typing.Tuple[str, bool]:
+    """Return the existing file holding the artifact and if it is compressed."""
+    plain = path(digest)
+    if os.path.exists(compressed := f"{plain}.gz"):
+        return compressed, True
+    return plain, False
+
+
+def exists(digest: str) -> bool:
+    return os.path.exists(_locate(digest)[0])
+
+
+def _reuse(digest: str) -> bool:
+    """Tell if the artifact is stored, marking it as used just now if so.
+
+    The modification time keeps the artifact from being removed while the
+    reference to it is not recorded yet.
+    """
+    try:
+        os.utime(_locate(digest)[0])
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def put(
+    data: bytes, *, media_type: str, digest: typing.Optional[str] = None
+) -> Artifact:
+    """Store data unless an identical artifact is already there.
+
+    The digest may be given when the caller already fingerprinted the data.
+    """
+    digest = digest or fingerprint.digest(data)
+    artifact = Artifact(digest=digest, size=len(data), media_type=media_type)
+    if _reuse(digest):
+        logger.debug("Artifact %s is already stored.", digest)
+        return artifact
+
+    target = path(digest)
+    compress = _is_compressible(media_type)
+    if compress:
+        target = f"{target}.gz"
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(target), prefix=".tmp-", delete=False
+    ) as fp:
+        try:
+            if compress:
+                # A fixed mtime keeps the compressed file deterministic.
+                with gzip.GzipFile(fileobj=fp, mode="wb", mtime=0) as gz:
+                    gz.write(data)
+            else:
+                fp.write(data)
+        except BaseException:
+            os.unlink(fp.name)
+            raise
+    os.replace(fp.name, target)
+    logger.debug("Stored artifact %s with %d bytes.", digest, len(data))
+    return artifact
+
+
+def put_stream(stream: typing.BinaryIO, *, media_type: str) -> Artifact:
+    """Store what is read from stream, fingerprinting it along the way.
+
+    Bodies are stored without being held in memory as a whole.
+    """
+    root = config.ARTIFACT_DIR
+    os.makedirs(root, exist_ok=True)
+    hasher = fingerprint.digester()
+    size = 0
+    compress = _is_compressible(media_type)
+    with tempfile.NamedTemporaryFile(dir=root, prefix=".tmp-", delete=False) as fp:
+        try:
+            with (
+                gzip.GzipFile(fileobj=fp, mode="wb", mtime=0)
+                if compress
+                else contextlib.nullcontext(fp)
+            ) as out:
+                while chunk := stream.read(CHUNK_SIZE):
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+        except BaseException:
+            os.unlink(fp.name)
+            raise
+
+    artifact = Artifact(digest=hasher.hexdigest(), size=size, media_type=media_type)
+    if _reuse(artifact.digest):
+        os.unlink(fp.name)
+        logger.debug("Artifact %s is already stored.", artifact.digest)
+        return artifact
+    target = path(artifact.digest)
+    if compress:
+        target = f"{target}.gz"
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(fp.name, target)
+    logger.debug("Stored artifact %s with %d bytes.", artifact.digest, size)
+    return artifact
+
+
+def open_artifact(digest: str) -> typing.BinaryIO:
+    """Open the artifact for reading its original, uncompressed, bytes."""
+    location, compressed = _locate(digest)
+    if compressed:
+        return gzip.open(location, "rb")
+    return open(location, "rb")
+
+
+def read(digest: str) -> bytes:
+    with open_artifact(digest) as fp:
+        return fp.read()
+
+
+def remove(digest: str, *, before: typing.Optional[float] = None) -> bool:
+    """Remove the artifact, unless it was stored or reused since before.
+
+    Return whether it is gone.
+    """
+    location, _ = _locate(digest)
+    try:
+        if before is not None and os.stat(location).st_mtime >= before:
+            return False
+        os.unlink(location)
+    except FileNotFoundError:
+        pass
+    return True
@@ -0,0 +1,218 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import contextlib
+import dataclasses
+import datetime
+import glob
+import heapq
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import typing
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+# Merge the segments once there are more of them than this.
+MAX_SEGMENTS = 16
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+# Snapshots are indexed from several threads at once, so adding and merging
+# segments take turns. Readers, in this process or others, need no lock, as
+# segments are immutable.
+_LOCK = threading.Lock()
+
+
+@dataclasses.dataclass(frozen=True)
+class Entry:
+    """Point a capture of url, at timestamp, to its record in a WARC file."""
+
+    url: str
+    timestamp: str
+    filename: str
+    offset: int
+    length: int
+    snapshot_uid: typing.Optional[str] = None
+
+    def to_line(self) -> bytes:
+        fields = dataclasses.asdict(self)
+        del fields["timestamp"]
+        return f"{surt(self.url)} {self.timestamp} {json.dumps(fields)}\n".encode()
+
+    @classmethod
+    def from_line(cls, line: bytes):
+        _, timestamp, fields = line.decode().split(" ", 2)
+        return cls(timestamp=timestamp, **json.loads(fields))
+
+
+def surt(url: str) -> str:
+    """Sort-friendly URI Reordering Transform of url, as in CDXJ indexes.
+
+    For instance, http://www.Example.com:80/a?b=1&a=2 becomes
+    com,example)/a?a=2&b=1 so captures of the same site sort together.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    host = (parts.hostname or "").strip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    key = ",".join(reversed(host.split(".")))
+    if parts.port and parts.port != _DEFAULT_PORTS.get(parts.scheme):
+        key = f"{key}:{parts.port}"
+    query = "&".join(sorted(parts.query.split("&"))) if parts.query else ""
+    path = urllib.parse.quote(parts.path or "/", safe="/%:@!$&'()*+,;=")
+    key = f"{key}){path}"
+    if query:
+        key = f"{key}?{query}"
+    return key.replace(" ", "%20").lower()
+
+
+def timestamp(date: str) -> str:
+    """Turn a WARC-Date into the 14 digits timestamp used by indexes."""
+    parsed = datetime.datetime.fromisoformat(date.replace("Z", "+00:00"))
+    return parsed.strftime("%Y%m%d%H%M%S")
+
+
+def _seconds(timestamp: str) -> float:
+    # A partial timestamp stands for the earliest moment it covers.
+    padded = timestamp + "00000101000000"[len(timestamp) :]
+    moment = datetime.datetime.strptime(padded, "%Y%m%d%H%M%S")
+    return moment.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _bisect(mm: mmap.mmap, key: bytes) -> int:
+    """Offset of the first line not less than key, in a file of sorted lines."""
+    lo, hi = 0, len(mm)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = mm.rfind(b"\n", 0, mid) + 1
+        end = mm.find(b"\n", start)
+        if end == -1:
+            end = len(mm)
+        if mm[start:end] < key:
+            lo = end + 1
+        else:
+            hi = start
+    return lo
+
+
+class Index:
+    """Sorted CDXJ index, kept as a handful of immutable segment files.
+
+    New entries become a new segment, and segments are merged once there
+    are too many of them. Lookups binary search every memory-mapped
+    segment, so they never read more than a few pages of each.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _segments(self) -> typing.List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "*.cdxj")))
+
+    def _write_segment(self, lines: typing.Iterable[bytes]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        name = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d%H%M%S%f")
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=".tmp-", delete=False
+        ) as fp:
+            fp.writelines(lines)
+        path = os.path.join(self.directory, f"{name}-{os.getpid()}.cdxj")
+        os.replace(fp.name, path)
+        return path
+
+    def add(self, entries: typing.Iterable[Entry]) -> None:
+        lines = sorted(entry.to_line() for entry in entries)
+        with _LOCK:
+            if lines:
+                self._write_segment(lines)
+                logger.debug("Added %d entries to the index.", len(lines))
+            if len(self._segments()) > MAX_SEGMENTS:
+                self._compact()
+
+    def compact(self) -> None:
+        """Merge every segment into a single one."""
+        with _LOCK:
+            self._compact()
+
+    def _compact(self) -> None:
+        files = []
+        try:
+            for segment in self._segments():
+                with contextlib.suppress(FileNotFoundError):
+                    files.append(open(segment, "rb"))
+            merged = self._write_segment(heapq.merge(*files))
+        finally:
+            for fp in files:
+                fp.close()
+        for fp in files:
+            if fp.name != merged:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(fp.name)
+        logger.info("Merged %d index segments.", len(files))
+
+    def _open_segments(self) -> typing.List[typing.BinaryIO]:
+        """Open every segment of a single listing.
+
+        Another process may merge segments meanwhile. A merge writes its
+        segment before removing the merged ones, so when a listed segment
+        is gone, listing again finds the merged one.
+        """
+        while True:
+            files = []
+            try:
+                for segment in self._segments():
+                    files.append(open(segment, "rb"))
+            except FileNotFoundError:
+                for fp in files:
+                    fp.close()
+                continue
+            return files
+
+    def listmany(self, url: str) -> typing.List[Entry]:
+        """Every capture of url, from the oldest to the newest."""
+        prefix = f"{surt(url)} ".encode()
+        entries = []
+        with contextlib.ExitStack() as stack:
+            files = [stack.enter_context(fp) for fp in self._open_segments()]
+            for fp in files:
+                if os.fstat(fp.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    position = _bisect(mm, prefix)
+                    while position < len(mm):
+                        end = mm.find(b"\n", position)
+                        line = mm[position : end if end != -1 else len(mm)]
+                        if not line.startswith(prefix):
+                            break
+                        entries.append(Entry.from_line(line))
+                        position = end + 1 if end != -1 else len(mm)
+        return sorted(set(entries), key=lambda entry: entry.timestamp)
+
+    def closest(
+        self, url: str, timestamp: typing.Optional[str] = None
+    ) -> typing.Optional[Entry]:
+        """The capture of url closest to timestamp, or the latest one."""
+        if not (entries := self.listmany(url)):
+            return None
+        if not timestamp:
+            return entries[-1]
+        target = _seconds(timestamp)
+        return min(entries, key=lambda entry: abs(_seconds(entry.timestamp) - target))
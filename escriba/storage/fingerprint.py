@@ -0,0 +1,90 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import hashlib
+import html
+import re
+import typing
+
+# Width of a simhash, which fits a signed INTEGER column once folded.
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+
+_MASK = (1 << SIMHASH_BITS) - 1
+_WIDTH = SIMHASH_BITS // 8
+# The lowest bit of a feature.
+_LOWEST = (1).to_bytes(_WIDTH, "big")
+_INVISIBLE = re.compile(r"<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_TAG = re.compile(r"<[^>]*>")
+_WORD = re.compile(r"\w+")
+
+
+def digest(data: bytes) -> str:
+    """Exact fingerprint, the same one naming artifacts in the store."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def digester() -> "hashlib._Hash":
+    """Hash object computing digest() of data read in chunks."""
+    return hashlib.sha256()
+
+
+def _shingles(words: typing.List[str]) -> typing.Iterator[str]:
+    if len(words) < SHINGLE_SIZE:
+        yield " ".join(words)
+        return
+    for i in range(len(words) - SHINGLE_SIZE + 1):
+        yield " ".join(words[i : i + SHINGLE_SIZE])
+
+
+def simhash(data: bytes) -> typing.Optional[int]:
+    """Near-duplicate fingerprint of the visible text of an HTML document.
+
+    Documents whose text barely changed, like a new date in the footer,
+    get fingerprints differing in a few bits only. The value is folded
+    into a signed 64 bits integer, so SQLite can keep it.
+    """
+    text = _INVISIBLE.sub(" ", data.decode(errors="replace"))
+    text = html.unescape(_TAG.sub(" ", text))
+    words = _WORD.findall(text.lower())
+    if not words:
+        return None
+
+    # Features side by side in one integer, SIMHASH_BITS apart, so a bit is
+    # counted over all of them at once instead of feature by feature.
+    features = b"".join(
+        hashlib.blake2b(shingle.encode(), digest_size=_WIDTH).digest()
+        for shingle in _shingles(words)
+    )
+    count = len(features) // _WIDTH
+    packed = int.from_bytes(features, "big")
+    lowest = int.from_bytes(_LOWEST * count, "big")
+
+    value = 0
+    for bit in range(SIMHASH_BITS):
+        # Set when most features have the bit set.
+        if 2 * (packed >> bit & lowest).bit_count() > count:
+            value |= 1 << bit
+    if value >= 1 << (SIMHASH_BITS - 1):
+        value -= 1 << SIMHASH_BITS
+    return value
+
+
+def distance(a: int, b: int) -> int:
+    """Count the bits in which two simhashes differ."""
+    return ((a ^ b) & _MASK).bit_count()
@@ -0,0 +1,338 @@
+"""
+    This file is part of Escriba.
+
+    Copyright (C) 2022-2023 Fernanda Queiroz <dev@vereda.tec.br>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import dataclasses
+import datetime
+import http.client
+import io
+import logging
+import os
+import socket
+import ssl
+import tempfile
+import typing
+import urllib.parse
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+WARC_VERSION = "WARC/1.1"
+CHUNK_SIZE = 64 * 1024
+# Start a new file once the current one reaches this size, which is what
+# the WARC specification recommends.
+ROTATE_SIZE = 1000 * 1000 * 1000
+# Responses without a Content-Length are spooled to disk beyond this size.
+SPOOL_SIZE = 1024 * 1024
+MAX_LINE = 64 * 1024
+TIMEOUT = 30
+USER_AGENT = "Escriba"
+
+
+@dataclasses.dataclass(frozen=True)
+class Location:
+    """Where a record was written, as a gzip member inside a WARC file."""
+
+    filename: str
+    offset: int
+    length: int
+    record_id: str
+    record_type: str
+    target_uri: typing.Optional[str]
+    date: str
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%S.%fZ"
+    )
+
+
+def _record_id() -> str:
+    return f"<urn:uuid:{uuid.uuid4()}>"
+
+
+class _ShortBlock(OSError):
+    """The block ended before the announced Content-Length."""
+
+
+class Writer:
+    """Append records to rotating WARC files, one gzip member per record.
+
+    Blocks are compressed as they are read, so a record is never held in
+    memory as a whole. A writer is not thread-safe: keep one per task.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        prefix: str = "escriba",
+        rotate_size: int = ROTATE_SIZE,
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.rotate_size = rotate_size
+        self._file = None
+        self._filename = None
+        self._serial = 0
+        # Tell apart files written at the same time by different writers.
+        self._writer_id = uuid.uuid4().hex[:8]
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._serial += 1
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime(
+            "%Y%m%d%H%M%S%f"
+        )
+        self._filename = (
+            f"{self.prefix}-{timestamp}-{self._serial:05d}-{self._writer_id}.warc.gz"
+        )
+        self._file = open(os.path.join(self.directory, self._filename), "ab")
+        logger.info("Writing WARC records to %s.", self._filename)
+
+        info = (
+            "software: Escriba\r\n"
+            "format: WARC File Format 1.1\r\n"
+            "conformsTo: https://iipc.github.io/warc-specifications/"
+            "specifications/warc-format/warc-1.1/\r\n"
+        ).encode()
+        self._write(
+            "warcinfo",
+            {
+                "WARC-Filename": self._filename,
+                "Content-Type": "application/warc-fields",
+            },
+            io.BytesIO(info),
+            len(info),
+        )
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> typing.Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def write_record(
+        self,
+        record_type: str,
+        headers: typing.Dict[str, str],
+        block: typing.BinaryIO,
+        length: int,
+    ) -> Location:
+        """Write a record whose block has exactly length bytes."""
+        if self._file is None or self._file.tell() >= self.rotate_size:
+            self.close()
+            self._open()
+        return self._write(record_type, headers, block, length)
+
+    def _write(
+        self,
+        record_type: str,
+        headers: typing.Dict[str, str],
+        block: typing.BinaryIO,
+        length: int,
+    ) -> Location:
+        headers = {
+            "WARC-Type": record_type,
+            "WARC-Record-ID": headers.get("WARC-Record-ID") or _record_id(),
+            "WARC-Date": headers.get("WARC-Date") or _now(),
+            **headers,
+            "Content-Length": str(length),
+        }
+        header = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+
+        offset = self._file.tell()
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        try:
+            self._file.write(
+                compressor.compress(f"{WARC_VERSION}\r\n{header}\r\n".encode())
+            )
+            remaining = length
+            while remaining:
+                if not (chunk := block.read(min(CHUNK_SIZE, remaining))):
+                    raise _ShortBlock(f"Block ended {remaining} bytes too early.")
+                remaining -= len(chunk)
+                self._file.write(compressor.compress(chunk))
+            self._file.write(compressor.compress(b"\r\n\r\n"))
+            self._file.write(compressor.flush())
+            self._file.flush()
+        except BaseException:
+            # Never leave half a record behind.
+            self._file.truncate(offset)
+            self._file.seek(offset)
+            raise
+
+        return Location(
+            filename=self._filename,
+            offset=offset,
+            length=self._file.tell() - offset,
+            record_id=headers["WARC-Record-ID"],
+            record_type=record_type,
+            target_uri=headers.get("WARC-Target-URI"),
+            date=headers["WARC-Date"],
+        )
+
+
+def _connect(parts: urllib.parse.SplitResult, timeout: float) -> socket.socket:
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    sock = socket.create_connection((parts.hostname, port), timeout=timeout)
+    if parts.scheme == "https":
+        context = ssl.create_default_context()
+        sock = context.wrap_socket(sock, server_hostname=parts.hostname)
+    return sock
+
+
+def _read_head(stream: typing.BinaryIO) -> bytes:
+    """Read the status line and headers, exactly as they came."""
+    lines = []
+    while True:
+        line = stream.readline(MAX_LINE)
+        if not line:
+            raise http.client.RemoteDisconnected("No response from the server.")
+        lines.append(line)
+        if line in (b"\r\n", b"\n"):
+            return b"".join(lines)
+
+
+class _Chain(io.RawIOBase):
+    """Read the bytes already consumed, then the rest of the stream."""
+
+    def __init__(self, head: bytes, stream: typing.BinaryIO):
+        self._head = io.BytesIO(head)
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if count := self._head.readinto(buffer):
+            return count
+        return self._stream.readinto(buffer)
+
+
+def capture(
+    url: str, writer: Writer, *, timeout: float = TIMEOUT
+) -> typing.List[Location]:
+    """Request url and write the response and request records to writer.
+
+    The response is recorded exactly as it was received. When the server
+    announces its length, the body is streamed straight into the record;
+    otherwise it is spooled, to disk once it grows past SPOOL_SIZE.
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise ValueError("Invalid URL scheme")
+
+    target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+    request = (
+        f"GET {target} HTTP/1.1\r\n"
+        f"Host: {parts.netloc.rpartition('@')[2]}\r\n"
+        f"User-Agent: {USER_AGENT}\r\n"
+        "Accept: */*\r\n"
+        "Accept-Encoding: gzip, deflate\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+    ).encode()
+
+    date = _now()
+    with _connect(parts, timeout) as sock:
+        ip_address = sock.getpeername()[0]
+        sock.sendall(request)
+        with sock.makefile("rb") as stream:
+            head = _read_head(stream)
+            headers = http.client.parse_headers(io.BytesIO(head.partition(b"\n")[2]))
+            common = {
+                "WARC-Date": date,
+                "WARC-Target-URI": url,
+                "WARC-IP-Address": ip_address,
+            }
+            response_headers = {
+                **common,
+                "Content-Type": "application/http; msgtype=response",
+            }
+
+            content_length = headers.get("Content-Length")
+            if content_length and not headers.get("Transfer-Encoding"):
+                block = io.BufferedReader(_Chain(head, stream))
+                response = writer.write_record(
+                    "response",
+                    response_headers,
+                    block,
+                    len(head) + int(content_length),
+                )
+            else:
+                with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+                    spool.write(head)
+                    while chunk := stream.read(CHUNK_SIZE):
+                        spool.write(chunk)
+                    length = spool.tell()
+                    spool.seek(0)
+                    response = writer.write_record(
+                        "response", response_headers, spool, length
+                    )
+
+    request_record = writer.write_record(
+        "request",
+        {
+            **common,
+            "Content-Type": "application/http; msgtype=request",
+            "WARC-Concurrent-To": response.record_id,
+        },
+        io.BytesIO(request),
+        len(request),
+    )
+    return [response, request_record]
+
+
+class _Socket:
+    """Just enough of a socket for http.client to parse a recorded response."""
+
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def makefile(self, *_, **__) -> typing.BinaryIO:
+        return io.BytesIO(self._data)
+
+
+def read_record(
+    filename: str, offset: int, length: int, *, directory: str
+) -> typing.Tuple[http.client.HTTPMessage, bytes]:
+    """Read exactly one record and return its WARC headers and block."""
+    with open(os.path.join(directory, os.path.basename(filename)), "rb") as fp:
+        fp.seek(offset)
+        member = fp.read(length)
+    record = zlib.decompress(member, wbits=16 + zlib.MAX_WBITS)
+    head, _, rest = record.partition(b"\r\n\r\n")
+    headers = http.client.parse_headers(
+        io.BytesIO(head.partition(b"\n")[2] + b"\r\n\r\n")
+    )
+    block = rest[: int(headers["Content-Length"])]
+    return headers, block
+
+
+def parse_response(block: bytes) -> http.client.HTTPResponse:
+    """Parse the block of a response record, undoing any chunked encoding."""
+    response = http.client.HTTPResponse(_Socket(block))
+    response.begin()
+    return response